@@ -0,0 +1,62 @@
+"""Архив заказов.
+
+Доставленные и отмененные заказы старше ORDER_ARCHIVE_DAYS дней вместе с
+позициями переезжают из orders и order_items в orders_archive и
+order_items_archive той же базы, так что горячие таблицы и их индексы
+остаются маленькими. Перенос идет пачками по ORDER_ARCHIVE_BATCH заказов:
+каждая пачка — короткая транзакция, а между пачками писатель свободен для
+обработчиков. Статистика магазина при переносе не меняется, история
+заказов заходит в архив, только когда ее листают дальше горизонта
+(database._orders_page).
+"""
+import asyncio
+import logging
+import time
+
+import database as db
+from config import ORDER_ARCHIVE_BATCH, ORDER_ARCHIVE_DAYS, ORDER_ARCHIVE_INTERVAL, ORDER_ARCHIVE_PAUSE
+
+logger = logging.getLogger(__name__)
+
+_task = None
+
+
+async def archive_orders(days: float = ORDER_ARCHIVE_DAYS, batch: int = ORDER_ARCHIVE_BATCH,
+                         pause: float = ORDER_ARCHIVE_PAUSE):
+    """Переносит в архив все подходящие заказы; возвращает их число."""
+    started = time.monotonic()
+    horizon = db.archive_horizon(days)
+    total = 0
+    while True:
+        moved = await db.archive_orders_batch(horizon, batch)
+        total += moved
+        if moved < batch:
+            break
+        await asyncio.sleep(pause)
+    if total:
+        logger.info('В архив перенесено заказов: %s за %.1f с', total, time.monotonic() - started)
+    return total
+
+
+async def _loop():
+    while True:
+        try:
+            await archive_orders()
+        except Exception:
+            logger.exception('Не удалось перенести заказы в архив')
+        await asyncio.sleep(ORDER_ARCHIVE_INTERVAL)
+
+
+def start():
+    global _task
+    if ORDER_ARCHIVE_INTERVAL and _task is None:
+        _task = asyncio.create_task(_loop())
+
+
+async def stop():
+    # Прерванная пачка откатывается целиком и перенесется в следующий раз
+    global _task
+    if _task:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,124 @@
+"""Стоимость разбора одного callback-запроса: цепочка фильтров против роутера.
+
+Старая схема — фильтры F.data.startswith(...) / F.data == ... в порядке
+регистрации и разбор id через split('_'). Новая — поиск префикса в
+словаре CallbackRouter и распаковка типизированной схемы.
+
+    python -m benchmarks.callback_dispatch --rounds 20000
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+from aiogram import F
+
+import callbacks as cb
+
+
+def _ids(position):
+    return lambda data: int(data.split('_')[position])
+
+def _nothing(data):
+    return None
+
+def _tail(data):
+    return data.split('_')[1:]
+
+# Фильтры в том порядке, в каком они были зарегистрированы в main.py
+LEGACY_CHAIN = [
+    (F.data.startswith('orders_'), _tail),
+    (F.data.startswith('category_'), _ids(1)),
+    (F.data.startswith('catpage_'), _tail),
+    (F.data.startswith('product_'), _ids(1)),
+    (F.data.startswith('add_to_cart_'), _ids(3)),
+    (F.data == 'back_to_categories', _nothing),
+    (F.data.startswith('back_to_cart'), _nothing),
+    (F.data == 'checkout', _nothing),
+    (F.data == 'confirm_order', _nothing),
+    (F.data.startswith('edit_cart_'), _ids(2)),
+    (F.data.startswith('increase_'), _ids(1)),
+    (F.data.startswith('decrease_'), _ids(1)),
+    (F.data == 'clear_cart', _nothing),
+    (F.data.startswith('delete_'), _ids(1)),
+    (F.data == 'back_to_main', _nothing),
+    (F.data == 'back_to_products', _nothing),
+    (F.data.startswith('remove_from_cart_'), _ids(3)),
+    (F.data == 'back_to_profile', _nothing),
+    (F.data == 'edit_profile', _nothing),
+    (F.data == 'admin_stats', _nothing),
+    (F.data == 'admin_add_product', _nothing),
+    (F.data == 'admin_add_category', _nothing),
+    (F.data.startswith('admin_select_category_'), _ids(3)),
+    (F.data == 'admin_cancel', _nothing),
+    (F.data == 'admin_orders', _nothing),
+    (F.data.startswith('admin_orders_'), _tail),
+]
+
+# Одни и те же нажатия в старом и новом формате
+WORKLOAD = [
+    ('category_3', cb.Category(category_id=3)),
+    ('catpage_3_price_f_120', cb.Category(category_id=3, sort='price', cursor=120)),
+    ('product_42', cb.Product(product_id=42)),
+    ('add_to_cart_42', cb.AddToCart(product_id=42)),
+    ('back_to_cart', cb.Cart()),
+    ('edit_cart_7', cb.EditCartItem(item_id=7)),
+    ('increase_7', cb.CartQuantity(item_id=7, delta=1)),
+    ('decrease_7', cb.CartQuantity(item_id=7, delta=-1)),
+    ('delete_7', cb.DeleteCartItem(item_id=7)),
+    ('back_to_categories', cb.Categories()),
+    ('back_to_main', cb.MainMenu()),
+    ('orders_n_1500', cb.Orders(newer=True, cursor=1500)),
+    ('edit_profile', cb.EditProfile()),
+    ('admin_select_category_3', cb.AdminSelectCategory(category_id=3)),
+    ('admin_orders_new_o_1500', cb.AdminOrdersPage(status='new', cursor=1500)),
+]
+
+
+def legacy_resolve(callback):
+    for magic, parse in LEGACY_CHAIN:
+        if magic.resolve(callback):
+            return parse, parse(callback.data)
+    return None
+
+
+def build_router():
+    router = cb.CallbackRouter()
+    schemas = {type(packed) for _, packed in WORKLOAD}
+    for schema in schemas:
+        async def handler(callback, callback_data):
+            return callback_data
+        router(schema)(handler)
+    return router
+
+
+def _measure(resolve, callbacks, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for callback in callbacks:
+            resolve(callback)
+    return (time.perf_counter() - started) / (rounds * len(callbacks)) * 1e9
+
+
+def run(rounds: int):
+    router = build_router()
+    legacy = [SimpleNamespace(data=old) for old, _ in WORKLOAD]
+    packed = [packed.pack() for _, packed in WORKLOAD]
+
+    for callback, data in zip(legacy, packed):
+        assert legacy_resolve(callback) is not None, callback.data
+        assert router.resolve(data) is not None, data
+
+    old_ns = _measure(legacy_resolve, legacy, rounds)
+    new_ns = _measure(router.resolve, packed, rounds)
+    old_bytes = sum(len(callback.data.encode()) for callback in legacy) / len(legacy)
+    new_bytes = sum(len(data.encode()) for data in packed) / len(packed)
+
+    print(f'Цепочка фильтров: {old_ns:8.0f} нс на callback, {old_bytes:.1f} байт на кнопку')
+    print(f'CallbackRouter:   {new_ns:8.0f} нс на callback, {new_bytes:.1f} байт на кнопку')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+    run(args.rounds)
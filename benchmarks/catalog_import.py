@@ -0,0 +1,116 @@
+"""Скорость массового импорта каталога.
+
+Генерирует файл на --rows товаров (с артикулами, по --categories
+категориям, часть строк с ошибками), загружает его в пустую базу, затем
+повторно (все строки — обновления) и выгружает обратно. Для сравнения
+--baseline строк добавляются по одной через add_product, как в диалоге
+админа.
+
+    python -m benchmarks.catalog_import --rows 100000 --format csv
+"""
+import argparse
+import asyncio
+import csv
+import json
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import catalog_io
+import database as db
+
+# Каждая BAD_EVERY-я строка — с неверной ценой
+BAD_EVERY = 1000
+
+
+def _rows(count: int, categories: int):
+    for n in range(count):
+        yield {
+            'sku': f'SKU-{n:07d}',
+            'category': f'Категория {n % categories}',
+            'name': f'Товар {n}',
+            'description': f'Описание товара {n}, ' + 'подробности; ' * 5,
+            'price': 'n/a' if n % BAD_EVERY == BAD_EVERY - 1 else f'{100 + n % 900}.99',
+            'stock': n % 50,
+            'image_path': '',
+        }
+
+
+def write_file(path: str, fmt: str, count: int, categories: int):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            writer = csv.DictWriter(file, fieldnames=catalog_io.COLUMNS)
+            writer.writeheader()
+            writer.writerows(_rows(count, categories))
+        else:
+            for row in _rows(count, categories):
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _import(path, fmt, workdir):
+    started = time.perf_counter()
+    report = await catalog_io.import_catalog(path, fmt, str(workdir / 'errors.csv'))
+    return report, time.perf_counter() - started
+
+
+async def run(rows: int, fmt: str, categories: int, baseline: int):
+    workdir = Path(tempfile.mkdtemp())
+    db_path = workdir / 'shop.db'
+    source = str(workdir / f'catalog.{fmt}')
+    write_file(source, fmt, rows, categories)
+    size = Path(source).stat().st_size / 1024 / 1024
+    print(f'Файл: {rows} строк, {size:.1f} МБ, {fmt}')
+
+    db.pool = db.ConnectionPool(db_path)
+    await db.init_db()
+    try:
+        rss = _max_rss_mb()
+        report, elapsed = await _import(source, fmt, workdir)
+        print(f'Импорт:    {report.imported} загружено, {report.failed} с ошибками, '
+              f'{report.categories} категорий за {elapsed:.2f} с ({report.imported / elapsed:.0f} строк/с), '
+              f'пик памяти +{_max_rss_mb() - rss:.0f} МБ')
+
+        report, elapsed = await _import(source, fmt, workdir)
+        print(f'Повторно:  {report.imported} обновлено за {elapsed:.2f} с ({report.imported / elapsed:.0f} строк/с)')
+
+        started = time.perf_counter()
+        exported = await catalog_io.export_catalog(str(workdir / f'export.{fmt}'), fmt)
+        elapsed = time.perf_counter() - started
+        print(f'Экспорт:   {exported} строк за {elapsed:.2f} с ({exported / elapsed:.0f} строк/с)')
+
+        if baseline:
+            started = time.perf_counter()
+            for n in range(baseline):
+                await db.add_product(1, f'Поштучно {n}', '', 100.0, 1)
+            elapsed = time.perf_counter() - started
+            print(f'Поштучно:  {baseline} через add_product за {elapsed:.2f} с ({baseline / elapsed:.0f} строк/с)')
+    finally:
+        await db.close_db()
+
+    expected = rows - rows // BAD_EVERY
+    with sqlite3.connect(db_path) as conn:
+        stored = conn.execute('SELECT COUNT(*) FROM products WHERE sku IS NOT NULL').fetchone()[0]
+        found = conn.execute(
+            "SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH 'Товар'"
+        ).fetchone()[0]
+    ok = stored == exported == expected and found >= expected
+    if not ok:
+        print(f'ОШИБКА: ожидалось {expected} товаров, в базе {stored}, выгружено {exported}, в поиске {found}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--format', choices=('csv', 'json'), default='csv')
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--baseline', type=int, default=2000)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.rows, args.format, args.categories, args.baseline)) else 1)
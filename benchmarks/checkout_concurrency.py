@@ -0,0 +1,85 @@
+"""Параллельные оформления заказа против ограниченного остатка.
+
+Несколько процессов (каждый со своим пулом соединений, как отдельные
+экземпляры бота) одновременно оформляют заказы на один товар. Проверяем,
+что продано ровно столько, сколько было на складе, а остальные покупатели
+получили OutOfStockError.
+
+    python -m benchmarks.checkout_concurrency --stock 25 --buyers 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import database as db
+
+PRODUCT_ID = 1
+
+
+async def _prepare(path, stock, buyers):
+    db.pool = db.ConnectionPool(path)
+    await db.init_db()
+    await db.add_category('Распродажа')
+    await db.add_product(1, 'Товар дня', '', 100.0, stock)
+    for user_id in range(1, buyers + 1):
+        await db.get_or_create_user(user_id)
+        await db.add_to_cart(user_id, PRODUCT_ID)
+    await db.close_db()
+
+
+async def _checkout(path, user_ids):
+    db.pool = db.ConnectionPool(path, readers=1)
+    await db.init_db()
+
+    async def one(user_id):
+        try:
+            return await db.create_order(user_id, '79990000000', 'Адрес')
+        except db.OutOfStockError:
+            return None
+
+    try:
+        results = await asyncio.gather(*(one(user_id) for user_id in user_ids))
+    finally:
+        await db.close_db()
+    return sum(1 for order_id in results if order_id)
+
+
+def _worker(args):
+    return asyncio.run(_checkout(*args))
+
+
+def run(stock: int, buyers: int, processes: int):
+    path = str(Path(tempfile.mkdtemp()) / 'shop.db')
+    asyncio.run(_prepare(path, stock, buyers))
+
+    shards = [list(range(n + 1, buyers + 1, processes)) for n in range(processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as workers:
+        sold = sum(workers.map(_worker, [(path, shard) for shard in shards]))
+    elapsed = time.perf_counter() - started
+
+    with sqlite3.connect(path) as conn:
+        left = conn.execute('SELECT stock FROM products WHERE id = ?', (PRODUCT_ID,)).fetchone()[0]
+        orders = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+        items = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM order_items').fetchone()[0]
+
+    print(f'Оформлено {sold} из {buyers} за {elapsed:.2f} с, остаток {left}')
+    expected = min(stock, buyers)
+    ok = sold == orders == items == expected and left == stock - expected
+    if not ok:
+        print(f'ОШИБКА: ожидалось {expected} заказов, в базе {orders}, позиций {items}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stock', type=int, default=25)
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.stock, args.buyers, args.processes) else 1)
@@ -0,0 +1,65 @@
+"""Сессия Bot API без сети для замеров.
+
+Запоминает, какие методы вызывал бот, и отвечает правдоподобными
+заглушками: отправка сообщения возвращает Message, остальное — True.
+Загруженные фото получают file_id вида fake-photo-N; uploads считает
+загрузки файлов.
+latency имитирует время ответа Telegram.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, InputFile, Message, PhotoSize, User
+
+BOT_USER = User(id=1, is_bot=True, first_name='Shop bot', username='shop_bot')
+
+# Токен подходящего формата: в сеть с ним ничего не уходит
+FAKE_TOKEN = '1:' + 'A' * 35
+
+
+class FakeTelegramSession(BaseSession):
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.uploads = 0
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(method)
+
+    def _result(self, method):
+        if method.__returning__ is Message:
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'),
+                from_user=BOT_USER,
+                text=getattr(method, 'text', None),
+                caption=getattr(method, 'caption', None),
+                photo=self._photo(getattr(method, 'photo', None))
+            )
+        if method.__returning__ is User:
+            return BOT_USER
+        return True
+
+    def _photo(self, photo):
+        if photo is None:
+            return None
+        if isinstance(photo, InputFile):
+            self.uploads += 1
+            photo = f'fake-photo-{self.uploads}'
+        return [PhotoSize(file_id=photo, file_unique_id=photo, width=800, height=800)]
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
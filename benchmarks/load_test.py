@@ -0,0 +1,304 @@
+"""Сквозной нагрузочный тест бота без сети.
+
+Заполняет временную shop.db, строит синтетические обновления по
+сценариям (каталог, карточка товара, корзина, ➕/➖, оформление заказа,
+статистика админа) и пропускает их через dp.feed_update с
+FakeTelegramSession. По каждому сценарию считает обновлений в секунду,
+p50/p95/p99 задержки, SQL-запросов и вызовов Bot API на обновление.
+Очередь RequestScheduler не используется: замеряется сам бот.
+
+    python -m benchmarks.load_test --users 200 --iterations 5 --output run.json
+    python -m benchmarks.load_test --scenarios checkout --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import config
+import callbacks as cb
+import database as db
+from benchmarks.fake_session import FAKE_TOKEN, FakeTelegramSession
+from benchmarks.workload import (
+    callback_update,
+    message_update,
+    seed_orders,
+    seed_shop,
+    seed_users,
+)
+
+
+class Shop:
+    """Размеры тестового магазина; сценарии берут из него id товаров."""
+
+    def __init__(self, categories: int, products: int):
+        self.categories = categories
+        self.products = products
+
+    def product(self, user_id: int):
+        product_id = user_id % (self.categories * self.products) + 1
+        return product_id, (product_id - 1) // self.products + 1
+
+
+# СЦЕНАРИИ
+# Сценарий — одна итерация пользователя: список сырых обновлений
+def browse(shop, user_id, cart_item):
+    _, category_id = shop.product(user_id)
+    return [
+        message_update(user_id, 'Каталог'),
+        callback_update(user_id, cb.Category(category_id=category_id)),
+        callback_update(user_id, cb.Category(category_id=category_id, sort='price')),
+        callback_update(user_id, cb.Categories()),
+    ]
+
+
+def product(shop, user_id, cart_item):
+    product_id, _ = shop.product(user_id)
+    return [callback_update(user_id, cb.Product(product_id=product_id))]
+
+
+def add_to_cart(shop, user_id, cart_item):
+    product_id, _ = shop.product(user_id)
+    return [
+        callback_update(user_id, cb.AddToCart(product_id=product_id)),
+        message_update(user_id, '🛒 Корзина'),
+    ]
+
+
+def quantity(shop, user_id, cart_item):
+    return [
+        callback_update(user_id, cb.EditCartItem(item_id=cart_item)),
+        callback_update(user_id, cb.CartQuantity(item_id=cart_item, delta=1)),
+        callback_update(user_id, cb.CartQuantity(item_id=cart_item, delta=1)),
+        callback_update(user_id, cb.CartQuantity(item_id=cart_item, delta=-1)),
+    ]
+
+
+def checkout(shop, user_id, cart_item):
+    product_id, _ = shop.product(user_id)
+    return [
+        callback_update(user_id, cb.AddToCart(product_id=product_id)),
+        callback_update(user_id, cb.Checkout()),
+        callback_update(user_id, cb.ConfirmOrder()),
+    ]
+
+
+def admin_stats(shop, user_id, cart_item):
+    return [callback_update(user_id, cb.AdminStats())]
+
+
+SCENARIOS = {
+    'browse': browse,
+    'product': product,
+    'add_to_cart': add_to_cart,
+    'quantity': quantity,
+    'checkout': checkout,
+    'admin_stats': admin_stats,
+}
+
+
+# ЗАМЕР
+class StatementCounter:
+    """Считает SQL-запросы на всех соединениях пула через trace callback.
+
+    У каждого соединения свой поток aiosqlite, поэтому и счетчик свой.
+    Запросы внутри триггеров (-- TRIGGER ...) не считаются.
+    """
+
+    def __init__(self):
+        self._counts = []
+
+    async def attach(self, connections):
+        for conn in connections:
+            counter = [0]
+            self._counts.append(counter)
+            await conn.set_trace_callback(lambda sql, counter=counter: self._count(counter, sql))
+
+    @staticmethod
+    def _count(counter, sql):
+        if not sql.startswith('--'):
+            counter[0] += 1
+
+    @property
+    def total(self):
+        return sum(counter[0] for counter in self._counts)
+
+
+def percentile(sorted_values, share):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * share))]
+
+
+async def run_scenario(main, session, statements, name, shop, users, iterations, concurrency, first_user):
+    from aiogram.methods import TelegramMethod
+    from aiogram.types import Update
+
+    bot, dp = main.bot, main.dp
+    cart_items = {}
+    if name == 'quantity':
+        for user_id in range(first_user, first_user + users):
+            await db.add_to_cart(user_id, shop.product(user_id)[0])
+            cart_items[user_id] = (await db.get_cart_snapshot(user_id)).lines[0].id
+    if name == 'admin_stats':
+        main.ID_ADMIN.extend(range(first_user, first_user + users))
+
+    # Update собираются заранее: разбор JSON в модели в замер не входит
+    by_user = [
+        [
+            Update.model_validate(raw, context={'bot': bot})
+            for _ in range(iterations)
+            for raw in SCENARIOS[name](shop, user_id, cart_items.get(user_id))
+        ]
+        for user_id in range(first_user, first_user + users)
+    ]
+
+    latencies = []
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def user_session(updates):
+        nonlocal errors
+        async with gate:
+            for update in updates:
+                started = time.perf_counter()
+                try:
+                    result = await dp.feed_update(bot, update)
+                    if isinstance(result, TelegramMethod):
+                        # Как при polling: метод, который вернул обработчик, отправляется
+                        await dp.silent_call_request(bot, result)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+    calls_before = sum(session.calls.values())
+    statements_before = statements.total
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(updates) for updates in by_user))
+    elapsed = time.perf_counter() - started
+    await main.cart_writes.flush_all()
+
+    count = len(latencies)
+    latencies.sort()
+    return {
+        'updates': count,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(count / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'sql_per_update': round((statements.total - statements_before) / count, 2),
+        'api_calls_per_update': round((sum(session.calls.values()) - calls_before) / count, 2),
+        'errors': errors,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    path = Path(tempfile.mkdtemp()) / 'shop.db'
+    db.pool = db.ConnectionPool(str(path))
+    await db.init_db()
+    await seed_shop(args.categories, args.products, stock=10 ** 9)
+    # Пользователи сценариев не пересекаются: у каждого свой диапазон id
+    await seed_users(args.users * len(SCENARIOS))
+    await seed_orders(args.orders, args.users, args.categories * args.products)
+
+    # main создает Bot при импорте: токен подменяется до импорта,
+    # сессия — сразу после, так что в сеть ничего не уходит
+    config.BOT_TOKEN = FAKE_TOKEN
+    import main
+    session = FakeTelegramSession(args.latency)
+    main.bot.session = session
+    main.setup_fsm_storage()
+
+    statements = StatementCounter()
+    await statements.attach(db.pool.connections)
+
+    shop = Shop(args.categories, args.products)
+    results = {}
+    try:
+        for index, name in enumerate(args.scenarios):
+            first_user = 1000 + index * args.users
+            results[name] = await run_scenario(
+                main, session, statements, name, shop,
+                args.users, args.iterations, args.concurrency, first_user
+            )
+            print(_row(name, results[name]))
+    finally:
+        await db.close_db()
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'params': {
+            key: getattr(args, key)
+            for key in ('categories', 'products', 'users', 'orders', 'iterations', 'concurrency', 'latency')
+        },
+        'scenarios': results,
+    }
+
+
+def _row(name, result):
+    return (
+        f'{name:<12} {result["updates"]:>6} обн. {result["updates_per_sec"]:>8.1f}/с  '
+        f'p50 {result["p50_ms"]:>7.2f}  p95 {result["p95_ms"]:>7.2f}  p99 {result["p99_ms"]:>7.2f} мс  '
+        f'SQL {result["sql_per_update"]:>5.1f}  API {result["api_calls_per_update"]:>4.1f}'
+        + (f'  ошибок {result["errors"]}' if result['errors'] else '')
+    )
+
+
+def compare(previous, current):
+    print(f'\nСравнение с запуском {previous.get("started_at")} ({previous.get("commit")}):')
+    for name, result in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = [
+            f'{key} {before[key]} → {result[key]} ({(result[key] - before[key]) / before[key] * 100:+.0f}%)'
+            for key in ('updates_per_sec', 'p95_ms', 'sql_per_update')
+            if before.get(key)
+        ]
+        print(f'{name:<12} ' + ', '.join(changes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--products', type=int, default=200, help='товаров в категории')
+    parser.add_argument('--users', type=int, default=100, help='пользователей на сценарий')
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=5, help='повторов сценария на пользователя')
+    parser.add_argument('--concurrency', type=int, default=20, help='пользователей одновременно')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f'Результаты: {args.output}')
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding='utf-8')), report)
+    errors = sum(result['errors'] for result in report['scenarios'].values())
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,154 @@
+"""Перенос заказов в архив и история заказов поверх архива.
+
+Заполняет временную базу заказами за последний год, запоминает историю
+нескольких покупателей и админские списки (все и по статусам), затем
+переносит в архив заказы старше --days дней. Пока идет перенос, отдельная
+задача пишет в корзину и замеряет, сколько запись ждет писателя. После
+переноса статистика магазина должна совпасть, а списки — пролистываться
+вперед и назад в том же порядке. Страницы новее горизонта не должны
+сливать orders с архивом, как и короткая история покупателя.
+
+    python -m benchmarks.order_archive --orders 100000 --batch 200
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import archive
+import database as db
+from benchmarks.workload import STATUSES, seed_orders, seed_shop, seed_users
+
+# Сколько покупателей с самой длинной историей пролистать
+CHECKED_USERS = 5
+
+
+@contextmanager
+def _count_pages():
+    """Считает запросы страниц: к одной таблице (1 часть) и слиянием (2)."""
+    spans = {1: 0, 2: 0}
+    keyset_page = db._keyset_page
+
+    async def counted(*args, parts=1, **kwargs):
+        spans[parts] += 1
+        return await keyset_page(*args, parts=parts, **kwargs)
+
+    db._keyset_page = counted
+    try:
+        yield spans
+    finally:
+        db._keyset_page = keyset_page
+
+
+async def _walk(fetch):
+    """Пролистывает список вперед до конца и назад до начала; возвращает
+    id заказов в обоих порядках и число запросов без архива и с ним."""
+    with _count_pages() as spans:
+        pages = [await fetch(None, False)]
+        while pages[-1].has_next:
+            pages.append(await fetch(pages[-1].rows[-1][0], False))
+        forward = [row[0] for page in pages for row in page.rows]
+
+        back = pages[-1]
+        backward = [row[0] for row in reversed(back.rows)]
+        while back.has_prev:
+            back = await fetch(back.rows[0][0], True)
+            backward.extend(row[0] for row in reversed(back.rows))
+    # Первая страница читается целиком и пересекается с предыдущей
+    backward = list(dict.fromkeys(backward))[::-1]
+    return forward, backward, spans[1], spans[2]
+
+
+def _lists(users):
+    lists = {'все заказы': lambda cursor, newer: db.get_all_orders(cursor, newer)}
+    for status in STATUSES:
+        lists[f'статус {status}'] = (
+            lambda cursor, newer, status=status: db.get_all_orders(cursor, newer, status)
+        )
+    for user_id in users:
+        lists[f'покупатель {user_id}'] = (
+            lambda cursor, newer, user_id=user_id: db.get_user_orders(user_id, cursor, newer)
+        )
+    return lists
+
+
+async def _probe(stop, waits):
+    # Короткие записи обработчиков, пока идет перенос
+    while not stop.is_set():
+        started = time.perf_counter()
+        await db.add_to_cart(1000, 1)
+        await db.remove_from_cart(1000, 1)
+        waits.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def run(orders: int, users: int, days: float, batch: int, pause: float):
+    db.pool = db.ConnectionPool(str(Path(tempfile.mkdtemp()) / 'shop.db'))
+    await db.init_db()
+    ok = True
+    try:
+        await seed_shop(5, 40)
+        await seed_users(users)
+        await seed_orders(orders, users, 200)
+        async with db.pool.reader() as conn:
+            top = await conn.execute_fetchall(
+                'SELECT user_id FROM orders GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT ?',
+                (CHECKED_USERS,)
+            )
+        lists = _lists([user_id for user_id, in top])
+        stats = await db.get_shop_stats(days=400)
+        before = {name: (await _walk(fetch))[0] for name, fetch in lists.items()}
+
+        stop = asyncio.Event()
+        waits = []
+        probe = asyncio.create_task(_probe(stop, waits))
+        started = time.perf_counter()
+        moved = await archive.archive_orders(days, batch, pause)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe
+        waits.sort()
+        print(f'В архив: {moved} из {orders} заказов за {elapsed:.2f} с пачками по {batch}')
+        print(f'Запись в корзину во время переноса: {len(waits)} раз, '
+              f'p50 {waits[len(waits) // 2] * 1000:.1f} мс, '
+              f'p99 {waits[int(len(waits) * 0.99)] * 1000:.1f} мс, max {waits[-1] * 1000:.1f} мс')
+
+        if await db.get_shop_stats(days=400) != stats:
+            print('ОШИБКА: статистика магазина изменилась после переноса')
+            ok = False
+        if not moved:
+            print('ОШИБКА: в архив ничего не перенесено')
+            ok = False
+
+        for name, fetch in lists.items():
+            forward, backward, hot_only, spanning = await _walk(fetch)
+            print(f'{name:>22}: {len(forward):>6} заказов, запросов к одной таблице {hot_only}, слиянием {spanning}')
+            if forward != before[name] or backward != before[name]:
+                print(f'ОШИБКА: список «{name}» изменился после переноса')
+                ok = False
+
+        # Первая страница всех заказов — внутри горизонта, а история без
+        # старых заказов в orders дочитывается из архива без слияния
+        with _count_pages() as spans:
+            await db.get_all_orders()
+            await db.get_user_orders(1)
+        if spans[2]:
+            print('ОШИБКА: страница новее горизонта сливает orders с архивом')
+            ok = False
+    finally:
+        await db.close_db()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=50_000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--days', type=float, default=90, help='переносить заказы старше стольких дней')
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.01, help='пауза между пачками, секунды')
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.orders, args.users, args.days, args.batch, args.pause)) else 1)
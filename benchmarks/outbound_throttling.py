@@ -0,0 +1,82 @@
+"""Очередь исходящих запросов: рассылка и ответы на нажатия одновременно.
+
+Через RequestScheduler и FakeTelegramSession идут bulk-рассылка по многим
+чатам и поток answerCallbackQuery. Один запрос получает flood control.
+Проверяем, что общий лимит соблюден, а ответы на нажатия не ждут рассылку.
+
+    python -m benchmarks.outbound_throttling --bulk 300 --interactive 60
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+import throttling
+from benchmarks.fake_session import FAKE_TOKEN, FakeTelegramSession
+
+
+class FloodSession(FakeTelegramSession):
+    """Отвечает flood control на запрос номер flood_at."""
+
+    def __init__(self, flood_at: int, retry_after: int = 1):
+        super().__init__()
+        self.flood_at = flood_at
+        self.retry_after = retry_after
+        self.sent_at = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.sent_at.append(time.monotonic())
+        if len(self.sent_at) == self.flood_at:
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=self.retry_after)
+        return await super().make_request(bot, method, timeout)
+
+
+async def run(bulk_count: int, interactive_count: int, rate: float):
+    session = FloodSession(flood_at=bulk_count // 2)
+    scheduler = throttling.RequestScheduler(rate=rate, burst=rate)
+    session.middleware(scheduler)
+    bot = Bot(FAKE_TOKEN, session=session)
+
+    async def broadcast():
+        with throttling.bulk():
+            await asyncio.gather(*(
+                bot(SendMessage(chat_id=chat_id, text='Новинки недели'))
+                for chat_id in range(1, bulk_count + 1)
+            ))
+
+    async def clicks():
+        waits = []
+        for n in range(interactive_count):
+            await asyncio.sleep(bulk_count / rate / interactive_count)
+            started = time.monotonic()
+            await bot(AnswerCallbackQuery(callback_query_id=str(n)))
+            waits.append(time.monotonic() - started)
+        return waits
+
+    started = time.monotonic()
+    _, waits = await asyncio.gather(broadcast(), clicks())
+    elapsed = time.monotonic() - started
+
+    sent = session.sent_at
+    # Самое плотное окно в одну секунду (после начального всплеска burst)
+    peak = max(sum(1 for t in sent if start <= t < start + 1) for start in sent)
+    stats = scheduler.stats()
+    print(f'Запросов: {len(sent)} за {elapsed:.1f} с, пик {peak} в секунду при лимите {rate:.0f} (+всплеск)')
+    print(
+        f'Ответы на нажатия: среднее ожидание {sum(waits) / len(waits) * 1000:.1f} мс, '
+        f'максимум {max(waits) * 1000:.1f} мс'
+    )
+    print(f'Рассылка: среднее ожидание {stats["bulk"]["avg_wait"]:.2f} с, flood control: {stats["retry_after"]}')
+    return len(sent) == bulk_count + interactive_count + 1 and peak <= 2 * rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bulk', type=int, default=300)
+    parser.add_argument('--interactive', type=int, default=60)
+    parser.add_argument('--rate', type=float, default=30)
+    args = parser.parse_args()
+    raise SystemExit(0 if asyncio.run(run(args.bulk, args.interactive, args.rate)) else 1)
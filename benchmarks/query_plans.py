@@ -0,0 +1,98 @@
+"""Планы всех запросов из queries.py на заполненной базе.
+
+Заполняет временную shop.db (каталог, пользователи, заказы), для каждого
+запроса реестра выполняет EXPLAIN QUERY PLAN и печатает план. Падает,
+если запрос горячего пути (hot=True) читает таблицу целиком (SCAN) или
+сортирует без индекса (USE TEMP B-TREE), а в его scans это не разрешено.
+Таблицы FTS5 и json_each (VIRTUAL TABLE) не проверяются, как и проход по
+результату подзапроса (SCAN (subquery-N)): планы самих подзапросов
+проверяются своими строками.
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --verbose
+"""
+import argparse
+import asyncio
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import database as db
+import queries
+from benchmarks.workload import seed_orders, seed_shop, seed_users
+
+
+async def seed(path, categories, products, users, orders):
+    db.pool = db.ConnectionPool(str(path))
+    await db.init_db()
+    try:
+        await seed_shop(categories, products)
+        await seed_users(users)
+        await seed_orders(orders, users, categories * products)
+        # Статистика для планировщика — как на живой базе после ANALYZE
+        async with db.pool.writer() as conn:
+            await conn.execute('ANALYZE')
+    finally:
+        await db.close_db()
+
+
+def plan(conn, query):
+    if query.requires:
+        conn.execute(query.requires.sql)
+    rows = conn.execute(f'EXPLAIN QUERY PLAN {query.sql}', [None] * query.sql.count('?')).fetchall()
+    return [detail for _, _, _, detail in rows]
+
+
+def violations(query, details):
+    """Полные проходы и сортировки без индекса, которые запросу не разрешены."""
+    found = []
+    for detail in details:
+        if 'VIRTUAL TABLE' in detail or 'CONSTANT ROW' in detail or detail.startswith('SCAN (subquery-'):
+            continue
+        if detail.startswith('SCAN '):
+            scan = detail[len('SCAN '):]
+            if scan not in query.scans and scan.split()[0] not in query.scans:
+                found.append(detail)
+        elif 'USE TEMP B-TREE' in detail and 'TEMP B-TREE' not in query.scans:
+            found.append(detail)
+    return found
+
+
+def check(path, verbose):
+    failed = []
+    with sqlite3.connect(path) as conn:
+        for query in queries.QUERIES.values():
+            try:
+                details = plan(conn, query)
+            except sqlite3.Error as e:
+                # Запрос не собирается на текущей схеме — это тоже регрессия
+                details = bad = [f'{type(e).__name__}: {e}']
+            else:
+                bad = violations(query, details) if query.hot else []
+            if bad:
+                failed.append(query.name)
+            if bad or verbose:
+                mark = 'ОШИБКА' if bad else ('ok' if query.hot else 'не горячий')
+                print(f'{query.name} [{mark}]')
+                for detail in details:
+                    print(f'    {"!" if detail in bad else " "} {detail}')
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--products', type=int, default=200, help='товаров в категории')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true', help='печатать планы всех запросов')
+    args = parser.parse_args()
+
+    path = Path(tempfile.mkdtemp()) / 'shop.db'
+    asyncio.run(seed(path, args.categories, args.products, args.users, args.orders))
+    failed = check(path, args.verbose)
+    print(f'Запросов: {len(queries.QUERIES)}, с полным проходом на горячем пути: {len(failed)}')
+    for name in failed:
+        print(f'    {name}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,81 @@
+"""Масштабирование по процессам: одни и те же обновления через Supervisor
+с разным числом воркеров.
+
+Воркеры — настоящие процессы бота с FakeTelegramSession вместо Bot API.
+После прогона проверяется, что ни одно добавление в корзину не потерялось.
+
+    python -m benchmarks.sharding --workers 1 2 4 --updates 7000
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import config
+import database as db
+from benchmarks.fake_session import FAKE_TOKEN, FakeTelegramSession
+from benchmarks.workload import seed_shop, synthetic_updates
+from supervisor import Supervisor
+
+
+def bench_worker(path, latency):
+    # Журнал aiogram на каждое обновление заметно тормозит замер
+    logging.basicConfig(level=logging.WARNING)
+    config.BOT_TOKEN = FAKE_TOKEN
+    db.pool = db.ConnectionPool(path)
+    return FakeTelegramSession(latency)
+
+
+async def _prepare(path):
+    db.pool = db.ConnectionPool(path)
+    await db.init_db()
+    await seed_shop()
+    await db.close_db()
+
+
+async def _run_once(workers, updates, latency):
+    path = str(Path(tempfile.mkdtemp()) / 'shop.db')
+    await _prepare(path)
+
+    supervisor = Supervisor(workers, functools.partial(bench_worker, path, latency))
+    supervisor.start()
+    await supervisor.wait_ready()
+
+    started = time.perf_counter()
+    for update in updates:
+        supervisor.route(update)
+    processed = await supervisor.stop()
+    elapsed = time.perf_counter() - started
+
+    added = sum(1 for update in updates if update.get('callback_query', {}).get('data', '').startswith('a:'))
+    with sqlite3.connect(path) as conn:
+        in_carts = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM cart').fetchone()[0]
+    return processed, elapsed, added == in_carts
+
+
+def run(workers_list, count, users, latency):
+    updates = synthetic_updates(count, users)
+    ok = True
+    for workers in workers_list:
+        processed, elapsed, consistent = asyncio.run(_run_once(workers, updates, latency))
+        ok = ok and consistent and processed == len(updates)
+        print(
+            f'Воркеров {workers}: {processed} обновлений за {elapsed:.2f} с — '
+            f'{processed / elapsed:.0f} в секунду, корзины {"сходятся" if consistent else "НЕ сходятся"}'
+        )
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--updates', type=int, default=7000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='имитация ответа Bot API, секунды')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(0 if run(args.workers, args.updates, args.users, args.latency) else 1)
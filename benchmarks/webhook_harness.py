@@ -0,0 +1,110 @@
+"""Пропускная способность webhook без сети.
+
+Поднимает настоящее aiohttp-приложение бота (webhook.build_app) на
+localhost, а вместо Telegram использует FakeTelegramSession. Обновления
+одного пользователя идут по очереди, разных — параллельно, как их
+присылает Telegram.
+
+    python -m benchmarks.webhook_harness --updates 2000 --concurrency 40 --latency 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+import config
+import database as db
+from benchmarks.fake_session import FAKE_TOKEN, FakeTelegramSession
+from benchmarks.workload import seed_shop, synthetic_updates
+
+SECRET = 'bench-secret'
+PATH = '/webhook'
+
+
+def load_bot():
+    # main создает Bot при импорте; токен подменяется до импорта,
+    # а сессия — сразу после, так что в сеть ничего не уходит
+    config.BOT_TOKEN = FAKE_TOKEN
+    import main
+    return main
+
+
+async def run(updates: int, users: int, concurrency: int, latency: float, port: int):
+    db.pool = db.ConnectionPool(str(Path(tempfile.mkdtemp()) / 'shop.db'))
+    await db.init_db()
+    await seed_shop()
+
+    main = load_bot()
+    from webhook import build_app
+    session = FakeTelegramSession(latency)
+    main.bot.session = session
+
+    runner = web.AppRunner(build_app(main.dp, main.bot, path=PATH, secret=SECRET))
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = f'http://127.0.0.1:{port}{PATH}'
+
+    by_user = defaultdict(list)
+    for update in synthetic_updates(updates, users):
+        event = update.get('message') or update.get('callback_query')
+        by_user[event['from']['id']].append(update)
+
+    latencies = []
+    inline_replies = 0
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as client:
+        async with client.post(url, json={'update_id': 0}, headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as response:
+            assert response.status == 401, response.status
+
+        async def user_session(user_updates):
+            nonlocal inline_replies, errors
+            for update in user_updates:
+                async with gate:
+                    started = time.perf_counter()
+                    async with client.post(url, json=update) as response:
+                        await response.read()
+                        latencies.append(time.perf_counter() - started)
+                        if response.status != 200:
+                            errors += 1
+                        elif response.content_type.startswith('multipart/'):
+                            inline_replies += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(user_updates) for user_updates in by_user.values()))
+        elapsed = time.perf_counter() - started
+
+    await main.cart_writes.flush_all()
+    await runner.cleanup()
+    await db.close_db()
+
+    latencies.sort()
+    total = len(latencies)
+    print(f'Обновлений: {total} за {elapsed:.2f} с — {total / elapsed:.0f} в секунду')
+    print(
+        f'Задержка: p50 {statistics.median(latencies) * 1000:.1f} мс, '
+        f'p95 {latencies[int(total * 0.95) - 1] * 1000:.1f} мс, '
+        f'p99 {latencies[int(total * 0.99) - 1] * 1000:.1f} мс'
+    )
+    print(f'Ответов прямо в webhook: {inline_replies}, ошибок: {errors}')
+    print(f'Запросов к Bot API: {sum(session.calls.values())} {dict(session.calls)}')
+    return errors == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.0, help='имитация ответа Bot API, секунды')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.updates, args.users, args.concurrency, args.latency, args.port))
+    raise SystemExit(0 if ok else 1)
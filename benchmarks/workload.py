@@ -0,0 +1,132 @@
+"""Тестовый магазин и синтетические обновления Telegram для замеров."""
+import itertools
+import time
+from datetime import datetime, timedelta
+from random import Random
+
+import callbacks as cb
+import database as db
+
+
+async def seed_shop(categories: int = 3, products: int = 50, stock: int = 1000):
+    """Заполняет пустую базу (db.pool уже открыт через init_db).
+
+    Товары категории c получают id (c - 1) * products + 1 ... c * products.
+    """
+    for category_id in range(1, categories + 1):
+        await db.add_category(f'Категория {category_id}', f'Описание {category_id}')
+        await db.upsert_products([
+            (None, category_id, f'Товар {category_id}-{n}', f'Описание товара {n}', 100.0 + n, stock, None)
+            for n in range(products)
+        ])
+
+
+async def seed_users(count: int, first_id: int = 1000):
+    """Пользователи first_id ... first_id + count - 1 с телефоном и адресом."""
+    async with db.pool.transaction() as conn:
+        await conn.executemany(
+            'INSERT OR IGNORE INTO users (user_id, username, full_name, phone, address) VALUES (?, ?, ?, ?, ?)',
+            [
+                (user_id, f'user{user_id}', f'User {user_id}', f'7999{user_id:07d}', f'Улица {user_id}')
+                for user_id in range(first_id, first_id + count)
+            ]
+        )
+
+
+async def seed_orders(count: int, users: int, products: int, first_user: int = 1000, days: int = 365):
+    """count заказов по 1-3 позиции, раскиданных по последним days дням."""
+    random = Random(count)
+    async with db.pool.transaction() as conn:
+        (last_id,), = await conn.execute_fetchall('SELECT COALESCE(MAX(id), 0) FROM orders')
+        orders, items = [], []
+        for order_id in range(last_id + 1, last_id + count + 1):
+            lines = [(random.randint(1, products), random.randint(1, 3)) for _ in range(random.randint(1, 3))]
+            total = sum((100.0 + product_id % 50) * quantity for product_id, quantity in lines)
+            created = datetime.now() - timedelta(days=random.random() * days)
+            orders.append((
+                order_id, first_user + random.randrange(users), total,
+                random.choice(STATUSES), created.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            items.extend(
+                (order_id, product_id, quantity, 100.0 + product_id % 50)
+                for product_id, quantity in lines
+            )
+        await conn.executemany(
+            'INSERT INTO orders (id, user_id, total_amount, status, created_at) VALUES (?, ?, ?, ?, ?)',
+            orders
+        )
+        await conn.executemany(
+            'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
+            items
+        )
+
+
+STATUSES = ('pending', 'processing', 'shipped', 'delivered', 'cancelled')
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+
+def _chat(user_id: int):
+    return {'id': user_id, 'type': 'private', 'first_name': f'User {user_id}'}
+
+
+def message_update(user_id: int, text: str):
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': _chat(user_id),
+            'from': _user(user_id),
+            'text': text,
+        },
+    }
+
+
+def callback_update(user_id: int, data):
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': _user(user_id),
+            'data': data.pack() if isinstance(data, cb.CallbackData) else data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': _chat(user_id),
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Shop bot'},
+                'text': 'menu',
+            },
+        },
+    }
+
+
+def shopping_session(user_id: int, product_id: int = 1, category_id: int = 1):
+    """Типичный путь покупателя: меню, каталог, товар, корзина."""
+    return [
+        message_update(user_id, '/start'),
+        message_update(user_id, 'Каталог'),
+        callback_update(user_id, cb.Category(category_id=category_id)),
+        callback_update(user_id, cb.Product(product_id=product_id)),
+        callback_update(user_id, cb.AddToCart(product_id=product_id)),
+        message_update(user_id, '🛒 Корзина'),
+        message_update(user_id, 'ℹ️ Помощь'),
+    ]
+
+
+def synthetic_updates(count: int, users: int = 100, categories: int = 3, products: int = 50):
+    """count обновлений от users пользователей по магазину из seed_shop."""
+    updates = []
+    for user_id in itertools.cycle(range(1000, 1000 + users)):
+        product_id = user_id % (categories * products) + 1
+        category_id = (product_id - 1) // products + 1
+        updates.extend(shopping_session(user_id, product_id, category_id))
+        if len(updates) >= count:
+            return updates[:count]
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+
+import database as db
+import keyboards as kb
+import throttling
+from config import (
+    BROADCAST_CHUNK,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_RATE
+)
+
+logger = logging.getLogger(__name__)
+
+_running = {}
+
+
+class Broadcast:
+    """Одна рассылка: получатели идут пачками по users.id, отправка — не
+    быстрее BROADCAST_RATE в секунду и не больше BROADCAST_CONCURRENCY
+    одновременно, в самой низкой полосе RequestScheduler.
+
+    Каждый получатель отмечается в broadcast_deliveries, поэтому после
+    перезапуска рассылка продолжается с тех, кому еще не отправляли.
+    Заблокировавшие бота помечаются в users.blocked_at.
+    """
+
+    def __init__(self, bot, broadcast_id: int):
+        self.bot = bot
+        self.id = broadcast_id
+        self.counts = Counter()
+        self.stopped = False
+        self._bucket = throttling.TokenBucket(BROADCAST_RATE, 1)
+        self._gate = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        self._delivered = 0
+        self._started = time.monotonic()
+
+    async def run(self):
+        _, self.admin_chat_id, self.message_id, self.text, status, self.total = await db.get_broadcast(self.id)
+        self.counts.update(await db.get_broadcast_counts(self.id))
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            with throttling.bulk():
+                await self._send_all()
+            if not self.stopped:
+                await db.set_broadcast_status(self.id, 'done')
+        finally:
+            reporter.cancel()
+        status = (await db.get_broadcast(self.id))[4]
+        await self._show_progress(status)
+        logger.info('Рассылка %s: %s, %s', self.id, status, dict(self.counts))
+
+    async def _send_all(self):
+        cursor = 0
+        while not self.stopped:
+            chunk = await db.claim_broadcast_chunk(self.id, cursor, BROADCAST_CHUNK)
+            if not chunk:
+                return
+            cursor = chunk[-1][0]
+            results = await asyncio.gather(*(self._deliver(user_id) for _, user_id in chunk))
+            results = [result for result in results if result]
+            await db.record_deliveries(self.id, results)
+            self.counts.update(status for _, status in results)
+
+    async def _deliver(self, user_id: int):
+        async with self._gate:
+            while wait := self._bucket.take():
+                await asyncio.sleep(wait)
+            if self.stopped:
+                # Остается pending: при отмене уже не важно, при
+                # перезапуске отправится заново
+                return None
+            try:
+                await self.bot.send_message(user_id, self.text, parse_mode='HTML')
+                status = 'sent'
+            except TelegramForbiddenError:
+                status = 'blocked'
+            except TelegramAPIError as error:
+                logger.warning('Рассылка %s, пользователь %s: %s', self.id, user_id, error)
+                status = 'failed'
+            self._delivered += 1
+            return user_id, status
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            # Отменить рассылку могли из другого процесса
+            if (await db.get_broadcast(self.id))[4] != 'running':
+                self.stopped = True
+            await self._show_progress('running')
+
+    def progress_text(self, status: str):
+        done = self.counts['sent'] + self.counts['blocked'] + self.counts['failed']
+        elapsed = time.monotonic() - self._started
+        title = {
+            'running': '📣 Рассылка',
+            'done': '✅ Рассылка завершена',
+            'cancelled': '⛔ Рассылка отменена',
+        }.get(status, '📣 Рассылка')
+        return (
+            f'{title} #{self.id}\n\n'
+            f'Обработано: {done} из {self.total}\n'
+            f'✉️ Доставлено: {self.counts["sent"]}\n'
+            f'🚫 Заблокировали бота: {self.counts["blocked"]}\n'
+            f'⚠️ Ошибок: {self.counts["failed"]}\n'
+            f'⚡ Скорость: {self._delivered / elapsed if elapsed else 0:.1f} сообщ./с'
+        )
+
+    async def _show_progress(self, status: str):
+        if not self.message_id:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=self.progress_text(status),
+                chat_id=self.admin_chat_id,
+                message_id=self.message_id,
+                reply_markup=kb.broadcast_menu(self.id) if status == 'running' else None
+            )
+        except TelegramBadRequest:
+            # Текст не изменился или сообщение удалено
+            pass
+
+
+def start(bot, broadcast_id: int):
+    runner = Broadcast(bot, broadcast_id)
+    task = asyncio.create_task(runner.run())
+    _running[broadcast_id] = runner, task
+    task.add_done_callback(lambda task: _running.pop(broadcast_id, None))
+    return runner
+
+
+async def create(bot, admin_chat_id: int, text: str):
+    broadcast_id, total = await db.create_broadcast(admin_chat_id, text)
+    message = await bot.send_message(
+        admin_chat_id,
+        f'📣 Рассылка #{broadcast_id}: {total} получателей, начинаю...',
+        reply_markup=kb.broadcast_menu(broadcast_id)
+    )
+    await db.set_broadcast_message(broadcast_id, message.message_id)
+    return start(bot, broadcast_id)
+
+
+async def cancel(broadcast_id: int):
+    await db.set_broadcast_status(broadcast_id, 'cancelled')
+    entry = _running.get(broadcast_id)
+    if entry:
+        entry[0].stopped = True
+
+
+async def resume(bot):
+    """Продолжает рассылки, прерванные остановкой бота."""
+    for broadcast_id in await db.get_running_broadcasts():
+        if broadcast_id in _running:
+            continue
+        await db.reset_pending_deliveries(broadcast_id)
+        logger.info('Продолжаю рассылку %s', broadcast_id)
+        start(bot, broadcast_id)
+
+
+async def stop_all():
+    """При остановке бота: рассылки останутся running и продолжатся при запуске."""
+    tasks = [task for _, task in _running.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
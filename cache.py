@@ -0,0 +1,144 @@
+import time
+from collections import OrderedDict
+
+from config import CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL, USER_CACHE_SIZE, USER_CACHE_TTL
+
+_MISSING = object()
+
+
+class TaggedCache:
+    """Кэш в памяти процесса с инвалидацией по тегам.
+
+    Каждая запись помечается тегами ('categories', 'category:3',
+    'product:10'), и запись в базу сбрасывает ровно те ключи, которые от нее
+    зависят. Ключи приходят и из callback_data, поэтому записей не больше
+    maxsize: давно неиспользованные вытесняются, как в LRUCache. None не
+    кэшируется.
+
+    Запись из другого процесса этот кэш не сбросит. После track() каждое
+    чтение сначала спрашивает changes(since) — теги, измененные после уже
+    известной версии, с их версиями — и сбрасывает их.
+    """
+
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+        self._version = 0
+        self._changes = None
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, tags=()):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        if len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def track(self, version: int, changes):
+        self._version = version
+        self._changes = changes
+
+    async def _sync(self):
+        rows = await self._changes(self._version)
+        if rows:
+            self.invalidate(*{tag for tag, _ in rows})
+            self._version = max(self._version, *(version for _, version in rows))
+
+    async def get_or_load(self, key, loader, tags=()):
+        if self._changes is not None:
+            await self._sync()
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        
+        generation = self._generation
+        value = await loader()
+        # Если пока шла загрузка что-то сбросили, значение могло устареть;
+        # None (например, несуществующий товар) не кэшируется
+        if value is not None and generation == self._generation:
+            self.set(key, value, tags)
+        return value
+
+    def invalidate(self, *tags):
+        self._generation += 1
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._tags.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением давно неиспользованных
+    записей и временем жизни каждой записи."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+catalog = TaggedCache()
+# Профиль меняют только обновления самого пользователя, а они всегда идут
+# в один воркер. Исключение — blocked_at из рассылки: его unblock_user
+# читает из базы
+users = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
@@ -0,0 +1,156 @@
+import inspect
+
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.filters.callback_data import CallbackData
+
+# Схемы callback_data. Префиксы короткие: Telegram ограничивает
+# callback_data 64 байтами, а каждый байт едет в каждой кнопке.
+
+
+# Каталог
+class MainMenu(CallbackData, prefix='m'):
+    pass
+
+class Categories(CallbackData, prefix='cl'):
+    pass
+
+class Category(CallbackData, prefix='c'):
+    category_id: int
+    sort: str = 'name'
+    backward: bool = False
+    cursor: int = 0
+
+class Product(CallbackData, prefix='p'):
+    product_id: int
+
+class AddToCart(CallbackData, prefix='a'):
+    product_id: int
+
+class RemoveFromCart(CallbackData, prefix='r'):
+    product_id: int
+
+
+# Корзина
+class Cart(CallbackData, prefix='k'):
+    pass
+
+class EditCartItem(CallbackData, prefix='ke'):
+    item_id: int
+
+class CartQuantity(CallbackData, prefix='kq'):
+    item_id: int
+    delta: int
+
+class DeleteCartItem(CallbackData, prefix='kd'):
+    item_id: int
+
+class ClearCart(CallbackData, prefix='kc'):
+    pass
+
+class Checkout(CallbackData, prefix='co'):
+    pass
+
+class ConfirmOrder(CallbackData, prefix='ok'):
+    pass
+
+
+# Заказы и профиль
+class Orders(CallbackData, prefix='o'):
+    newer: bool = False
+    cursor: int = 0
+
+class Profile(CallbackData, prefix='pf'):
+    pass
+
+class EditProfile(CallbackData, prefix='pe'):
+    pass
+
+class ChangePhone(CallbackData, prefix='pp'):
+    pass
+
+class ChangeAddress(CallbackData, prefix='pa'):
+    pass
+
+
+# Админка
+class AdminStats(CallbackData, prefix='as'):
+    pass
+
+class AdminOrders(CallbackData, prefix='ao'):
+    pass
+
+class AdminOrdersPage(CallbackData, prefix='aop'):
+    status: str = 'all'
+    newer: bool = False
+    cursor: int = 0
+
+class AdminAddProduct(CallbackData, prefix='aap'):
+    pass
+
+class AdminAddCategory(CallbackData, prefix='aac'):
+    pass
+
+class AdminSelectCategory(CallbackData, prefix='asc'):
+    category_id: int
+
+class AdminCancel(CallbackData, prefix='ax'):
+    pass
+
+class AdminProductPhoto(CallbackData, prefix='aph'):
+    product_id: int
+
+class AdminImport(CallbackData, prefix='aim'):
+    pass
+
+class AdminExport(CallbackData, prefix='aex'):
+    fmt: str = ''
+
+class AdminBroadcast(CallbackData, prefix='ab'):
+    pass
+
+class CancelBroadcast(CallbackData, prefix='abx'):
+    broadcast_id: int
+
+
+class CallbackRouter:
+    """Диспетчер callback-запросов по префиксу callback_data.
+
+    Вместо цепочки фильтров F.data.startswith(...), которые проверяются по
+    очереди, префикс ищется в словаре, а данные разбираются схемой.
+    Обработчик получает (callback, callback_data) и те из аргументов
+    aiogram (state, bot, ...), которые объявлены в его сигнатуре.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def __call__(self, schema):
+        def decorator(handler):
+            prefix = schema.__prefix__
+            if prefix in self._routes:
+                raise ValueError(f'Префикс {prefix!r} уже занят')
+            params = inspect.signature(handler).parameters
+            extra = tuple(name for name in params if name not in ('callback', 'callback_data'))
+            self._routes[prefix] = (schema, handler, extra)
+            return handler
+        return decorator
+
+    def __contains__(self, prefix: str):
+        return prefix in self._routes
+
+    def resolve(self, data: str):
+        route = self._routes.get(data.split(':', 1)[0])
+        if route is None:
+            return None
+        schema, handler, extra = route
+        try:
+            return schema.unpack(data), handler, extra
+        except (TypeError, ValueError):
+            return None
+
+    async def dispatch(self, callback, **kwargs):
+        resolved = self.resolve(callback.data or '')
+        if resolved is None:
+            return UNHANDLED
+        callback_data, handler, extra = resolved
+        return await handler(callback, callback_data, **{name: kwargs[name] for name in extra if name in kwargs})
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+
+class CartWriteBehind:
+    """Склеивает быстрые нажатия ➕/➖ по одной строке корзины.
+
+    Изменения количества копятся в памяти в течение окна window, затем
+    уходят в базу одной записью, а сообщение редактируется один раз через
+    render(message, user_id, cart_item_id, line). flush_user только пишет:
+    его вызывают обработчики, которые сами перерисуют сообщение.
+    window = 0 отключает буфер.
+    """
+
+    def __init__(self, window: float, render):
+        self.window = window
+        self.render = render
+        self._pending = {}
+        self._timers = {}
+        self._locks = {}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, user_id: int, cart_item_id: int, delta: int, message):
+        key = (user_id, cart_item_id)
+        entry = self._pending.get(key)
+        if entry:
+            entry[0] += delta
+            entry[1] = message
+        else:
+            self._pending[key] = [delta, message]
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        self._timers.pop(key, None)
+        try:
+            written = await self._persist(key)
+            # Сообщение правится уже без блокировки, чтобы flush_user и
+            # оформление заказа не ждали Telegram
+            if written:
+                message, line = written
+                await self.render(message, key[0], key[1], line)
+        except Exception:
+            logger.exception('Не удалось записать изменения корзины %s', key)
+
+    @asynccontextmanager
+    async def _user_lock(self, user_id: int):
+        # Блокировка живет, пока ее держат или ждут: счетчик, а не locked(),
+        # иначе ожидающий и следующий пришедший получили бы разные блокировки
+        entry = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[user_id]
+
+    async def _persist(self, key):
+        """Записывает накопленное изменение строки; возвращает (message,
+        line) для render или None, если записывать нечего."""
+        user_id, cart_item_id = key
+        # Записи одного пользователя идут по очереди
+        async with self._user_lock(user_id):
+            entry = self._pending.pop(key, None)
+            if not entry or not entry[0]:
+                return None
+            delta, message = entry
+            line = await db.change_cart_item(cart_item_id, user_id, delta)
+        return message, line
+
+    def _take_timer(self, key):
+        timer = self._timers.pop(key, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+    async def flush_user(self, user_id: int):
+        # Только запись: вызывающий обработчик сам перерисует сообщение
+        for key in [key for key in self._pending if key[0] == user_id]:
+            self._take_timer(key)
+            try:
+                await self._persist(key)
+            except Exception:
+                logger.exception('Не удалось записать изменения корзины %s', key)
+        # Дожидаемся записи, которая уже могла начаться до вызова
+        async with self._user_lock(user_id):
+            pass
+
+    async def flush_all(self):
+        for user_id in {key[0] for key in self._pending}:
+            await self.flush_user(user_id)
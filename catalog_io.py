@@ -0,0 +1,359 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+import database as db
+import media
+from config import IMPORT_CHUNK, IMPORT_PROGRESS_INTERVAL, PRODUCT_IMAGES_DIR
+
+logger = logging.getLogger(__name__)
+
+# Колонки файла каталога; обязательны category, name и price
+COLUMNS = ('sku', 'category', 'name', 'description', 'price', 'stock', 'image_path')
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'json', '.ndjson': 'json'}
+
+NAME_LIMIT = 200
+# Больше этого один товар в JSON не занимает; дальше — испорченный файл
+JSON_OBJECT_LIMIT = 1024 * 1024
+
+
+def detect_format(file_name: str):
+    return FORMATS.get(os.path.splitext(file_name or '')[1].lower())
+
+
+# ЧТЕНИЕ
+def _read_csv(file):
+    sample = file.read(4096)
+    file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(file, dialect=dialect)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _read_json(file, chunk_size: int = 65536):
+    # Массив объектов или JSON Lines. json.load прочитал бы файл целиком,
+    # поэтому объекты разбираются по одному из скользящего буфера
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    line = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            line += buffer[position] == '\n'
+            position += 1
+        if position >= len(buffer) or not eof and len(buffer) - position < chunk_size:
+            if eof:
+                if position < len(buffer):
+                    raise ValueError(f'строка {line}: файл оборван')
+                return
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            if not eof and len(buffer) - position < JSON_OBJECT_LIMIT:
+                # Объект не поместился в буфер целиком — дочитываем
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            raise ValueError(f'строка {line}: {error.msg}') from None
+        yield line, item
+        line += buffer.count('\n', position, end)
+        position = end
+
+
+def _image_path(path: str):
+    # Фото из файла потом загружается в Telegram: брать можно только из
+    # PRODUCT_IMAGES_DIR, а не любой файл, который может прочитать бот
+    images = os.path.realpath(PRODUCT_IMAGES_DIR)
+    if os.path.commonpath([images, os.path.realpath(path)]) != images:
+        raise ValueError(f'фото не в папке {PRODUCT_IMAGES_DIR}: {path!r}')
+    return path
+
+
+def _parse(raw: dict):
+    """Проверяет строку файла; возвращает (sku, category, name, description,
+    price, stock, image_path) или бросает ValueError с причиной."""
+    if not isinstance(raw, dict):
+        raise ValueError('ожидался объект с полями товара')
+
+    def text(column):
+        value = raw.get(column)
+        return str(value).strip() if value is not None else ''
+
+    name = text('name')
+    category = text('category')
+    if not name:
+        raise ValueError('не указано название')
+    if len(name) > NAME_LIMIT:
+        raise ValueError(f'название длиннее {NAME_LIMIT} символов')
+    if not category:
+        raise ValueError('не указана категория')
+    try:
+        price = float(text('price').replace(',', '.'))
+    except ValueError:
+        raise ValueError(f'неверная цена: {text("price")!r}') from None
+    if not price >= 0 or price == float('inf'):
+        raise ValueError(f'неверная цена: {text("price")!r}')
+    try:
+        stock = int(text('stock') or 0)
+    except ValueError:
+        raise ValueError(f'неверный остаток: {text("stock")!r}') from None
+    if stock < 0:
+        raise ValueError(f'неверный остаток: {stock}')
+    image_path = text('image_path')
+    return (
+        text('sku') or None, category, name, text('description'),
+        round(price, 2), stock, _image_path(image_path) if image_path else None
+    )
+
+
+# ИМПОРТ
+class ImportReport:
+    """Счетчики импорта; ошибки по строкам сразу пишутся в errors_path (CSV)."""
+
+    def __init__(self, errors_path: str):
+        self.errors_path = errors_path
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.categories = 0
+        self.started = time.monotonic()
+        self._errors = None
+
+    def error(self, line, message: str):
+        if self._errors is None:
+            self._file = open(self.errors_path, 'w', newline='', encoding='utf-8')
+            self._errors = csv.writer(self._file)
+            self._errors.writerow(['line', 'error'])
+        self.failed += 1
+        self._errors.writerow([line, message])
+
+    def close(self):
+        if self._errors is not None:
+            self._file.close()
+
+    @property
+    def has_errors(self):
+        return self.failed > 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def text(self, done: bool = False):
+        title = '✅ Импорт завершен' if done else '📥 Импорт каталога'
+        return (
+            f'{title}\n\n'
+            f'Прочитано строк: {self.rows}\n'
+            f'✅ Загружено: {self.imported}\n'
+            f'🏷️ Новых категорий: {self.categories}\n'
+            f'⚠️ С ошибками: {self.failed}\n'
+            f'⏱ {self.elapsed:.1f} с'
+        )
+
+
+async def _write_chunk(chunk, categories, report):
+    """chunk — [(строка файла, разобранный товар)]."""
+    missing = list({
+        category.casefold(): category
+        for _, (_, category, *_) in chunk if category.casefold() not in categories
+    }.values())
+    if missing:
+        created = await db.add_categories(missing)
+        categories.update((name.casefold(), category_id) for name, category_id in created.items())
+        report.categories += len(created)
+    rows = [
+        (line, (sku, categories[category.casefold()], *rest))
+        for line, (sku, category, *rest) in chunk
+    ]
+    # Без артикула строку не с чем сопоставить: товар с тем же названием в
+    # той же категории не дублируется (например, при загрузке выгрузки)
+    keys = [(row[1], row[2]) for _, row in rows if row[0] is None]
+    existing = await db.find_products_by_name(keys) if keys else set()
+    accepted = []
+    for line, row in rows:
+        if row[0] is None:
+            if (row[1], row[2]) in existing:
+                report.error(line, f'товар {row[2]!r} без артикула уже есть в категории')
+                continue
+            existing.add((row[1], row[2]))
+        accepted.append(row)
+    if accepted:
+        await db.upsert_products(accepted)
+    report.imported += len(accepted)
+
+
+async def import_catalog(path: str, fmt: str, errors_path: str, progress=None):
+    """Загружает каталог из файла path (fmt — 'csv' или 'json').
+
+    Файл читается потоково, строки проверяются по одной и пишутся пачками
+    по IMPORT_CHUNK в одной транзакции. Категории ищутся по имени без учета
+    регистра, отсутствующие создаются. Строка без артикула не добавляется,
+    если в категории уже есть товар с тем же названием; image_path — только
+    из PRODUCT_IMAGES_DIR. progress(report) вызывается не чаще
+    раза в IMPORT_PROGRESS_INTERVAL секунд.
+    """
+    report = ImportReport(errors_path)
+    categories = {name.casefold(): category_id for name, category_id in (await db.get_category_ids()).items()}
+    read = _read_csv if fmt == 'csv' else _read_json
+    chunk = []
+    reported = time.monotonic()
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            try:
+                for line, raw in read(file):
+                    report.rows += 1
+                    try:
+                        chunk.append((line, _parse(raw)))
+                    except ValueError as error:
+                        report.error(line, str(error))
+                    if len(chunk) >= IMPORT_CHUNK:
+                        await _write_chunk(chunk, categories, report)
+                        chunk = []
+                        if progress and time.monotonic() - reported >= IMPORT_PROGRESS_INTERVAL:
+                            reported = time.monotonic()
+                            await progress(report)
+            except (ValueError, UnicodeDecodeError, csv.Error) as error:
+                # Файл испорчен дальше этого места: загруженное остается
+                report.error('-', f'файл не дочитан: {error}')
+        if chunk:
+            await _write_chunk(chunk, categories, report)
+    finally:
+        report.close()
+    logger.info('Импорт каталога: %s строк, %s загружено, %s с ошибками за %.1f с',
+                report.rows, report.imported, report.failed, report.elapsed)
+    return report
+
+
+# ЭКСПОРТ
+def _export_row(row):
+    _, sku, category, name, description, price, stock, image_path = row
+    return {
+        'sku': sku, 'category': category, 'name': name, 'description': description,
+        'price': price, 'stock': stock, 'image_path': image_path,
+    }
+
+
+async def export_catalog(path: str, fmt: str):
+    """Пишет каталог в path пачками из базы; файл подходит для import_catalog."""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            async for rows in db.export_products():
+                writer.writerows(row[1:] for row in rows)
+                count += len(rows)
+        else:
+            file.write('[')
+            async for rows in db.export_products():
+                for row in rows:
+                    file.write(',\n' if count else '\n')
+                    file.write(json.dumps(_export_row(row), ensure_ascii=False))
+                    count += 1
+            file.write('\n]\n')
+    return count
+
+
+# TELEGRAM
+# Файлы больше 20 МБ Bot API скачивать не дает
+DOCUMENT_LIMIT = 20 * 1024 * 1024
+
+_running = set()
+
+
+def _start(coro):
+    # Импорт и экспорт идут в фоне: обработчик (и ответ на webhook)
+    # не ждет, пока пройдут сотни тысяч строк
+    task = asyncio.create_task(coro)
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def stop_all(timeout: float):
+    """При остановке бота: ждет начатые импорт и экспорт не дольше timeout,
+    остальные прерывает (уже записанные пачки импорта остаются в базе)."""
+    if not _running:
+        return
+    _, pending = await asyncio.wait(list(_running), timeout=max(0, timeout))
+    for task in pending:
+        logger.warning('Импорт или экспорт каталога прерван остановкой бота')
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _edit(message, text: str):
+    try:
+        await message.edit_text(text)
+    except TelegramBadRequest:
+        pass
+
+
+async def _import_document(bot, chat_id: int, document, fmt: str):
+    status = await bot.send_message(chat_id, '📥 Скачиваю файл...')
+    workdir = tempfile.mkdtemp(prefix='catalog-')
+    try:
+        path = os.path.join(workdir, 'catalog')
+        async with media.upload_gate:
+            await bot.download(document, destination=path)
+        await _edit(status, '📥 Загружаю каталог...')
+
+        report = await import_catalog(
+            path, fmt, os.path.join(workdir, 'errors.csv'),
+            progress=lambda report: _edit(status, report.text())
+        )
+        await _edit(status, report.text(done=True))
+        if report.has_errors:
+            await bot.send_document(
+                chat_id, FSInputFile(report.errors_path, filename='import_errors.csv'),
+                caption=f'⚠️ Строки с ошибками: {report.failed}'
+            )
+    except Exception:
+        logger.exception('Импорт каталога не удался')
+        await _edit(status, '❌ Импорт прерван, загружена только часть файла')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def start_import(bot, chat_id: int, document, fmt: str):
+    return _start(_import_document(bot, chat_id, document, fmt))
+
+
+async def _export_document(bot, chat_id: int, fmt: str):
+    workdir = tempfile.mkdtemp(prefix='catalog-')
+    try:
+        path = os.path.join(workdir, f'catalog.{fmt}')
+        count = await export_catalog(path, fmt)
+        async with media.upload_gate:
+            await bot.send_document(chat_id, FSInputFile(path), caption=f'📤 Товаров в каталоге: {count}')
+    except Exception:
+        logger.exception('Экспорт каталога не удался')
+        await bot.send_message(chat_id, '❌ Не удалось выгрузить каталог')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def start_export(bot, chat_id: int, fmt: str):
+    return _start(_export_document(bot, chat_id, fmt))
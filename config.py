@@ -6,4 +6,118 @@ BOT_TOKEN = 'YOUR_TOKEN'
 
 ID_ADMIN = ['ADMIN_ID']
 
-DB_NAME = 'shop.db'
\ No newline at end of file
+DB_NAME = 'shop.db'
+
+# Пул соединений SQLite: сколько соединений на чтение держать открытыми
+DB_READERS = 4
+# Размер кэша подготовленных выражений на каждое соединение
+DB_STATEMENT_CACHE = 256
+# Запросы дольше стольких секунд пишутся в лог database.slow; None — не писать
+SLOW_QUERY_THRESHOLD = 0.1
+
+# Сколько заказов показывать на одной странице истории
+ORDERS_PAGE_SIZE = 10
+
+# Архив заказов: доставленные и отмененные заказы старше ORDER_ARCHIVE_DAYS
+# дней переносятся из orders в orders_archive раз в ORDER_ARCHIVE_INTERVAL
+# секунд (0 — не переносить), пачками по ORDER_ARCHIVE_BATCH заказов с
+# паузой ORDER_ARCHIVE_PAUSE секунд между пачками
+ORDER_ARCHIVE_DAYS = 90
+ORDER_ARCHIVE_INTERVAL = 3600
+ORDER_ARCHIVE_BATCH = 200
+ORDER_ARCHIVE_PAUSE = 0.2
+
+# Сколько секунд кэш каталога доверяет записи, даже если ее никто не сбросил,
+# и сколько записей (страниц, карточек, клавиатур) он держит
+CATALOG_CACHE_TTL = 300
+CATALOG_CACHE_SIZE = 20000
+
+# Сколько товаров показывать на одной странице категории
+PRODUCTS_PAGE_SIZE = 20
+
+# Сколько товаров возвращает один запрос поиска
+SEARCH_RESULTS_LIMIT = 20
+
+# Кэш профилей пользователей: сколько профилей держать и сколько секунд
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600
+
+# Окно склеивания нажатий ➕/➖ в корзине, секунды (0 — писать сразу)
+CART_WRITE_WINDOW = 0.3
+
+# Где хранить состояния диалогов: 'memory' или 'sqlite' (переживает перезапуск)
+FSM_STORAGE = 'sqlite'
+
+# Брошенные диалоги удаляются через столько секунд без изменений
+FSM_STATE_TTL = 86400
+FSM_CLEANUP_INTERVAL = 3600
+
+# Кэш состояний перед базой: сколько записей держать и сколько секунд
+FSM_CACHE_SIZE = 5000
+FSM_CACHE_TTL = 300
+
+# Как получать обновления: 'polling' или 'webhook'
+BOT_MODE = 'polling'
+
+# Webhook: публичный адрес, путь и секрет, который Telegram присылает в
+# заголовке X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_URL = 'https://example.com'
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = 'YOUR_WEBHOOK_SECRET'
+# Сколько запросов Telegram может держать к боту одновременно (1-100)
+WEBHOOK_MAX_CONNECTIONS = 40
+# Локальный адрес aiohttp-сервера (за reverse proxy с TLS)
+WEBAPP_HOST = '127.0.0.1'
+WEBAPP_PORT = 8080
+# Сколько секунд при остановке ждать уже принятые запросы
+WEBAPP_SHUTDOWN_TIMEOUT = 30
+# Сколько секунд при остановке ждать начатые обработчики, импорт и экспорт
+# каталога; не дольше, чем ждет менеджер процессов перед SIGKILL
+SHUTDOWN_TIMEOUT = 25
+
+# Сколько процессов-воркеров разбирают обновления (1 — все в одном процессе).
+# Обновления одного пользователя всегда попадают в один воркер по порядку.
+# Общий лимит Bot API (TG_GLOBAL_RATE) воркеры делят поровну, так что
+# рассылка из одного воркера идет не быстрее TG_GLOBAL_RATE / WORKERS
+WORKERS = 1
+# Воркер отмечается каждые WORKER_HEARTBEAT_INTERVAL секунд; молчащий дольше
+# WORKER_HEALTH_TIMEOUT считается зависшим и перезапускается. Запущенный
+# воркер, не отметившийся ни разу за WORKER_START_TIMEOUT, — тоже
+WORKER_HEARTBEAT_INTERVAL = 2
+WORKER_HEALTH_TIMEOUT = 30
+WORKER_START_TIMEOUT = 60
+# Сколько обновлений воркер разбирает одновременно; остальные ждут в очереди
+WORKER_MAX_IN_FLIGHT = 100
+# Сколько секунд при остановке ждать, пока воркеры разберут очереди
+WORKER_STOP_TIMEOUT = 30
+
+# Лимиты исходящих запросов к Bot API: всего в секунду и в один чат,
+# с допустимым всплеском. TG_MAX_RETRIES — повторы после flood control
+TG_GLOBAL_RATE = 30
+TG_GLOBAL_BURST = 30
+TG_CHAT_RATE = 1
+TG_CHAT_BURST = 3
+TG_MAX_RETRIES = 3
+
+# Рассылки: сообщений в секунду (ниже общего лимита, чтобы бот оставался
+# отзывчивым), одновременных отправок, получателей в одной пачке и как
+# часто обновлять сообщение с прогрессом, секунды
+BROADCAST_RATE = 20
+BROADCAST_CONCURRENCY = 10
+BROADCAST_CHUNK = 500
+BROADCAST_PROGRESS_INTERVAL = 5
+
+# Фото товаров: куда сохранять присланные админом файлы и сколько файлов
+# одновременно загружать в Telegram или скачивать из него
+PRODUCT_IMAGES_DIR = 'images'
+PHOTO_UPLOAD_CONCURRENCY = 4
+
+# Импорт каталога из файла: строк в одной транзакции и как часто
+# обновлять сообщение с прогрессом (секунды)
+IMPORT_CHUNK = 1000
+IMPORT_PROGRESS_INTERVAL = 3
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+# (воркер N — на порту METRICS_PORT + N). 0 — не поднимать
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
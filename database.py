@@ -1,23 +1,415 @@
+import asyncio
+import json
+import logging
+import re
 import sqlite3
+import sys
+import time
 import aiosqlite
-from datetime import datetime
+import metrics
+import queries as q
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import NamedTuple
+
+from cache import catalog, users
+from config import (
+    DB_READERS,
+    DB_STATEMENT_CACHE,
+    ORDER_ARCHIVE_DAYS,
+    ORDERS_PAGE_SIZE,
+    PRODUCTS_PAGE_SIZE,
+    SEARCH_RESULTS_LIMIT,
+    SLOW_QUERY_THRESHOLD
+)
+
+slow_log = logging.getLogger('database.slow')
 
 DB_PATH = Path(__file__).parent / 'shop.db'
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+# Настройки, которые применяются к каждому соединению пула
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class ConnectionPool:
+    """Долгоживущие соединения: несколько читателей и один писатель.
+
+    Соединения открываются один раз в init_db() и живут до close_db(),
+    поэтому подготовленные выражения остаются в кэше sqlite3 между вызовами.
+    """
+
+    def __init__(self, path, readers: int = DB_READERS):
+        self.path = path
+        self.size = readers
+        self._readers = None
+        self._all_readers = []
+        self._writer = None
+        self._write_lock = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    @property
+    def connections(self):
+        return [self._writer, *self._all_readers] if self.is_open else []
+
+    async def _connect(self, query_only: bool = False):
+        metrics.db_connections.inc()
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if query_only:
+            await conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._write_lock = asyncio.Lock()
+        self._writer = await self._connect()
+
+    async def open_readers(self):
+        # Читатели открываются после миграций, чтобы сразу видеть свежую схему
+        if self._all_readers:
+            return
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await self._connect(query_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        if not self.is_open:
+            return
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        await self._writer.close()
+        self._writer = None
+
+    # Время запроса пишется под именем публичной функции database.py,
+    # из которой он сделан (см. metrics.instrument_queries в конце модуля)
+    @asynccontextmanager
+    async def reader(self):
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        acquired = time.perf_counter()
+        metrics.db_wait_seconds.observe(acquired - started, 'reader')
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+            metrics.db_query_seconds.observe(time.perf_counter() - acquired, metrics.current_query())
+
+    @asynccontextmanager
+    async def writer(self):
+        started = time.perf_counter()
+        async with self._write_lock:
+            acquired = time.perf_counter()
+            metrics.db_wait_seconds.observe(acquired - started, 'writer')
+            try:
+                yield self._writer
+            finally:
+                metrics.db_query_seconds.observe(time.perf_counter() - acquired, metrics.current_query())
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.writer() as conn:
+            await conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+# ЗАПРОСЫ
+# Весь SQL рабочего кода — именованные запросы из queries.py. Запрос
+# дольше SLOW_QUERY_THRESHOLD секунд пишется в лог database.slow вместе
+# с параметрами и местом вызова за пределами database.py.
+_INTERNAL_MODULES = ('database', 'metrics', 'cache', 'contextlib', 'asyncio', 'aiosqlite')
+
+def _caller():
+    frame = sys._getframe(2)
+    while frame:
+        module = frame.f_globals.get('__name__', '')
+        if module.split('.')[0] not in _INTERNAL_MODULES:
+            return f'{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+def _slow(query: q.Query, params, started: float, many: bool = False):
+    elapsed = time.perf_counter() - started
+    if SLOW_QUERY_THRESHOLD is None or elapsed < SLOW_QUERY_THRESHOLD:
+        return
+    if many:
+        params = list(params)
+        params = f'{len(params)} строк, первая {params[0] if params else None!r}'
+    else:
+        params = repr(tuple(params))
+    slow_log.warning(
+        'Медленный запрос %s: %.3f с, параметры %.200s, вызов %s',
+        query.name, elapsed, params, _caller()
+    )
+
+async def _rows(conn, query: q.Query, params=()):
+    started = time.perf_counter()
+    rows = await conn.execute_fetchall(query.sql, params)
+    _slow(query, params, started)
+    return rows
+
+async def _run(conn, query: q.Query, params=()):
+    started = time.perf_counter()
+    cursor = await conn.execute(query.sql, params)
+    _slow(query, params, started)
+    return cursor
+
+async def _run_many(conn, query: q.Query, rows):
+    started = time.perf_counter()
+    await conn.executemany(query.sql, rows)
+    _slow(query, rows, started, many=True)
+
+async def _fetchall(query: q.Query, params=()):
+    async with pool.reader() as conn:
+        return await _rows(conn, query, params)
+
+async def _fetchone(query: q.Query, params=()):
+    rows = await _fetchall(query, params)
+    return rows[0] if rows else None
+
+async def _execute(query: q.Query, params=()):
+    async with pool.writer() as conn:
+        return await _run(conn, query, params)
+
+async def _execute_returning(query: q.Query, params=()):
+    async with pool.writer() as conn:
+        rows = await _rows(conn, query, params)
+    return rows[0] if rows else None
+
+
+# ПАГИНАЦИЯ
+class Page(NamedTuple):
+    """Страница keyset-пагинации.
+
+    has_prev — есть строки ближе к началу списка, has_next — дальше.
+    """
+    rows: list
+    has_prev: bool
+    has_next: bool
+
+
+# Списки листаются по ключу сортировки, а не OFFSET; variants — семейство
+# запросов из queries.keyset (с курсором и без, вперед и назад) или
+# queries.keyset_union из parts частей
+async def _keyset_page(variants: dict, params: list, cursor, backward: bool, limit: int, parts: int = 1):
+    args = list(params)
+    if cursor is not None:
+        args.append(cursor)
+    args = (*args, limit + 1) * parts + ((limit + 1,) if parts > 1 else ())
+    rows = await _fetchall(variants[cursor is not None, backward], args)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    
+    if not backward:
+        return Page(rows, has_prev=cursor is not None, has_next=more)
+    if not more:
+        # Дошли до начала списка — показываем полную первую страницу
+        return await _keyset_page(variants, params, None, False, limit, parts=parts)
+    rows.reverse()
+    return Page(rows, has_prev=True, has_next=True)
+
+
+# МИГРАЦИИ
+# Каждая миграция — (версия, название, шаги). Шаг — SQL-строка или
+# корутина, принимающая соединение. Шаги должны быть идемпотентными:
+# старые базы shop.db обновляются на месте при запуске.
+
+async def _dedupe_cart(db):
+    # Склеиваем повторяющиеся строки корзины перед UNIQUE-индексом
+    await db.execute('''
+        UPDATE cart SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart c2
+            WHERE c2.user_id = cart.user_id AND c2.product_id = cart.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+    ''')
+    await db.execute('''
+        DELETE FROM cart WHERE id NOT IN (
+            SELECT MIN(id) FROM cart GROUP BY user_id, product_id
+        )
+    ''')
+
+# Агрегаты для админской статистики поддерживают триггеры, поэтому экран
+# статистики читает несколько строк независимо от числа заказов
+_STATS_UPSERT = '''
+    INSERT INTO shop_stats (key, value) VALUES {values}
+    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;
+'''
+_DAILY_UPSERT = '''
+    INSERT INTO shop_daily_revenue (day, orders, revenue) VALUES ({values})
+    ON CONFLICT (day) DO UPDATE SET
+        orders = orders + excluded.orders,
+        revenue = revenue + excluded.revenue;
+'''
+
+def _order_stats(row: str, sign: str):
+    return (
+        _STATS_UPSERT.format(values=(
+            f"('orders', {sign}1), ('revenue', {sign}{row}.total_amount), "
+            f"('status:' || COALESCE({row}.status, 'pending'), {sign}1)"
+        )) +
+        _DAILY_UPSERT.format(values=(
+            f"date({row}.created_at), {sign}1, {sign}{row}.total_amount"
+        ))
+    )
+
+_STATS_TRIGGERS = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_orders_insert AFTER INSERT ON orders
+        BEGIN {_order_stats('NEW', '+')} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_orders_delete AFTER DELETE ON orders
+        BEGIN {_order_stats('OLD', '-')} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_orders_update
+        AFTER UPDATE OF status, total_amount, created_at ON orders
+        BEGIN {_order_stats('OLD', '-')} {_order_stats('NEW', '+')} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users
+        BEGIN {_STATS_UPSERT.format(values="('users', 1)")} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users
+        BEGIN {_STATS_UPSERT.format(values="('users', -1)")} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_products_insert AFTER INSERT ON products
+        BEGIN {_STATS_UPSERT.format(values="('products', 1)")} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_products_delete AFTER DELETE ON products
+        BEGIN {_STATS_UPSERT.format(values="('products', -1)")} END
+    ''',
+]
+
+# Внешний FTS5-индекс по products: триггеры держат его в синхроне с таблицей
+_FTS_INSERT = 'INSERT INTO products_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);'
+_FTS_DELETE = (
+    "INSERT INTO products_fts (products_fts, rowid, name, description) "
+    "VALUES ('delete', OLD.id, OLD.name, OLD.description);"
+)
+_FTS_TRIGGERS = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+        BEGIN {_FTS_INSERT} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+        BEGIN {_FTS_DELETE} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+        AFTER UPDATE OF name, description ON products
+        BEGIN {_FTS_DELETE} {_FTS_INSERT} END
+    ''',
+]
+
+# Версии тегов кэша каталога для других процессов: изменение products или
+# categories записывает новую общую версию тегам, которые от него зависят
+# (те же теги, что сбрасывает catalog.invalidate), в той же транзакции
+_VERSION_UPSERT = '''
+    INSERT INTO catalog_versions (tag, version)
+    SELECT value, (SELECT COALESCE(MAX(version), 0) + 1 FROM catalog_versions)
+    FROM json_each(json_array({tags})) WHERE true
+    ON CONFLICT (tag) DO UPDATE SET version = excluded.version;
+'''
+
+def _product_tags(row: str):
+    return f"'product:' || {row}.id, 'category:' || {row}.category_id"
+
+_VERSION_TRIGGERS = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_products_insert AFTER INSERT ON products
+        BEGIN {_VERSION_UPSERT.format(tags=_product_tags('NEW'))} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_products_delete AFTER DELETE ON products
+        BEGIN {_VERSION_UPSERT.format(tags=_product_tags('OLD'))} END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_products_update AFTER UPDATE ON products
+        BEGIN {_VERSION_UPSERT.format(tags=_product_tags('OLD') + ", 'category:' || NEW.category_id")} END
+    ''',
+    *(
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_catalog_categories_{event.lower()} AFTER {event} ON categories
+            BEGIN {_VERSION_UPSERT.format(tags="'categories'")} END
+        '''
+        for event in ('INSERT', 'UPDATE', 'DELETE')
+    ),
+]
+
+async def _backfill_shop_stats(db):
+    await db.execute('DELETE FROM shop_stats')
+    await db.execute('DELETE FROM shop_daily_revenue')
+    await db.execute('''
+        INSERT INTO shop_stats (key, value)
+        SELECT 'orders', COUNT(*) FROM orders
+        UNION ALL SELECT 'revenue', COALESCE(SUM(total_amount), 0) FROM orders
+        UNION ALL SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'products', COUNT(*) FROM products
+        UNION ALL SELECT 'status:' || COALESCE(status, 'pending'), COUNT(*)
+            FROM orders GROUP BY COALESCE(status, 'pending')
+    ''')
+    await db.execute('''
+        INSERT INTO shop_daily_revenue (day, orders, revenue)
+        SELECT date(created_at), COUNT(*), SUM(total_amount)
+        FROM orders GROUP BY date(created_at)
+    ''')
+
+def _add_column(table: str, column: str, declaration: str):
+    # ALTER TABLE ADD COLUMN не умеет IF NOT EXISTS
+    async def step(db):
+        columns = [row[1] for row in await db.execute_fetchall(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    return step
+
+MIGRATIONS = [
+    (1, 'base tables', [
         # Категории
-        await db.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS categories(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 description TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
+        ''',
         # Товары
-        await db.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS products(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 category_id INTEGER,
@@ -29,10 +421,9 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (category_id) REFERENCES categories (id)
             )
-        ''')
-        
-         # Пользователи
-        await db.execute('''
+        ''',
+        # Пользователи
+        '''
             CREATE TABLE IF NOT EXISTS users(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER UNIQUE NOT NULL,
@@ -43,10 +434,9 @@ async def init_db():
                 is_admin BOOLEAN DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
-        
+        ''',
         # Корзина
-        await db.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS cart(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -56,10 +446,9 @@ async def init_db():
                 FOREIGN KEY (user_id) REFERENCES users (user_id),
                 FOREIGN KEY (product_id) REFERENCES products (id)
             )
-        ''')
-
+        ''',
         # Заказы
-        await db.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS orders(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -70,10 +459,9 @@ async def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
-        ''')
-        
+        ''',
         # Элементы заказа
-        await db.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS order_items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 order_id INTEGER NOT NULL,
@@ -83,205 +471,693 @@ async def init_db():
                 FOREIGN KEY (order_id) REFERENCES orders (id),
                 FOREIGN KEY (product_id) REFERENCES products (id)
             )
-        ''')
-        
-        await db.commit()
-        print('База данных инициализирована')
+        ''',
+    ]),
+    (2, 'hot path indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+    ]),
+    (3, 'unique cart line', [
+        _dedupe_cart,
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_cart_user_product ON cart (user_id, product_id)',
+    ]),
+    (4, 'shop stats aggregates', [
+        '''
+            CREATE TABLE IF NOT EXISTS shop_stats(
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS shop_daily_revenue(
+                day TEXT PRIMARY KEY,
+                orders INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''',
+        _backfill_shop_stats,
+        *_STATS_TRIGGERS,
+    ]),
+    (5, 'orders by status index', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)',
+    ]),
+    (6, 'product sort indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_products_category_name ON products (category_id, name)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_id, price)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category_created ON products (category_id, created_at)',
+        # Префикс любого из индексов выше
+        'DROP INDEX IF EXISTS idx_products_category',
+    ]),
+    (7, 'product full-text search', [
+        '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description,
+                content='products', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        ''',
+        *_FTS_TRIGGERS,
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+    (8, 'fsm storage', [
+        # Состояние диалога: data — компактный JSON, NULL если данных нет
+        '''
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                bot_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                state TEXT,
+                data TEXT,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (bot_id, chat_id, user_id)
+            ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)',
+    ]),
+    (9, 'broadcasts', [
+        # Пользователь заблокировал бота — рассылки его пропускают
+        _add_column('users', 'blocked_at', 'TIMESTAMP'),
+        '''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_chat_id INTEGER NOT NULL,
+                progress_message_id INTEGER,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''',
+        # Прогресс по получателям: pending — взят в работу, дальше
+        # sent / blocked / failed
+        '''
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                broadcast_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (broadcast_id, user_id)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    (10, 'product photo file_id', [
+        # file_id фото после первой загрузки в Telegram: дальше фото
+        # отправляется по нему, без повторной загрузки image_path
+        _add_column('products', 'image_file_id', 'TEXT'),
+    ]),
+    (11, 'product sku', [
+        # Артикул — ключ массового импорта: строка с известным артикулом
+        # обновляет товар, с новым — добавляет
+        _add_column('products', 'sku', 'TEXT'),
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_products_sku ON products (sku) WHERE sku IS NOT NULL',
+    ]),
+    (12, 'order archive', [
+        # Доставленные и отмененные заказы старше ORDER_ARCHIVE_DAYS
+        # переносятся сюда вместе с позициями (archive.py); id сохраняется
+        '''
+            CREATE TABLE IF NOT EXISTS orders_archive(
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                total_amount REAL NOT NULL,
+                status TEXT,
+                phone TEXT,
+                address TEXT,
+                created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS order_items_archive (
+                id INTEGER PRIMARY KEY,
+                order_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                price REAL NOT NULL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created ON orders_archive (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_archive_status_created ON orders_archive (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_archive_order ON order_items_archive (order_id)',
+        # Ключи заказов обеих таблиц — для курсора страницы, заходящей в архив
+        '''
+            CREATE VIEW IF NOT EXISTS order_keys AS
+            SELECT id, created_at FROM orders
+            UNION ALL SELECT id, created_at FROM orders_archive
+        ''',
+        # Перенос в архив — не удаление: статистика магазина не меняется
+        'DROP TRIGGER IF EXISTS trg_stats_orders_delete',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_stats_orders_delete AFTER DELETE ON orders
+            WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE id = OLD.id)
+            BEGIN {_order_stats('OLD', '-')} END
+        ''',
+    ]),
+    (13, 'catalog cache versions', [
+        # Версия — номер последнего изменения, задевшего тег
+        '''
+            CREATE TABLE IF NOT EXISTS catalog_versions(
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_catalog_versions_version ON catalog_versions (version)',
+        *_VERSION_TRIGGERS,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    rows = await db.execute_fetchall('SELECT MAX(version) FROM schema_version')
+    return rows[0][0] or 0
+
+async def migrate():
+    """Применяет недостающие миграции; возвращает версию схемы до запуска
+    (0 — база только что создана)."""
+    async with pool.writer() as db:
+        # Обычный запуск — одно чтение заголовка базы, без DDL: версию
+        # в user_version пишет последняя успешная миграция
+        (current,), = await db.execute_fetchall('PRAGMA user_version')
+        if current >= SCHEMA_VERSION:
+            return current
+        current = await get_schema_version(db)
+    
+    for version, name, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        async with pool.transaction() as db:
+            for step in steps:
+                if isinstance(step, str):
+                    await db.execute(step)
+                else:
+                    await step(db)
+            await db.execute(
+                'INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                (version, name)
+            )
+        print(f'Миграция {version} применена: {name}')
+    async with pool.writer() as db:
+        await db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return current
+
+
+async def init_db():
+    await pool.open()
+    version = await migrate()
+    await pool.open_readers()
+    print('База данных инициализирована')
+    return version
+
+async def prepare_statements():
+    """Готовит запросы горячего пути на каждом соединении пула, чтобы первые
+    обновления после запуска брали их из кэша sqlite3.
+
+    Чтения выполняются с пустыми параметрами (и ничего не находят), записи —
+    в транзакции, которая откатывается: выражение попадает в кэш соединения
+    еще до выполнения, так что ошибки ограничений здесь не мешают.
+    """
+    hot = [query for query in q.QUERIES.values() if query.hot and not query.requires]
+    reads = [query for query in hot if query.sql.lstrip().startswith('SELECT')]
+    writes = [query for query in hot if query not in reads]
+
+    async def prepare(conn, queries):
+        for query in queries:
+            try:
+                await conn.execute_fetchall(query.sql, [None] * query.sql.count('?'))
+            except sqlite3.Error:
+                pass
+
+    # Читатели берутся по очереди: без параллельных запросов очередь пула
+    # выдает каждое соединение по одному разу
+    for _ in range(pool.size):
+        async with pool.reader() as conn:
+            await prepare(conn, reads)
+    async with pool.writer() as conn:
+        await conn.execute('BEGIN')
+        try:
+            await prepare(conn, writes)
+        finally:
+            await conn.rollback()
+
+async def close_db():
+    await pool.close()
+
+async def _catalog_changes(since: int):
+    return await _fetchall(q.CATALOG_CHANGES, (since,))
+
+async def track_catalog_changes():
+    """Кэш каталога этого процесса начинает сверяться с catalog_versions:
+    так до него доходят изменения, сделанные другими воркерами."""
+    version, = await _fetchone(q.CATALOG_VERSION)
+    catalog.track(version, _catalog_changes)
 
 
 # КАТЕГОРИИ        
+# Каталог читается через кэш процесса (cache.catalog); записи в каталог
+# сбрасывают ровно те ключи, которые от них зависят
 async def get_categories():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('SELECT id, name FROM categories ORDER BY name') as cursor:
-            return await cursor.fetchall()
+    return await catalog.get_or_load(
+        ('categories',),
+        lambda: _fetchall(q.GET_CATEGORIES),
+        tags=('categories',)
+    )
         
 async def add_category(name: str, description: str = ''):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'INSERT INTO categories (name, description) VALUES (?, ?)',
-            (name, description)
-        )
-        await db.commit()
+    await _execute(q.ADD_CATEGORY, (name, description))
+    catalog.invalidate('categories')
 
 # ТОВАРЫ
-async def get_products_by_category(category_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT id, name, price, stock, image_path FROM products WHERE category_id = ?',
-            (category_id,)
-        ) as cursor:
-            return await cursor.fetchall()
+async def get_products_page(category_id: int, sort: str = 'name', cursor: int = None,
+                            backward: bool = False, limit: int = PRODUCTS_PAGE_SIZE):
+    return await catalog.get_or_load(
+        ('products', category_id, sort, cursor, backward, limit),
+        lambda: _keyset_page(q.PRODUCTS_PAGE[sort], [category_id], cursor, backward, limit),
+        tags=(f'category:{category_id}',)
+    )
         
+class Product(NamedTuple):
+    id: int
+    category_id: int
+    name: str
+    description: str
+    price: float
+    stock: int
+    image_path: str
+    image_file_id: str
+
+async def _load_product(product_id: int):
+    row = await _fetchone(q.GET_PRODUCT, (product_id,))
+    return Product(*row) if row else None
+
 async def get_product(product_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT * FROM products WHERE id = ?',
-            (product_id,)
-        ) as cursor:
-            return await cursor.fetchone()
+    return await catalog.get_or_load(
+        ('product', product_id),
+        lambda: _load_product(product_id),
+        tags=(f'product:{product_id}',)
+    )
+
+async def set_product_image(product_id: int, image_path: str, file_id: str = None):
+    row = await _execute_returning(q.SET_PRODUCT_IMAGE, (image_path, file_id, product_id))
+    if row:
+        catalog.invalidate(f'product:{product_id}', f'category:{row[0]}')
+    return row is not None
+
+async def set_product_file_id(product_id: int, file_id: str = None):
+    await _execute(q.SET_PRODUCT_FILE_ID, (file_id, product_id))
+    catalog.invalidate(f'product:{product_id}')
         
 async def add_product(category_id: int, name: str, description: str, price: float, stock: int, image_path: str = None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            '''INSERT INTO products (category_id, name, description, price, stock, image_path)
-                VALUES (?, ?, ?, ?, ?, ?)''',
-            (category_id, name, description, price, stock, image_path)
-        )
-        await db.commit()
+    await _execute(q.ADD_PRODUCT, (category_id, name, description, price, stock, image_path))
+    catalog.invalidate(f'category:{category_id}')
+
+# МАССОВЫЙ ИМПОРТ И ЭКСПОРТ
+async def get_category_ids():
+    # Имя -> id; при повторяющихся именах берется первая категория
+    rows = await _fetchall(q.GET_CATEGORY_IDS)
+    return dict(rows)
+
+async def add_categories(names: list):
+    async with pool.transaction() as conn:
+        rows = await _rows(conn, q.ADD_CATEGORIES, (json.dumps(names, ensure_ascii=False),))
+    catalog.invalidate('categories')
+    return dict(rows)
+
+async def find_products_by_name(keys: list):
+    """keys — [(category_id, name)]; возвращает множество тех, что уже есть."""
+    rows = await _fetchall(q.FIND_PRODUCTS_BY_NAME, (json.dumps(keys, ensure_ascii=False),))
+    return {tuple(row) for row in rows}
+
+async def upsert_products(rows: list):
+    """rows — кортежи (sku, category_id, name, description, price, stock,
+    image_path); вся пачка пишется одной транзакцией.
+
+    Товар с уже известным артикулом обновляется, без артикула — всегда
+    добавляется. Пустой image_path не стирает уже загруженное фото.
+
+    Строки сначала ложатся во временную таблицу и переносятся в products
+    одним запросом: FTS5 сбрасывает накопленный индекс на диск в конце
+    каждого запроса, и при executemany прямо в products поиск
+    перестраивался бы после каждой строки.
+    """
+    async with pool.transaction() as conn:
+        await _run(conn, q.CREATE_PRODUCT_IMPORT)
+        await _run_many(conn, q.STAGE_PRODUCTS, rows)
+        await _run(conn, q.UPSERT_PRODUCTS)
+        await _run(conn, q.CLEAR_PRODUCT_IMPORT)
+    # Пачка задевает сотни товаров и категорий — проще сбросить каталог целиком
+    catalog.clear()
+
+async def export_products(batch: int = 1000):
+    """Весь каталог пачками по batch строк в порядке id, без чтения в память целиком."""
+    after = 0
+    while True:
+        rows = await _fetchall(q.EXPORT_PRODUCTS, (after, batch))
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+def _fts_query(text: str):
+    # Каждое слово — префиксный поиск; кавычки экранируют синтаксис FTS5
+    words = re.findall(r'\w+', text.lower())[:8]
+    return ' '.join(f'"{word}"*' for word in words)
+
+async def search_products(text: str, limit: int = SEARCH_RESULTS_LIMIT, offset: int = 0):
+    query = _fts_query(text)
+    if not query:
+        return []
+    return await _fetchall(q.SEARCH_PRODUCTS, (query, limit, offset))
+
+def invalidate_stock(items):
+    # items — пары (product_id, category_id) товаров с изменившимся остатком
+    tags = set()
+    for product_id, category_id in items:
+        tags.add(f'product:{product_id}')
+        tags.add(f'category:{category_id}')
+    catalog.invalidate(*tags)
 
 # ПОЛЬЗОВАТЕЛИ
+class User(NamedTuple):
+    id: int
+    user_id: int
+    username: str
+    full_name: str
+    phone: str
+    address: str
+    is_admin: bool
+    created_at: str
+    # Заблокировал бота: рассылки его пропускают до следующего /start
+    blocked_at: str
+
+
+# Профили читаются через LRU-кэш (cache.users); изменения пишутся в кэш
+# сразу после записи в базу
 async def get_or_create_user(user_id: int, username: str = None, full_name: str = None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT * FROM users WHERE user_id = ?',
-            (user_id,)
-        ) as cursor:
-            user = await cursor.fetchone()
-            
-        if not user:
-            await db.execute(
-                'INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)',
-                (user_id, username, full_name)
-            )
-            await db.commit()
-            
-            async with db.execute(
-                'SELECT * FROM users WHERE user_id = ?',
-                (user_id,)
-            ) as cursor:
-                user = await cursor.fetchone()
-        
+    user = users.get(user_id)
+    if user:
         return user
+    
+    row = await _fetchone(q.GET_USER, (user_id,))
+    if not row:
+        row = await _execute_returning(q.CREATE_USER, (user_id, username, full_name))
+    if not row:
+        # Пользователя создал параллельный запрос
+        row = await _fetchone(q.GET_USER, (user_id,))
+    
+    user = User(*row)
+    users.set(user_id, user)
+    return user
 
 async def update_user_info(user_id: int, phone: str = None, address: str = None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        if phone:
-            await db.execute(
-                'UPDATE users SET phone = ? WHERE user_id = ?',
-                (phone, user_id)
-            )
-        if address:
-            await db.execute(
-                'UPDATE users SET address = ? WHERE user_id = ?',
-                (address, user_id)
-            )
-        await db.commit()
+    row = await _execute_returning(q.UPDATE_USER_INFO, (phone or None, address or None, user_id))
+    if not row:
+        users.pop(user_id)
+        return None
+    
+    user = User(*row)
+    users.set(user_id, user)
+    return user
         
 # КОРЗИНА
+# Каждая операция — одно выражение с RETURNING: новое количество и название
+# товара приходят сразу, без повторного чтения корзины. Количество 0
+# означает, что строка удалена; None — что строки в корзине нет.
 async def add_to_cart(user_id: int, product_id: int, quantity: int = 1):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT id, quantity FROM cart WHERE user_id = ? AND product_id = ?',
-            (user_id, product_id)
-        ) as cursor:
-            item = await cursor.fetchone()
-            
-        if item :
-            new_quantity = item[1] + quantity
-            await db.execute(
-                'UPDATE cart SET quantity = ? WHERE id = ?',
-                (new_quantity, item[0])
-            )
-        else:
-            await db.execute(
-                'INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)',
-                (user_id, product_id, quantity)
-            )
-        await db.commit()
-        
-async def get_cart(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('''
-            SELECT c.id, p.name, p.price, c.quantity, p.id as product_id
-            FROM cart c
-            JOIN products p ON c.product_id = p.id
-            WHERE c.user_id = ?              
-                ''', (user_id,)) as cursor:
-            return await cursor.fetchall()
-
-async def update_cart_item(cart_item_id: int, quantity: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        if quantity <= 0:
-            await db.execute('DELETE FROM cart WHERE id = ?', (cart_item_id,))
-        else:
-            await db.execute(
-                'UPDATE cart SET quantity = ? WHERE id = ?',
-                (quantity, cart_item_id)
-            )
-        await db.commit()
+    return await _execute_returning(q.ADD_TO_CART, (user_id, product_id, quantity))
+
+async def set_cart_quantity(user_id: int, product_id: int, quantity: int):
+    if quantity <= 0:
+        return await remove_from_cart(user_id, product_id)
+    return await _execute_returning(q.SET_CART_QUANTITY, (user_id, product_id, quantity))
+
+async def change_cart_item(cart_item_id: int, user_id: int, delta: int):
+    line = await _execute_returning(q.CHANGE_CART_ITEM, (delta, cart_item_id, user_id, delta))
+    if line:
+        return line
+    # Количество ушло в ноль — удаляем строку
+    return await remove_cart_item(cart_item_id, user_id)
+
+async def remove_cart_item(cart_item_id: int, user_id: int):
+    return await _execute_returning(q.REMOVE_CART_ITEM, (cart_item_id, user_id))
+
+async def remove_from_cart(user_id: int, product_id: int):
+    return await _execute_returning(q.REMOVE_FROM_CART, (user_id, product_id))
+
+async def get_cart_item(cart_item_id: int, user_id: int):
+    return await _fetchone(q.GET_CART_ITEM, (cart_item_id, user_id))
         
+class CartLine(NamedTuple):
+    id: int
+    product_id: int
+    name: str
+    price: float
+    quantity: int
+    total: float
+
+
+class CartSnapshot(NamedTuple):
+    lines: list
+    count: int
+    total: float
+
+
+async def get_cart_snapshot(user_id: int):
+    rows = await _fetchall(q.GET_CART_SNAPSHOT, (user_id,))
+    lines = [CartLine(*row) for row in rows]
+    return CartSnapshot(
+        lines,
+        sum(line.quantity for line in lines),
+        sum(line.total for line in lines)
+    )
+
 async def clear_cart(user_id: int, db=None):
     if db:
-        await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+        await _run(db, q.CLEAR_CART, (user_id,))
     else:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
-            await db.commit()
+        await _execute(q.CLEAR_CART, (user_id,))
 
 # ЗАКАЗЫ
-async def get_cart_with_db(db, user_id: int):
-    async with db.execute('''
-        SELECT c.id, p.name, p.price, c.quantity, p.id as product_id
-        FROM cart c
-        JOIN products p ON c.product_id = p.id
-        WHERE c.user_id = ?              
-            ''', (user_id,)) as cursor:
-        return await cursor.fetchall()
+class OutOfStockError(Exception):
+    """Части товаров из корзины не хватает на складе.
+
+    items — список (product_id, name, requested, available).
+    """
+
+    def __init__(self, items):
+        self.items = items
+        super().__init__(f'Недостаточно товара: {[item[1] for item in items]}')
+
 
 async def clear_cart_with_db(db, user_id: int):
-    await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+    await _run(db, q.CLEAR_CART, (user_id,))
 
 async def create_order(user_id: int, phone: str, address: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cart_items = await get_cart_with_db(db, user_id)
+    # BEGIN IMMEDIATE сразу берет блокировку записи: остатки, проверенные
+    # здесь, не изменит параллельное оформление из другого соединения
+    async with pool.transaction() as db:
+        cart_items = await _rows(db, q.ORDER_CART, (user_id,))
         if not cart_items:
             return None
         
-        total_amount = sum(item[2] * item[3] for item in cart_items)
+        shortages = []
+        for product_id, quantity, price, name, stock, _ in cart_items:
+            cursor = await _run(db, q.TAKE_STOCK, (quantity, product_id, quantity))
+            if cursor.rowcount == 0:
+                shortages.append((product_id, name, quantity, stock))
+        if shortages:
+            # Исключение откатывает транзакцию вместе с уже списанными остатками;
+            # показанные покупателю остатки явно устарели — сбрасываем их
+            invalidate_stock((item[0], item[5]) for item in cart_items)
+            raise OutOfStockError(shortages)
         
-        cursor = await db.execute(
-            '''INSERT INTO orders (user_id, total_amount, phone, address)
-            VALUES (?, ?, ?, ?)''',
-            (user_id, total_amount, phone, address)
-        )
+        total_amount = sum(item[1] * item[2] for item in cart_items)
+        
+        cursor = await _run(db, q.CREATE_ORDER, (user_id, total_amount, phone, address))
         order_id = cursor.lastrowid
         
-        for item in cart_items:
-            await db.execute(
-                '''INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)''',
-                (order_id, item[4], item[3], item[2])
-            )
+        await _run(db, q.ADD_ORDER_ITEMS, (order_id, user_id))
             
         await clear_cart_with_db(db, user_id)
-        
-        await db.commit()
-        return order_id
     
-async def get_user_orders(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            'SELECT id, total_amount, status, created_at FROM orders WHERE user_id = ? ORDER BY created_at DESC',
-            (user_id,)
-        ) as cursor:
-            return await cursor.fetchall()
+    invalidate_stock((item[0], item[5]) for item in cart_items)
+    return order_id
+    
+def archive_horizon(days: float = ORDER_ARCHIVE_DAYS):
+    """Заказы новее горизонта всегда лежат в orders: архиватор переносит
+    только более старые. Формат — как у CURRENT_TIMESTAMP (UTC)."""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+# История заказов листается по orders, пока страница целиком новее горизонта
+# архива: архивные заказы все старше него. Короткую последнюю страницу
+# дочитывает запрос только к архиву; слияние обеих таблиц нужно, только
+# когда курсор или сама страница заходят за горизонт
+async def _orders_page(lists: q.OrderLists, params: list, cursor, newer: bool, limit: int):
+    horizon = archive_horizon()
+    if cursor is not None and not await _in_hot_window(cursor, horizon):
+        return await _keyset_page(lists.spanning, params, cursor, newer, limit, parts=2)
+    page = await _keyset_page(lists.hot, params, cursor, newer, limit)
+    # created_at — последняя колонка строк заказов
+    if page.rows and page.rows[-1][-1] < horizon:
+        # Среди старых заказов в orders могут оказаться архивные
+        return await _keyset_page(lists.spanning, params, cursor, newer, limit, parts=2)
+    if page.has_next:
+        return page
+    # orders кончились раньше горизонта: дальше идет архив с самого начала
+    tail = await _keyset_page(lists.archived, params, None, False, limit - len(page.rows))
+    return Page(page.rows + tail.rows, has_prev=page.has_prev, has_next=tail.has_next)
+
+async def _in_hot_window(order_id: int, horizon: str):
+    # Курсора нет в orders — он уже в архиве
+    row = await _fetchone(q.GET_ORDER_CREATED, (order_id,))
+    return row is not None and row[0] >= horizon
+
+async def get_user_orders(user_id: int, cursor: int = None, newer: bool = False, limit: int = ORDERS_PAGE_SIZE):
+    return await _orders_page(q.USER_ORDERS, [user_id], cursor, newer, limit)
+
+async def archive_orders_batch(horizon: str, limit: int):
+    """Переносит в архив до limit доставленных и отмененных заказов старше
+    horizon вместе с позициями; возвращает, сколько заказов перенесено."""
+    async with pool.transaction() as db:
+        rows = await _rows(db, q.PICK_ARCHIVE_ORDERS, (horizon, limit))
+        if not rows:
+            return 0
+        ids = json.dumps([order_id for order_id, in rows])
+        await _run(db, q.ARCHIVE_ORDERS, (ids,))
+        await _run(db, q.ARCHIVE_ORDER_ITEMS, (ids,))
+        await _run(db, q.DELETE_ARCHIVED_ITEMS, (ids,))
+        await _run(db, q.DELETE_ARCHIVED_ORDERS, (ids,))
+    return len(rows)
 
 # АДМИН
-async def get_all_orders():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute('''
-            SELECT o.id, u.full_name, o.total_amount, o.status, o.created_at
-            FROM orders o
-            JOIN users u ON o.user_id = u.user_id
-            ORDER BY o.created_at DESC                
-        ''') as cursor:
-            return await cursor.fetchall()
+async def get_all_orders(cursor: int = None, newer: bool = False, status: str = None, limit: int = ORDERS_PAGE_SIZE):
+    if status:
+        return await _orders_page(q.ORDERS_BY_STATUS, [status], cursor, newer, limit)
+    return await _orders_page(q.ALL_ORDERS, [], cursor, newer, limit)
 
 async def update_order_status(order_id: int, status: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            'UPDATE orders SET status = ? WHERE id = ?',
-            (status, order_id)
+    await _execute(q.UPDATE_ORDER_STATUS, (status, order_id))
+
+# СТАТИСТИКА
+# Счетчики читаются из shop_stats, которую поддерживают триггеры
+async def _stat(key: str):
+    result = await _fetchone(q.GET_STAT, (key,))
+    return result[0] if result else 0
+
+async def get_user_count():
+    return int(await _stat('users'))
+
+async def get_product_count():
+    return int(await _stat('products'))
+
+async def get_order_count():
+    return int(await _stat('orders'))
+
+async def get_total_revenue():
+    return await _stat('revenue')
+
+async def get_shop_stats(days: int = 7):
+    async with pool.reader() as conn:
+        rows = await _rows(conn, q.GET_STATS)
+        daily = await _rows(conn, q.GET_DAILY_REVENUE, (days,))
+    stats = dict(rows)
+    by_status = {
+        key.split(':', 1)[1]: int(value)
+        for key, value in stats.items()
+        if key.startswith('status:') and value
+    }
+    return {
+        'orders': int(stats.get('orders', 0)),
+        'revenue': stats.get('revenue', 0.0),
+        'users': int(stats.get('users', 0)),
+        'products': int(stats.get('products', 0)),
+        'by_status': by_status,
+        'daily': daily,
+    }
+
+# FSM
+# Строка есть, только пока у пользователя есть состояние или данные
+async def get_fsm_record(bot_id: int, chat_id: int, user_id: int):
+    return await _fetchone(q.GET_FSM_RECORD, (bot_id, chat_id, user_id))
+
+async def set_fsm_record(bot_id: int, chat_id: int, user_id: int, state: str = None, data: str = None):
+    if state is None and data is None:
+        await _execute(q.DELETE_FSM_RECORD, (bot_id, chat_id, user_id))
+        return
+    await _execute(q.SET_FSM_RECORD, (bot_id, chat_id, user_id, state, data, int(time.time())))
+
+async def delete_stale_fsm(max_age: int):
+    cursor = await _execute(q.DELETE_STALE_FSM, (int(time.time()) - max_age,))
+    return cursor.rowcount
+
+# РАССЫЛКИ
+async def create_broadcast(admin_chat_id: int, text: str):
+    row = await _execute_returning(q.CREATE_BROADCAST, (admin_chat_id, text))
+    return row
+
+async def set_broadcast_message(broadcast_id: int, message_id: int):
+    await _execute(q.SET_BROADCAST_MESSAGE, (message_id, broadcast_id))
+
+async def get_broadcast(broadcast_id: int):
+    return await _fetchone(q.GET_BROADCAST, (broadcast_id,))
+
+async def get_running_broadcasts():
+    rows = await _fetchall(q.GET_RUNNING_BROADCASTS)
+    return [row[0] for row in rows]
+
+async def set_broadcast_status(broadcast_id: int, status: str):
+    await _execute(q.SET_BROADCAST_STATUS, (status, broadcast_id))
+
+async def claim_broadcast_chunk(broadcast_id: int, after_id: int, limit: int):
+    """Следующие получатели после users.id = after_id, которым эта рассылка
+    еще не уходила. Они сразу помечаются pending, так что второй
+    исполнитель той же рассылки их не возьмет."""
+    async with pool.transaction() as conn:
+        rows = await _rows(conn, q.CLAIM_RECIPIENTS, (after_id, broadcast_id, limit))
+        await _run_many(conn, q.ADD_PENDING_DELIVERY, [(broadcast_id, user_id) for _, user_id in rows])
+    return rows
+
+async def record_deliveries(broadcast_id: int, results):
+    """results — [(user_id, status)] по одной пачке."""
+    async with pool.transaction() as conn:
+        await _run_many(
+            conn, q.SET_DELIVERY_STATUS,
+            [(status, broadcast_id, user_id) for user_id, status in results]
         )
-        await db.commit()
-    
\ No newline at end of file
+        blocked = [(user_id,) for user_id, status in results if status == 'blocked']
+        await _run_many(conn, q.BLOCK_USER, blocked)
+    # Профиль в кэше перечитается с blocked_at; кэши других воркеров
+    # догонят базу через USER_CACHE_TTL (unblock_user кэшу не верит)
+    for user_id, in blocked:
+        users.pop(user_id)
+
+async def reset_pending_deliveries(broadcast_id: int):
+    # После перезапуска: отправились ли pending, неизвестно — отправляем снова
+    await _execute(q.RESET_PENDING_DELIVERIES, (broadcast_id,))
+
+async def get_broadcast_counts(broadcast_id: int):
+    rows = await _fetchall(q.GET_BROADCAST_COUNTS, (broadcast_id,))
+    return dict(rows)
+
+async def unblock_user(user_id: int):
+    # blocked_at читается из базы, а не из кэша: блокировку мог записать
+    # другой воркер. Писатель нужен, только если пользователь заблокирован
+    if not await _fetchone(q.IS_USER_BLOCKED, (user_id,)):
+        return
+    await _execute(q.UNBLOCK_USER, (user_id,))
+    users.pop(user_id)
+
+
+# МЕТРИКИ
+metrics.instrument_queries(globals())
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import logging
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+import database as db
+from cache import LRUCache
+from config import FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_CLEANUP_INTERVAL, FSM_STATE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в таблице fsm_state основной базы.
+
+    Запись — (state, data) по ключу (bot, chat, user); data хранится
+    компактным JSON. Перед базой стоит LRU-кэш, так что get_state/get_data
+    в середине диалога не ходят в SQLite. Диалоги, которые не менялись
+    FSM_STATE_TTL секунд, удаляет фоновая очистка.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, cache_ttl: float = FSM_CACHE_TTL,
+                 state_ttl: int = FSM_STATE_TTL, cleanup_interval: float = FSM_CLEANUP_INTERVAL):
+        self.state_ttl = state_ttl
+        self.cleanup_interval = cleanup_interval
+        self._cache = LRUCache(cache_size, cache_ttl)
+        self._cleanup_task = None
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return key.bot_id, key.chat_id, key.user_id
+
+    async def _load(self, key):
+        record = self._cache.get(key)
+        if record is None:
+            record = await db.get_fsm_record(*key) or (None, None)
+            self._cache.set(key, record)
+        return record
+
+    async def _save(self, key, state, data):
+        await db.set_fsm_record(*key, state, data)
+        self._cache.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state=None):
+        key = self._key(key)
+        _, data = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data):
+        key = self._key(key)
+        state, _ = await self._load(key)
+        packed = json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data else None
+        await self._save(key, state, packed)
+
+    async def get_data(self, key: StorageKey):
+        _, data = await self._load(self._key(key))
+        # Разбор JSON заодно дает вызывающему свою копию данных
+        return json.loads(data) if data else {}
+
+    async def cleanup(self):
+        deleted = await db.delete_stale_fsm(self.state_ttl)
+        if deleted:
+            self._cache.clear()
+            logger.info('Удалено брошенных состояний FSM: %s', deleted)
+        return deleted
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                await self.cleanup()
+            except Exception:
+                logger.exception('Не удалось очистить состояния FSM')
+            await asyncio.sleep(self.cleanup_interval)
+
+    def start(self):
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def close(self):
+        # Соединения принадлежат пулу базы, их закрывает close_db()
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import (
     ReplyKeyboardMarkup,
@@ -5,7 +7,17 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton
 )
+import callbacks as cb
 import database as db
+from cache import catalog
+
+STATUS_ICONS = {
+    'pending': '⏳',
+    'processing': '🔄',
+    'shipped': '🚚',
+    'delivered': '✅',
+    'cancelled': '❌'
+}
 
 def main_menu():
     builder = ReplyKeyboardBuilder()
@@ -14,90 +26,208 @@ def main_menu():
     builder.button(text='Мои заказы')
     builder.button(text='👤 Профиль')
     builder.button(text='ℹ️ Помощь')
-    builder.adjust(2, 2, 1)
+    builder.button(text='🔍 Поиск')
+    builder.adjust(2, 2, 2)
     return builder.as_markup(resize_keyboard=True)
 
 async def categories_menu():
+    # Готовая разметка хранится в кэше каталога рядом с данными
+    return await catalog.get_or_load(
+        ('markup', 'categories'),
+        _build_categories_menu,
+        tags=('categories',)
+    )
+
+async def _build_categories_menu():
     categories = await db.get_categories()
     builder = InlineKeyboardBuilder()
     
     for category_id, category_name in categories:
         builder.button(
             text=category_name,
-            callback_data=f'category_{category_id}'
+            callback_data=cb.Category(category_id=category_id)
         )
         
-    builder.button(text='🔙 Назад', callback_data='back_to_main')
+    builder.button(text='🔙 Назад', callback_data=cb.MainMenu())
     builder.adjust(2)
     return builder.as_markup()
 
-async def products_menu(category_id: int):
-    products = await db.get_products_by_category(category_id)
+SORT_LABELS = {
+    'name': '🔤 По названию',
+    'price': '💰 По цене',
+    'new': '🆕 Новинки',
+}
+
+async def products_menu(category_id: int, sort: str = 'name', cursor: int = None, backward: bool = False):
+    return await catalog.get_or_load(
+        ('markup', 'products', category_id, sort, cursor, backward),
+        lambda: _build_products_menu(category_id, sort, cursor, backward),
+        tags=(f'category:{category_id}',)
+    )
+
+async def _build_products_menu(category_id: int, sort: str, cursor: int, backward: bool):
+    page = await db.get_products_page(category_id, sort, cursor, backward)
     builder = InlineKeyboardBuilder()
     
-    for product in products:
+    for product in page.rows:
         product_id, name, price, stock, _ = product
         text = f'{name} - {price} - ({stock} шт.)'
         builder.button(
             text=text,
-            callback_data=f'product_{product_id}'
+            callback_data=cb.Product(product_id=product_id)
         )
     
-    builder.button(text='🔙 Назад к категориям', callback_data='back_to_categories')
-    builder.adjust(1)
+    nav = 0
+    if not page.rows and page.has_prev:
+        # Устаревший или поддельный курсор: за ним товаров нет
+        builder.button(text='⬅️ В начало', callback_data=cb.Category(category_id=category_id, sort=sort))
+        nav += 1
+    elif page.has_prev:
+        builder.button(text='⬅️', callback_data=cb.Category(
+            category_id=category_id, sort=sort, backward=True, cursor=page.rows[0][0]
+        ))
+        nav += 1
+    if page.has_next and page.rows:
+        builder.button(text='➡️', callback_data=cb.Category(
+            category_id=category_id, sort=sort, cursor=page.rows[-1][0]
+        ))
+        nav += 1
+    
+    for name, label in SORT_LABELS.items():
+        builder.button(
+            text=f'• {label}' if name == sort else label,
+            callback_data=cb.Category(category_id=category_id, sort=name)
+        )
+    
+    builder.button(text='🔙 Назад к категориям', callback_data=cb.Categories())
+    builder.adjust(*[1] * len(page.rows), *([nav] if nav else []), 3, 1)
     return builder.as_markup()
 
-def product_menu(product_id: int):
+@lru_cache(maxsize=1024)
+def product_menu(product_id: int, category_id: int = None, admin: bool = False):
     builder = InlineKeyboardBuilder()
-    builder.button(text='➕ Добавить в корзину', callback_data=f'add_to_cart_{product_id}')
-    builder.button(text='➖ Убрать из корзины', callback_data=f'remove_from_cart_{product_id}')
-    builder.button(text='🔙 Назад', callback_data='back_to_products')
+    builder.button(text='➕ Добавить в корзину', callback_data=cb.AddToCart(product_id=product_id))
+    builder.button(text='➖ Убрать из корзины', callback_data=cb.RemoveFromCart(product_id=product_id))
+    if admin:
+        builder.button(text='🖼 Фото', callback_data=cb.AdminProductPhoto(product_id=product_id))
+    builder.button(
+        text='🔙 Назад',
+        callback_data=cb.Category(category_id=category_id) if category_id else cb.Categories()
+    )
     builder.adjust(1)
     return builder.as_markup()
 
-async def cart_menu(user_id: int):
-    cart_items = await db.get_cart(user_id)
+# Telegram принимает не больше 100 кнопок в клавиатуре
+CART_MENU_ITEMS = 90
+
+def cart_menu(cart):
     builder = InlineKeyboardBuilder()
     
-    for item in cart_items:
-        cart_item_id, name, price, quantity, product_id = item
+    for line in cart.lines[:CART_MENU_ITEMS]:
         builder.button(
-            text=f'✏️ {name} (x{quantity})',
-            callback_data=f'edit_cart_{cart_item_id}'
+            text=f'✏️ {line.name} (x{line.quantity})',
+            callback_data=cb.EditCartItem(item_id=line.id)
         )
     
-    if cart_items:
-        builder.button(text='✅ Оформить заказ', callback_data='checkout')
-        builder.button(text='🗑️ Очистить корзину', callback_data='clear_cart')
+    if cart.lines:
+        builder.button(text='✅ Оформить заказ', callback_data=cb.Checkout())
+        builder.button(text='🗑️ Очистить корзину', callback_data=cb.ClearCart())
         
-    builder.button(text='🛒 Продолжить покупки', callback_data='back_to_categories')
+    builder.button(text='🛒 Продолжить покупки', callback_data=cb.Categories())
+    builder.adjust(1)
+    return builder.as_markup()
+
+def search_results_menu(products, query: str):
+    builder = InlineKeyboardBuilder()
+    for product_id, name, price, stock, *_ in products:
+        builder.button(text=f'{name} - {price} - ({stock} шт.)', callback_data=cb.Product(product_id=product_id))
+    builder.button(text='🔎 Искать в inline-режиме', switch_inline_query_current_chat=query)
+    builder.adjust(1)
+    return builder.as_markup()
+
+@lru_cache(maxsize=1024)
+def search_result_menu(product_id: int):
+    # Клавиатура под сообщением из inline-режима: у него нет обычного
+    # message, поэтому только действия, которые не редактируют сообщение
+    builder = InlineKeyboardBuilder()
+    builder.button(text='➕ Добавить в корзину', callback_data=cb.AddToCart(product_id=product_id))
+    builder.button(text='➖ Убрать из корзины', callback_data=cb.RemoveFromCart(product_id=product_id))
     builder.adjust(1)
     return builder.as_markup()
 
 def quantity_menu(cart_item_id: int, current_qty: int):
     builder = InlineKeyboardBuilder()
-    builder.button(text='➖', callback_data=f'decrease_{cart_item_id}')
-    builder.button(text=f'{current_qty}', callback_data=f'show_qty_{cart_item_id}')
-    builder.button(text='➕', callback_data=f'increase_{cart_item_id}')
-    builder.button(text='🗑️ Удалить', callback_data=f'delete_{cart_item_id}')
-    builder.button(text='🔙 Назад', callback_data=f'back_to_cart')
+    builder.button(text='➖', callback_data=cb.CartQuantity(item_id=cart_item_id, delta=-1))
+    builder.button(text=f'{current_qty}', callback_data=cb.CartQuantity(item_id=cart_item_id, delta=0))
+    builder.button(text='➕', callback_data=cb.CartQuantity(item_id=cart_item_id, delta=1))
+    builder.button(text='🗑️ Удалить', callback_data=cb.DeleteCartItem(item_id=cart_item_id))
+    builder.button(text='🔙 Назад', callback_data=cb.Cart())
     builder.adjust(3, 1, 1)
     return builder.as_markup()
 
+def _page_buttons(builder, page, schema, **fields):
+    # Курсор — id крайнего заказа на странице. За курсором страница бывает
+    # пустой (заказы ушли из списка, пока его листали) — тогда только в начало
+    buttons = 0
+    if not page.rows:
+        if page.has_prev:
+            builder.button(text='⬅️ В начало', callback_data=schema(**fields))
+            buttons += 1
+        return buttons
+    if page.has_prev:
+        builder.button(text='⬅️ Новее', callback_data=schema(newer=True, cursor=page.rows[0][0], **fields))
+        buttons += 1
+    if page.has_next:
+        builder.button(text='Старее ➡️', callback_data=schema(cursor=page.rows[-1][0], **fields))
+        buttons += 1
+    return buttons
+
+def orders_menu(page):
+    builder = InlineKeyboardBuilder()
+    _page_buttons(builder, page, cb.Orders)
+    builder.adjust(2)
+    return builder.as_markup()
+
+def admin_orders_menu(page, status: str = None):
+    builder = InlineKeyboardBuilder()
+    buttons = _page_buttons(builder, page, cb.AdminOrdersPage, status=status or 'all')
+    
+    builder.button(text='📦 Все', callback_data=cb.AdminOrdersPage())
+    for name, icon in STATUS_ICONS.items():
+        builder.button(text=f'{icon} {name}', callback_data=cb.AdminOrdersPage(status=name))
+    sizes = [buttons] if buttons else []
+    builder.adjust(*sizes, 3)
+    return builder.as_markup()
+
 def checkout_menu():
     builder = InlineKeyboardBuilder()
-    builder.button(text='✅ Подтвердить заказ', callback_data='confirm_order')
-    builder.button(text='✏️ Изменить данные', callback_data='edit_profile')
-    builder.button(text='❌ Отменить', callback_data='back_to_cart')
+    builder.button(text='✅ Подтвердить заказ', callback_data=cb.ConfirmOrder())
+    builder.button(text='✏️ Изменить данные', callback_data=cb.EditProfile())
+    builder.button(text='❌ Отменить', callback_data=cb.Cart())
     builder.adjust(1)
     return builder.as_markup()
 
 def admin_menu():
     builder = InlineKeyboardBuilder()
-    builder.button(text='📊 Статистика', callback_data='admin_stats')
-    builder.button(text='📦 Заказы', callback_data='admin_orders')
-    builder.button(text='➕ Добавить товар', callback_data='admin_add_product')
-    builder.button(text='🏷️ Добавить категорию', callback_data='admin_add_category')
+    builder.button(text='📊 Статистика', callback_data=cb.AdminStats())
+    builder.button(text='📦 Заказы', callback_data=cb.AdminOrders())
+    builder.button(text='➕ Добавить товар', callback_data=cb.AdminAddProduct())
+    builder.button(text='🏷️ Добавить категорию', callback_data=cb.AdminAddCategory())
+    builder.button(text='📣 Рассылка', callback_data=cb.AdminBroadcast())
+    builder.button(text='📥 Импорт каталога', callback_data=cb.AdminImport())
+    builder.button(text='📤 Экспорт каталога', callback_data=cb.AdminExport())
+    builder.adjust(2)
+    return builder.as_markup()
+
+def export_menu():
+    builder = InlineKeyboardBuilder()
+    builder.button(text='CSV', callback_data=cb.AdminExport(fmt='csv'))
+    builder.button(text='JSON', callback_data=cb.AdminExport(fmt='json'))
     builder.adjust(2)
     return builder.as_markup()
+
+def broadcast_menu(broadcast_id: int):
+    builder = InlineKeyboardBuilder()
+    builder.button(text='⛔ Остановить', callback_data=cb.CancelBroadcast(broadcast_id=broadcast_id))
+    return builder.as_markup()
     
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""Запуск и остановка процесса бота.
+
+Запуск: init_db() сверяет только версию схемы, а каталог и подготовленные
+выражения прогреваются в фоне — прием обновлений начинается сразу.
+
+Остановка: к вызову shutdown() прием обновлений уже прекращен (polling
+остановлен по SIGINT/SIGTERM, webhook закрыл порт). Начатые обработчики
+дорабатывают не дольше SHUTDOWN_TIMEOUT, затем фоновые задачи
+останавливаются, отложенные записи корзины сбрасываются, сессия Bot API
+и база закрываются.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+import archive
+import broadcast
+import catalog_io
+import database as db
+from config import SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight(BaseMiddleware):
+    """Внешняя middleware на dp.update: задачи, которые сейчас обрабатывают
+    обновление (задача polling, запрос webhook или задача воркера)."""
+
+    def __init__(self):
+        self._tasks = set()
+
+    @property
+    def count(self):
+        return len(self._tasks)
+
+    async def __call__(self, handler, event, data):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.discard(task)
+
+    async def drain(self, timeout: float):
+        """Ждет начатые обработчики не дольше timeout, остальные отменяет:
+        транзакция прерванного обработчика откатывается целиком."""
+        deadline = time.monotonic() + timeout
+        # Пока ждем, могут начаться обновления, которые polling уже получил
+        while self._tasks and time.monotonic() < deadline:
+            await asyncio.wait(list(self._tasks), timeout=deadline - time.monotonic())
+        if not self._tasks:
+            return True
+        tasks = list(self._tasks)
+        logger.warning('Обработчики не успели завершиться, отменяю: %s', len(tasks))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return False
+
+
+in_flight = InFlight()
+
+
+# ЗАПУСК
+_prewarm = None
+
+
+async def prewarm():
+    started = time.perf_counter()
+    try:
+        await db.prepare_statements()
+        # Первая страница каждой категории в порядке по умолчанию
+        for category_id, _ in await db.get_categories():
+            await db.get_products_page(category_id)
+    except Exception:
+        logger.exception('Прогрев не удался')
+        return
+    logger.info('Прогрев каталога и запросов: %.2f с', time.perf_counter() - started)
+
+
+def start_prewarm():
+    global _prewarm
+    _prewarm = asyncio.create_task(prewarm())
+    return _prewarm
+
+
+# ОСТАНОВКА
+async def shutdown(bot, cart_writes, timeout: float = SHUTDOWN_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    if _prewarm:
+        _prewarm.cancel()
+
+    if in_flight.count:
+        logger.info('Жду обработчики: %s', in_flight.count)
+    await in_flight.drain(deadline - time.monotonic())
+
+    # Рассылки и архив продолжатся при следующем запуске, импорт — нет: его ждем
+    await broadcast.stop_all()
+    await archive.stop()
+    await catalog_io.stop_all(deadline - time.monotonic())
+    await cart_writes.flush_all()
+
+    await bot.session.close()
+    await db.close_db()
+    logger.info('Бот остановлен')
@@ -1,6 +1,8 @@
 import asyncio
+import html
 import logging
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.dispatcher.event.bases import UNHANDLED
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -8,21 +10,73 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import database as db
+import archive
+import broadcast
+import callbacks as cb
+import catalog_io
 import keyboards as kb
-from config import BOT_TOKEN, ID_ADMIN
-import aiosqlite
+import lifecycle
+import media
+import metrics
+from callbacks import CallbackRouter
+from cart_buffer import CartWriteBehind
+from cache import catalog
+from config import (
+    BOT_MODE,
+    BOT_TOKEN,
+    CART_WRITE_WINDOW,
+    FSM_STORAGE,
+    ID_ADMIN,
+    METRICS_HOST,
+    METRICS_PORT,
+    SEARCH_RESULTS_LIMIT,
+    TG_GLOBAL_BURST,
+    TG_GLOBAL_RATE,
+    WORKERS
+)
+from fsm_storage import SQLiteStorage
+from supervisor import run_supervisor
+from throttling import LANES, RequestScheduler
+from webhook import run_webhook
 logging.basicConfig(level=logging.INFO)
 
 
 bot = Bot(token=BOT_TOKEN)
+# Все исходящие запросы проходят через общий и початовые лимиты Telegram.
+# Счетчик у каждого процесса свой, поэтому общий лимит делится между
+# воркерами; початовые — нет: чат всегда обслуживает один воркер
+outbound = RequestScheduler(rate=TG_GLOBAL_RATE / WORKERS, burst=max(1, TG_GLOBAL_BURST / WORKERS))
+bot.session.middleware(outbound)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+on_callback = CallbackRouter()
+
+# Метрики для /metrics: время обработчиков и запросов к Bot API
+# (после очереди RequestScheduler), запросы к базе считает database.py
+bot.session.middleware(metrics.TelegramMetrics())
+handler_metrics = metrics.HandlerMetrics(on_callback)
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.middleware(handler_metrics)
+# Начатые обработчики, которых остановка дождется
+dp.update.outer_middleware(lifecycle.in_flight)
+
+def runtime_metrics():
+    lanes = outbound.stats()
+    yield from metrics.gauge(
+        'shop_outbound_queued', 'Запросов к Bot API в очереди RequestScheduler',
+        {name: lanes[name]['queued'] for name in LANES.values()}, 'lane'
+    )
+
+metrics.collectors['outbound'] = runtime_metrics
 
 
 class OrderStates(StatesGroup):
     waiting_for_phone = State()
     waiting_for_address = State()
     
+class SearchState(StatesGroup):
+    waiting_for_query = State()
+    
 class AdminState(StatesGroup):
     waiting_for_category_name = State()
     waiting_for_category_desc = State()
@@ -30,7 +84,22 @@ class AdminState(StatesGroup):
     waiting_for_product_desc = State()
     waiting_for_product_price = State()
     waiting_for_product_stock = State()
+    waiting_for_broadcast_text = State()
+    waiting_for_product_photo = State()
+    waiting_for_catalog_file = State()
+
+def product_card_text(name: str, description: str, price: float, stock: int):
+    return (
+        f'<b>{html.escape(name)}</b>\n\n'
+        f'📝 Описание: {html.escape(description or "Нет описания")}\n'
+        f'💰 Цена: {price}\n'
+        f'📦 В наличии: {stock} шт.\n\n'
+        f'🛒 Выберите действие:'
+    )
 
+# Обработчики с одним ответом возвращают метод, а не ждут его: в режиме
+# webhook он уходит прямо в ответе на запрос Telegram, при polling его
+# отправляет диспетчер
 @dp.message(Command('start'))
 async def start_comand(message: types.Message):
     user = await db.get_or_create_user(
@@ -38,6 +107,9 @@ async def start_comand(message: types.Message):
         username=message.from_user.username,
         full_name=message.from_user.full_name
     )
+    # Вернулся после блокировки бота — снова получает рассылки. Запись —
+    # только для заблокировавших: обычный /start обходится чтением
+    await db.unblock_user(user.user_id)
     
     welcome_text = (
         'Добро можаловать в мой магазин!\n\n'
@@ -49,82 +121,107 @@ async def start_comand(message: types.Message):
         'Используйте кнопки ниже для навигации:'
     )
     
-    await message.answer(welcome_text, reply_markup=kb.main_menu())
+    return message.answer(welcome_text, reply_markup=kb.main_menu())
 
 @dp.message(F.text == 'Каталог')
 async def show_categories(message: types.Message):
     categories = await db.get_categories()
     if not categories:
-        await message.answer('Категории пока пусты. Загляните позже!')
-        return
+        return message.answer('Категории пока пусты. Загляните позже!')
     
     keyboard = await kb.categories_menu()
-    await message.answer('📂 Выберите категорию:', reply_markup=keyboard)
+    return message.answer('📂 Выберите категорию:', reply_markup=keyboard)
+
+# Лимит длины одного сообщения Telegram, в символах UTF-16
+MESSAGE_LIMIT = 4096
+
+def split_message(blocks, limit: int = MESSAGE_LIMIT):
+    """Собирает блоки текста в сообщения не длиннее limit."""
+    parts, current, size = [], [], 0
+    for block in blocks:
+        block_size = len(block.encode('utf-16-le')) // 2
+        if current and size + block_size > limit:
+            parts.append(''.join(current))
+            current, size = [], 0
+        current.append(block)
+        size += block_size
+    if current:
+        parts.append(''.join(current))
+    return parts
+
+def cart_texts(cart):
+    blocks = ['🛒 Ваша корзина:\n\n']
+    blocks.extend(
+        f'{line.name}\n {line.price} * {line.quantity} = {line.total}\n'
+        for line in cart.lines
+    )
+    blocks.append(f'\n💰 Итого: {cart.total}')
+    return split_message(blocks)
 
 @dp.message(F.text == '🛒 Корзина')
 async def show_cart(message: types.Message):
-    cart_items = await db.get_cart(message.from_user.id)
-    
-    if not cart_items:
-        await message.answer('🛒 Ваша корзина пуста')
-        return
+    await cart_writes.flush_user(message.from_user.id)
+    cart = await db.get_cart_snapshot(message.from_user.id)
     
-    cart_text = '🛒 Ваша корзина:\n\n'
-    total = 0
+    if not cart.lines:
+        return message.answer('🛒 Ваша корзина пуста')
     
-    for item in cart_items:
-        _, name, price, quantity, _ = item
-        item_total = price *quantity
-        cart_text += f' {name}\n {price} {quantity} = {item_total}\n'
-        total += item_total
-    
-    cart_text += f'\n💰 Итого: {total}'
-    
-    keyboard = await kb.cart_menu(message.from_user.id)
-    await message.answer(cart_text, reply_markup=keyboard)
+    *head, last = cart_texts(cart)
+    for text in head:
+        await message.answer(text)
+    return message.answer(last, reply_markup=kb.cart_menu(cart))
 
-@dp.message(F.text == 'Мои заказы')
-async def show_orders(message: types.Message):
-    orders = await db.get_user_orders(message.from_user.id)
-    
-    if not orders:
-        await message.answer('📦 У вас пока нет заказов')
-        return
-    
+def user_orders_text(page):
     orders_text = '📦 Ваши заказы:\n\n'
-    for order in orders:
+    for order in page.rows:
         order_id, total, status, created_at = order
-        status_icons = {
-            'pending': '⏳',
-            'processing': '🔄',
-            'shipped': '🚚',
-            'delivered': '✅',
-            'cancelled': '❌'
-        }
-        icon = status_icons.get(status, '📦')
+        icon = kb.STATUS_ICONS.get(status, '📦')
         orders_text += f'{icon} Заказ #{order_id}\n'
         orders_text += f'   Сумма: {total}\n'
         orders_text += f'   Статус: {status}\n'
         orders_text += f'   Дата: {created_at}\n\n'
-        
-    await message.answer(orders_text)
+    return orders_text
 
-@dp.message(F.text == '👤 Профиль')
-async def show_profile(message: types.Message):
-    user = await db.get_or_create_user(message.from_user.id)
+@dp.message(F.text == 'Мои заказы')
+async def show_orders(message: types.Message):
+    page = await db.get_user_orders(message.from_user.id)
     
-    profile_text = (
-        f'👤 Ваш профиль:\n\n'
-        f'🆔 ID: {user[1]}\n'
-        f'👤 Имя: {user[3] or 'Не указано'}\n'
-        f'📱 Телефон: {user[4] or 'Не указан'}\n'
-        f'🏠 Адрес: {user[5] or 'Не указан'}\n\n'
-        f'📅 Регистрация: {user[7][:10] if user[7] else "Неизвестно"}'
+    if not page.rows:
+        return message.answer('📦 У вас пока нет заказов')
+        
+    return message.answer(user_orders_text(page), reply_markup=kb.orders_menu(page))
+
+@on_callback(cb.Orders)
+async def show_orders_page(callback: types.CallbackQuery, callback_data: cb.Orders):
+    page = await db.get_user_orders(
+        callback.from_user.id,
+        cursor=callback_data.cursor or None,
+        newer=callback_data.newer
     )
     
+    if page.rows:
+        await callback.message.edit_text(user_orders_text(page), reply_markup=kb.orders_menu(page))
+    await callback.answer()
+
+def profile_text(user):
+    return (
+        f'👤 Ваш профиль:\n\n'
+        f'🆔 ID: {user.user_id}\n'
+        f'👤 Имя: {user.full_name or 'Не указано'}\n'
+        f'📱 Телефон: {user.phone or 'Не указан'}\n'
+        f'🏠 Адрес: {user.address or 'Не указан'}\n\n'
+        f'📅 Регистрация: {user.created_at[:10] if user.created_at else "Неизвестно"}'
+    )
+
+def profile_menu():
     builder = InlineKeyboardBuilder()
-    builder.button(text='✏️ Редактировать профиль', callback_data='edit_profile')
-    await message.answer(profile_text, reply_markup=builder.as_markup())
+    builder.button(text='✏️ Редактировать профиль', callback_data=cb.EditProfile())
+    return builder.as_markup()
+
+@dp.message(F.text == '👤 Профиль')
+async def show_profile(message: types.Message):
+    user = await db.get_or_create_user(message.from_user.id)
+    return message.answer(profile_text(user), reply_markup=profile_menu())
     
 @dp.message(F.text == 'ℹ️ Помощь')
 async def show_help(message: types.Message):
@@ -150,73 +247,177 @@ async def show_help(message: types.Message):
         " Картой онлайн\n"
         " Переводом на карту"
     )
-    await message.answer(help_text, parse_mode='HTML')
+    return message.answer(help_text, parse_mode='HTML')
+
+@dp.message(F.text == '🔍 Поиск')
+async def start_search(message: types.Message, state: FSMContext):
+    await state.set_state(SearchState.waiting_for_query)
+    return message.answer('🔍 Введите название или часть описания товара:')
 
-@dp.callback_query(F.data.startswith('category_'))
-async def show_products(callback: types.CallbackQuery):
-    category_id = int(callback.data.split('_')[1])
-    keyboard = await kb.products_menu(category_id)
-    await callback.message.edit_text('🛍️ Выберите товар:', reply_markup=keyboard)
+@dp.message(SearchState.waiting_for_query, F.text)
+async def process_search(message: types.Message, state: FSMContext):
+    query = message.text.strip()
+    products = await db.search_products(query)
+    await state.clear()
+    
+    if not products:
+        return message.answer('😔 Ничего не найдено. Попробуйте другой запрос.')
+    
+    return message.answer(
+        f'🔍 Найдено по запросу «{query}»:',
+        reply_markup=kb.search_results_menu(products, query)
+    )
+
+@dp.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    offset = int(inline_query.offset or 0)
+    products = await db.search_products(inline_query.query, offset=offset)
+    
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(product_id),
+            title=name,
+            description=f'💰 {price} • 📦 {stock} шт.',
+            input_message_content=types.InputTextMessageContent(
+                message_text=product_card_text(name, description, price, stock),
+                parse_mode='HTML'
+            ),
+            reply_markup=kb.search_result_menu(product_id)
+        )
+        for product_id, name, price, stock, description, _ in products
+    ]
+    next_offset = str(offset + len(products)) if len(products) == SEARCH_RESULTS_LIMIT else ''
+    return inline_query.answer(results, cache_time=30, next_offset=next_offset)
+
+@on_callback(cb.Category)
+async def show_products(callback: types.CallbackQuery, callback_data: cb.Category):
+    if callback_data.sort not in kb.SORT_LABELS:
+        await callback.answer()
+        return
+    
+    keyboard = await kb.products_menu(
+        callback_data.category_id,
+        callback_data.sort,
+        cursor=callback_data.cursor or None,
+        backward=callback_data.backward
+    )
+    await edit_or_replace(callback.message, '🛍️ Выберите товар:', reply_markup=keyboard)
     await callback.answer()
+
+# Подпись к фото — не длиннее 1024 символов
+CAPTION_LIMIT = 1024
+
+def _longest(fits, length: int):
+    # Наибольшая длина от 0 до length, при которой fits(длина) еще верно
+    low, high = 0, length
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def product_caption(product):
+    name, description = product.name, product.description or ''
+    text = product_card_text(name, description, product.price, product.stock)
+    if len(text) <= CAPTION_LIMIT:
+        return text
+    # Режется описание, а если не хватает и этого — название (до
+    # экранирования), чтобы не сломать HTML и не потерять цену
+    def card(name_length, length):
+        return product_card_text(
+            name if name_length == len(name) else name[:name_length] + '…',
+            description[:length] + '…', product.price, product.stock
+        )
     
-@dp.callback_query(F.data.startswith('product_'))
-async def show_product(callback: types.CallbackQuery):
-    product_id = int(callback.data.split('_')[1])
+    def fits(name_length, length):
+        return len(card(name_length, length)) <= CAPTION_LIMIT
+    
+    if fits(len(name), 0):
+        return card(len(name), _longest(lambda length: fits(len(name), length), len(description)))
+    return card(_longest(lambda name_length: fits(name_length, 0), len(name)), 0)
+
+async def edit_or_replace(message: types.Message, text: str, **kwargs):
+    # Сообщение с фото нельзя превратить в текстовое — оно заменяется новым
+    if message.photo:
+        await message.delete()
+        return await message.answer(text, **kwargs)
+    return await message.edit_text(text, **kwargs)
+    
+@on_callback(cb.Product)
+async def show_product(callback: types.CallbackQuery, callback_data: cb.Product):
+    product_id = callback_data.product_id
     product = await db.get_product(product_id)
     
     if not product:
         await callback.answer('Товары не найдены')
         return
     
-    product_text = (
-        f'<b>{product[2]}</b>\n\n'
-        f'📝 Описание: {product[3] or "Нет описания"}\n'
-        f'💰 Цена: {product[4]}\n'
-        f'📦 В наличии: {product[5]} шт.\n\n'
-        f'🛒 Выберите действие:'
-    )
+    keyboard = kb.product_menu(product_id, product.category_id, callback.from_user.id in ID_ADMIN)
+    if product.image_file_id or product.image_path:
+        sent = await media.answer_product_photo(callback.message, product, product_caption(product), keyboard)
+        if sent:
+            await callback.message.delete()
+            await callback.answer()
+            return
     
-    keyboard = kb.product_menu(product_id)
-    await callback.message.edit_text(product_text, reply_markup=keyboard, parse_mode='HTML')
+    product_text = product_card_text(product.name, product.description, product.price, product.stock)
+    await edit_or_replace(callback.message, product_text, reply_markup=keyboard, parse_mode='HTML')
     await callback.answer()
     
-@dp.callback_query(F.data.startswith('add_to_cart_'))
-async def add_to_cart_handler(callback: types.CallbackQuery):
-    product_id = int(callback.data.split('_')[3])
-    await db.add_to_cart(callback.from_user.id, product_id)
+@on_callback(cb.AddToCart)
+async def add_to_cart_handler(callback: types.CallbackQuery, callback_data: cb.AddToCart):
+    await db.add_to_cart(callback.from_user.id, callback_data.product_id)
     await callback.answer('✅ Товар добавлен в корзину!')
 
-@dp.callback_query(F.data == 'back_to_categories')
-async def back_to_categories(callback: types.CallbackQuery):
+@on_callback(cb.Categories)
+async def back_to_categories(callback: types.CallbackQuery, callback_data: cb.Categories):
     keyboard = await kb.categories_menu()
-    await callback.message.edit_text('📂 Выберите категорию:', reply_markup=keyboard)
+    await edit_or_replace(callback.message, '📂 Выберите категорию:', reply_markup=keyboard)
     await callback.answer()
     
-@dp.callback_query(F.data.startswith('back_to_cart'))
-async def back_to_cart(callback: types.CallbackQuery):
-    cart_items = await db.get_cart(callback.from_user.id)
+async def edit_cart_message(message: types.Message, user_id: int):
+    cart = await db.get_cart_snapshot(user_id)
+    
+    if not cart.lines:
+        await message.edit_text('🛒 Ваша корзина пуста')
+        return
     
-    if not cart_items:
-        await callback.message.edit_text('🛒 Ваша корзина пуста')
+    first, *rest = cart_texts(cart)
+    keyboard = kb.cart_menu(cart)
+    if not rest:
+        await message.edit_text(first, reply_markup=keyboard)
         return
-    cart_text = '🛒 Ваша корзина:\n\n'
-    total = 0
-    
-    for item in cart_items:
-        _, name, price, quantity, _ = item
-        item_total = price * quantity
-        cart_text += f'{name}\n {price} * {quantity} = {item_total}\n'
-        total += item_total
-    cart_text += f'\n 💰 Итого:  {total}'
-    
-    keyboard = await kb.cart_menu(callback.from_user.id)
-    await callback.message.edit_text(cart_text, reply_markup=keyboard)
+    
+    # Длинная корзина: начало на месте старого сообщения, остальное новыми,
+    # кнопки — под последним
+    await message.edit_text(first)
+    for text in rest[:-1]:
+        await message.answer(text)
+    await message.answer(rest[-1], reply_markup=keyboard)
+
+@on_callback(cb.Cart)
+async def back_to_cart(callback: types.CallbackQuery, callback_data: cb.Cart):
+    await cart_writes.flush_user(callback.from_user.id)
+    await edit_cart_message(callback.message, callback.from_user.id)
     await callback.answer()
-@dp.callback_query(F.data == 'checkout')
-async def start_checkout(callback: types.CallbackQuery, state: FSMContext):
+def checkout_text(user, cart):
+    return (
+        '✅ Подтвердите заказ:\n\n'
+        f'📱 Телефон: {user.phone}\n'
+        f'🏠 Адрес: {user.address}\n\n'
+        f'🛒 Товаров: {len(cart.lines)} ({cart.count} шт.)\n'
+        f'💰 Итого: {cart.total}\n\n'
+        'Верно ли все указано?'
+    )
+
+@on_callback(cb.Checkout)
+async def start_checkout(callback: types.CallbackQuery, callback_data: cb.Checkout, state: FSMContext):
+    await cart_writes.flush_user(callback.from_user.id)
     user = await db.get_or_create_user(callback.from_user.id)
     
-    if not user[4] or not user[5]:
+    if not user.phone or not user.address:
         await callback.message.answer(
             '📝 Для оформления заказа нужны ваши контактные данные.\n'
             'Пожалуйста, укажите ваш номер телефона:'
@@ -226,20 +427,9 @@ async def start_checkout(callback: types.CallbackQuery, state: FSMContext):
         await state.set_state(OrderStates.waiting_for_phone)
         return
     
-    cart_items = await db.get_cart(callback.from_user.id)
-    total = sum(item[2] * item[3] for item in cart_items)
-    
-    confirm_text = (
-        '✅ Подтвердите заказ:\n\n'
-        f'📱 Телефон: {user[4]}\n'
-        f'🏠 Адрес: {user[5]}\n\n'
-        f'🛒 Товаров: {len(cart_items)}\n'
-        f'💰 Итого: {total}\n\n'
-        'Верно ли все указано?'
-    )
-    
+    cart = await db.get_cart_snapshot(callback.from_user.id)
     keyboard = kb.checkout_menu()
-    await callback.message.edit_text(confirm_text, reply_markup=keyboard)
+    await callback.message.edit_text(checkout_text(user, cart), reply_markup=keyboard)
     await callback.answer()
 
 @dp.message(OrderStates.waiting_for_phone)
@@ -252,6 +442,11 @@ async def process_phone(message: types.Message, state: FSMContext):
     
     await db.update_user_info(message.from_user.id, phone=phone)
     
+    if (await state.get_data()).get('profile_only'):
+        await state.clear()
+        await message.answer('✅ Телефон обновлен')
+        return
+    
     await state.set_state(OrderStates.waiting_for_address)
     await message.answer('📝 Отлично! Теперь укажите ваш адрес доставки:')
 
@@ -263,35 +458,41 @@ async def process_address(message: types.Message, state: FSMContext):
         await message.answer('❌ Адрес слишком короткий. Введите полный адрес:')
         return
     
-    await db.update_user_info(message.from_user.id, address=address)
+    user = await db.update_user_info(message.from_user.id, address=address)
     
+    profile_only = (await state.get_data()).get('profile_only')
     await state.clear()
+    if profile_only:
+        await message.answer('✅ Адрес обновлен')
+        return
     
-    user = await db.get_or_create_user(message.from_user.id)
-    cart_items = await db.get_cart(message.from_user.id)
-    total = sum(item[2] * item[3] for item in cart_items)
-    
-    confirm_text = (
-        '✅ Подтвердите заказ:\n\n'
-        f'📱 Телефон: {user[4]}\n'
-        f'🏠 Адрес: {user[5]}\n\n'
-        f'🛒 Товаров: {len(cart_items)}\n'
-        f'💰 Итого: {total}\n\n'
-        'Верно ли все указано?'
-    )
-    
+    cart = await db.get_cart_snapshot(message.from_user.id)
     keyboard = kb.checkout_menu()
-    await message.answer(confirm_text, reply_markup=keyboard)
+    await message.answer(checkout_text(user, cart), reply_markup=keyboard)
     
-@dp.callback_query(F.data == 'confirm_order')
-async def confirm_order(callback: types.CallbackQuery):
+@on_callback(cb.ConfirmOrder)
+async def confirm_order(callback: types.CallbackQuery, callback_data: cb.ConfirmOrder):
+    await cart_writes.flush_user(callback.from_user.id)
     user = await db.get_or_create_user(callback.from_user.id)
     
-    if not user[4] or not user[5]:
+    if not user.phone or not user.address:
         await callback.answer('❌ Не заполнены контактные данные')
         return
     
-    order_id = await db.create_order(callback.from_user.id, user[4], user[5])
+    try:
+        order_id = await db.create_order(callback.from_user.id, user.phone, user.address)
+    except db.OutOfStockError as error:
+        lines = [
+            f'• {name}: в корзине {requested}, доступно {available}'
+            for _, name, requested, available in error.items
+        ]
+        await callback.message.edit_text(
+            '❌ Не хватает товара на складе:\n\n' + '\n'.join(lines) +
+            '\n\nИзмените количество в корзине и попробуйте снова.',
+            reply_markup=kb.cart_menu(await db.get_cart_snapshot(callback.from_user.id))
+        )
+        await callback.answer()
+        return
     
     if order_id:
         await callback.message.edit_text(
@@ -304,114 +505,100 @@ async def confirm_order(callback: types.CallbackQuery):
         
     await callback.answer()
     
-@dp.callback_query(F.data.startswith('edit_cart_'))
-async def edit_cart_item(callback: types.CallbackQuery):
-    cart_item_id = int(callback.data.split('_')[2])
-    cart_items = await db.get_cart(callback.from_user.id)
-    
-    for item in cart_items:
-        if item[0] == cart_item_id:
-            keyboard = kb.quantity_menu(cart_item_id, item[3])
-            await callback.message.edit_text(
-                f'✏️ Редактирование: {item[1]}\n'
-                f'Текущее количество: {item[3]}\n',
-                reply_markup=keyboard
-            )
-            break
+@on_callback(cb.EditCartItem)
+async def edit_cart_item(callback: types.CallbackQuery, callback_data: cb.EditCartItem):
+    cart_item_id = callback_data.item_id
+    item = await db.get_cart_item(cart_item_id, callback.from_user.id)
+    
+    if item:
+        quantity, name = item
+        keyboard = kb.quantity_menu(cart_item_id, quantity)
+        await callback.message.edit_text(
+            f'✏️ Редактирование: {name}\n'
+            f'Текущее количество: {quantity}\n',
+            reply_markup=keyboard
+        )
     await callback.answer()
 
-@dp.callback_query(F.data.startswith('increase_'))
-async def increase_quantity(callback: types.CallbackQuery):
-    cart_item_id = int(callback.data.split('_')[1])
-    cart_items = await db.get_cart(callback.from_user.id)
-    
-    for item in cart_items:
-        if item[0] == cart_item_id:
-            new_qty = item[3] + 1
-            await db.update_cart_item(cart_item_id, new_qty)
-            
-            keyboard = kb.quantity_menu(cart_item_id, new_qty)
-            await callback.message.edit_text(
-               f'✏️ Редактирование: {item[1]}\n'
-               f'Текущее количество: {new_qty}',
-               reply_markup=keyboard
-            )
-            break
-    await callback.answer()
+async def render_quantity(message: types.Message, user_id: int, cart_item_id: int, item):
+    # item — (новое количество, название) или None, если строки уже нет
+    if not item:
+        return
+    new_qty, name = item
+    if new_qty <= 0:
+        await message.answer('✅ Товар удален из корзины')
+        await asyncio.sleep(1)
+        await edit_cart_message(message, user_id)
+        return
+    
+    keyboard = kb.quantity_menu(cart_item_id, new_qty)
+    await message.edit_text(
+       f'✏️ Редактирование: {name}\n'
+       f'Текущее количество: {new_qty}',
+       reply_markup=keyboard
+    )
+
+cart_writes = CartWriteBehind(CART_WRITE_WINDOW, render_quantity)
+
+@on_callback(cb.CartQuantity)
+async def change_quantity(callback: types.CallbackQuery, callback_data: cb.CartQuantity):
+    cart_item_id, delta = callback_data.item_id, callback_data.delta
+    if not delta:
+        # Кнопка с текущим количеством — просто подпись
+        await callback.answer()
+        return
+    
+    if cart_writes.enabled:
+        # Запись и правка сообщения произойдут один раз после серии нажатий
+        cart_writes.add(callback.from_user.id, cart_item_id, delta, callback.message)
+        await callback.answer()
+        return
     
-@dp.callback_query(F.data.startswith('decrease_'))
-async def decrease_quantity(callback: types.CallbackQuery):
-    cart_item_id = int(callback.data.split('_')[1])
-    cart_items = await db.get_cart(callback.from_user.id)
-    
-    for item in cart_items:
-        if item[0] == cart_item_id:
-            new_qty = item[3] - 1
-            await db.update_cart_item(cart_item_id, new_qty)
-            
-            if new_qty <= 0:
-                await callback.message.answer('✅ Товар удален из корзины')
-                await asyncio.sleep(1)
-                await back_to_cart(callback)
-                return
-            
-            keyboard = kb.quantity_menu(cart_item_id, new_qty)
-            await callback.message.edit_text(
-               f'✏️ Редактирование: {item[1]}\n'
-               f'Текущее количество: {new_qty}',
-               reply_markup=keyboard
-            )
-            break
+    item = await db.change_cart_item(cart_item_id, callback.from_user.id, delta)
+    await render_quantity(callback.message, callback.from_user.id, cart_item_id, item)
     await callback.answer()
 
-@dp.callback_query(F.data == 'clear_cart')
-async def clear_cart_handler(callback: types.CallbackQuery):
+@on_callback(cb.ClearCart)
+async def clear_cart_handler(callback: types.CallbackQuery, callback_data: cb.ClearCart):
+    await cart_writes.flush_user(callback.from_user.id)
     await db.clear_cart(callback.from_user.id)
     await callback.message.edit_text('✅ Корзина очищена')
     await callback.answer()
     
-@dp.callback_query(F.data.startswith('delete_'))
-async def delete_cart_item(callback: types.CallbackQuery):
-    cart_item_id = int(callback.data.split('_')[1])
-    await db.update_cart_item(cart_item_id, 0)
+@on_callback(cb.DeleteCartItem)
+async def delete_cart_item(callback: types.CallbackQuery, callback_data: cb.DeleteCartItem):
+    # Отложенные ➕/➖ пишутся до удаления, а не после — в пустоту
+    await cart_writes.flush_user(callback.from_user.id)
+    await db.remove_cart_item(callback_data.item_id, callback.from_user.id)
     await callback.message.edit_text('✅ Товар удален из корзины')
     await callback.answer()
     
-@dp.callback_query(F.data == 'back_to_main')
-async def back_to_menu(callback: types.CallbackQuery):
+@on_callback(cb.MainMenu)
+async def back_to_menu(callback: types.CallbackQuery, callback_data: cb.MainMenu):
     await callback.message.answer(
         'Главное меню:',
         reply_markup=kb.main_menu()
     )
     await callback.answer()
 
-@dp.callback_query(F.data == 'back_to_products')
-async def back_to_product(callback: types.CallbackQuery):
-    keyboard = await kb.categories_menu()
-    await callback.message.edit_text('📂 Выберите категорию:', reply_markup=keyboard)
-    await callback.answer()
-    
-@dp.callback_query(F.data.startswith('remove_from_cart_'))
-async def remove_from_cart(callback: types.CallbackQuery):
-    product_id = int(callback.data.split('_')[3])
-    cart_items = await db.get_cart(callback.from_user.id)
-    for item in cart_items:
-        if item[4] == product_id:
-            await db.update_cart_item(item[0], 0)
-            break
+@on_callback(cb.RemoveFromCart)
+async def remove_from_cart(callback: types.CallbackQuery, callback_data: cb.RemoveFromCart):
+    await cart_writes.flush_user(callback.from_user.id)
+    await db.remove_from_cart(callback.from_user.id, callback_data.product_id)
     await callback.answer('✅ Товар удален из корзины')
 
-@dp.callback_query(F.data == 'back_to_profile')
-async def back_to_profile_handler(callback: types.CallbackQuery):
-    await show_profile(callback.message)
-    await callback.answer
+@on_callback(cb.Profile)
+async def back_to_profile_handler(callback: types.CallbackQuery, callback_data: cb.Profile):
+    user = await db.get_or_create_user(callback.from_user.id)
+    await callback.message.edit_text(profile_text(user), reply_markup=profile_menu())
+    await callback.answer()
     
-@dp.callback_query(F.data == 'edit_profile')
-async def edit_profile(callback: types.CallbackQuery):
+@on_callback(cb.EditProfile)
+async def edit_profile(callback: types.CallbackQuery, callback_data: cb.EditProfile):
     builder = InlineKeyboardBuilder()
-    builder.button(text='📱 Изменить телефон', callback_data='change_phone')
-    builder.button(text='🏠 Изменить адрес', callback_data='change_address')
-    builder.button(text='🔙 Назад', callback_data='back_to_profile')
+    builder.button(text='📱 Изменить телефон', callback_data=cb.ChangePhone())
+    builder.button(text='🏠 Изменить адрес', callback_data=cb.ChangeAddress())
+    builder.button(text='🔙 Назад', callback_data=cb.Profile())
     builder.adjust(1)
     
     await callback.message.edit_text(
@@ -419,41 +606,71 @@ async def edit_profile(callback: types.CallbackQuery):
         reply_markup=builder.as_markup()
     )
     await callback.answer()
+
+@on_callback(cb.ChangePhone)
+async def change_phone(callback: types.CallbackQuery, callback_data: cb.ChangePhone, state: FSMContext):
+    await state.set_state(OrderStates.waiting_for_phone)
+    await state.update_data(profile_only=True)
+    await callback.message.answer('📱 Введите новый номер телефона:')
+    await callback.answer()
+
+@on_callback(cb.ChangeAddress)
+async def change_address(callback: types.CallbackQuery, callback_data: cb.ChangeAddress, state: FSMContext):
+    await state.set_state(OrderStates.waiting_for_address)
+    await state.update_data(profile_only=True)
+    await callback.message.answer('🏠 Введите новый адрес доставки:')
+    await callback.answer()
     
 @dp.message(Command('admin'))
 async def admin_panel(message: types.Message):
     if message.from_user.id not in ID_ADMIN:
-        await message.answer('⛔ У вас нет доступа к админ-панели')
-        return
-    await message.answer('👑 Админ-панель:', reply_markup=kb.admin_menu())
+        return message.answer('⛔ У вас нет доступа к админ-панели')
+    return message.answer('👑 Админ-панель:', reply_markup=kb.admin_menu())
 
-@dp.callback_query(F.data == 'admin_stats')
-async def admin_stats(callback: types.CallbackQuery):
+@on_callback(cb.AdminStats)
+async def admin_stats(callback: types.CallbackQuery, callback_data: cb.AdminStats):
     if callback.from_user.id not in ID_ADMIN:
         await callback.answer('⛔ Нет доступа')
         return
     
-    total_orders = 0
-    total_revenue = 0.0
-    orders = await db.get_all_orders()
-    
-    if orders:
-        total_orders = len(orders)
-        total_revenue = sum(order[2] for order in orders)
+    stats = await db.get_shop_stats()
     
     stats_text = (
         '📊 Статистика магазина:\n\n'
-        f'📦 Всего заказов: {total_orders}\n'
-        f'💰 Общая выручка: {total_revenue:.2f}\n'
-        f'👤 Пользователей: {await get_user_count()}\n'
-        f'🛍️ Товаров в каталоге: {await get_product_count()}'
+        f'📦 Всего заказов: {stats["orders"]}\n'
+        f'💰 Общая выручка: {stats["revenue"]:.2f}\n'
+        f'👤 Пользователей: {stats["users"]}\n'
+        f'🛍️ Товаров в каталоге: {stats["products"]}'
+    )
+    cache_stats = catalog.stats()
+    stats_text += (
+        f'\n🗃 Кэш каталога: {cache_stats["hits"]} попаданий, '
+        f'{cache_stats["misses"]} промахов'
+    )
+    outbound_stats = outbound.stats()
+    stats_text += (
+        f'\n📤 Очередь к Telegram: {outbound_stats["normal"]["queued"]}, '
+        f'среднее ожидание {outbound_stats["normal"]["avg_wait"] * 1000:.0f} мс, '
+        f'flood control: {outbound_stats["retry_after"]}'
     )
+    if stats['by_status']:
+        stats_text += '\n\n📋 По статусам:\n'
+        stats_text += '\n'.join(
+            f'{kb.STATUS_ICONS.get(status, "📦")} {status}: {count}'
+            for status, count in stats['by_status'].items()
+        )
+    if stats['daily']:
+        stats_text += '\n\n📅 Выручка по дням:\n'
+        stats_text += '\n'.join(
+            f'{day}: {orders} зак. / {revenue:.2f}'
+            for day, orders, revenue in stats['daily']
+        )
     
     await callback.message.answer(stats_text)
     await callback.answer()
 
-@dp.callback_query(F.data == 'admin_add_product')
-async def admin_add_product_start(callback: types.CallbackQuery, state: FSMContext):
+@on_callback(cb.AdminAddProduct)
+async def admin_add_product_start(callback: types.CallbackQuery, callback_data: cb.AdminAddProduct, state: FSMContext):
     if callback.from_user.id not in ID_ADMIN:
         await callback.answer('⛔ Нет доступа')
         return
@@ -464,15 +681,15 @@ async def admin_add_product_start(callback: types.CallbackQuery, state: FSMConte
     
     builder = InlineKeyboardBuilder()
     for category_id, category_name in categories:
-        builder.button(text=category_name, callback_data=f'admin_select_category_{category_id}')
-    builder.button(text='❌ Отмена', callback_data='admin_cancel')
+        builder.button(text=category_name, callback_data=cb.AdminSelectCategory(category_id=category_id))
+    builder.button(text='❌ Отмена', callback_data=cb.AdminCancel())
     builder.adjust(1)
     
     await callback.message.answer('📂 Выберите категорию для нового товара:', reply_markup=builder.as_markup())
     await callback.answer()
     
-@dp.callback_query(F.data == 'admin_add_category')
-async def admin_add_category_start(callback: types.CallbackQuery, state: FSMContext):
+@on_callback(cb.AdminAddCategory)
+async def admin_add_category_start(callback: types.CallbackQuery, callback_data: cb.AdminAddCategory, state: FSMContext):
     if callback.from_user.id not in ID_ADMIN:
         await callback.answer('⛔ Нет доступа')
         return
@@ -481,18 +698,19 @@ async def admin_add_category_start(callback: types.CallbackQuery, state: FSMCont
     await callback.message.answer('📝 Введите название новой категории:')
     await callback.answer()
 
-@dp.callback_query(F.data.startswith('admin_select_category_'))
-async def admin_select_category(callback: types.CallbackQuery, state: FSMContext):
+@on_callback(cb.AdminSelectCategory)
+async def admin_select_category(callback: types.CallbackQuery, callback_data: cb.AdminSelectCategory, state: FSMContext):
     if callback.from_user.id not in ID_ADMIN:
         await callback.answer('⛔ Нет доступа')
         return
     
-    category_id = int(callback.data.split('_')[3])
-    await state.update_data(category_id=category_id)
+    await state.update_data(category_id=callback_data.category_id)
+    await state.set_state(AdminState.waiting_for_product_name)
+    await callback.message.answer('📝 Введите название товара:')
     await callback.answer()
 
-@dp.callback_query(F.data == 'admin_cancel')
-async def admin_cansel(callback: types.CallbackQuery, state: FSMContext):
+@on_callback(cb.AdminCancel)
+async def admin_cansel(callback: types.CallbackQuery, callback_data: cb.AdminCancel, state: FSMContext):
     await state.clear()
     await callback.message.answer('❌ Операция отменена')
     await callback.answer()
@@ -554,62 +772,175 @@ async def process_product_stock(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer('❌ Неверный формат количества. Введите целое число:')
 
-async def get_user_count():
-    from database import DB_PATH
-    async with aiosqlite.connect(DB_PATH) as connection:
-        async with connection.execute('SELECT COUNT(*) FROM users') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
-
-async def get_product_count():
-    from database import DB_PATH
-    async with aiosqlite.connect(DB_PATH) as connection:
-        async with connection.execute('SELECT COUNT(*) FROM products') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
-
-async def get_order_count():
-    from database import DB_PATH
-    async with aiosqlite.connect(DB_PATH) as connection:
-        async with connection.execute('SELECT COUNT(*) FROM orders') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
-
-async def get_total_revenue():
-    from database import DB_PATH
-    async with aiosqlite.connect(DB_PATH) as connection:
-        async with connection.execute('SELECT SUM(total_amount) FROM orders') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else 0
-
-@dp.callback_query(F.data == 'admin_orders')
-async def admin_orders(callback: types.CallbackQuery):
+@on_callback(cb.AdminProductPhoto)
+async def admin_product_photo(callback: types.CallbackQuery, callback_data: cb.AdminProductPhoto, state: FSMContext):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
+        return
+    
+    builder = InlineKeyboardBuilder()
+    builder.button(text='❌ Отмена', callback_data=cb.AdminCancel())
+    await state.set_state(AdminState.waiting_for_product_photo)
+    await state.update_data(product_id=callback_data.product_id)
+    await callback.message.answer('🖼 Отправьте фото товара:', reply_markup=builder.as_markup())
+    await callback.answer()
+
+@dp.message(AdminState.waiting_for_product_photo, F.photo)
+async def process_product_photo(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    if not await media.save_product_photo(message.bot, data['product_id'], message.photo[-1]):
+        return message.answer('❌ Товар не найден')
+    return message.answer('✅ Фото товара сохранено!')
+
+@dp.message(AdminState.waiting_for_product_photo)
+async def process_product_photo_invalid(message: types.Message):
+    return message.answer('❌ Нужна фотография. Отправьте фото товара:')
+
+@on_callback(cb.AdminImport)
+async def admin_import_start(callback: types.CallbackQuery, callback_data: cb.AdminImport, state: FSMContext):
     if callback.from_user.id not in ID_ADMIN:
         await callback.answer('⛔ Нет доступа')
         return
     
-    orders = await db.get_all_orders()
+    builder = InlineKeyboardBuilder()
+    builder.button(text='❌ Отмена', callback_data=cb.AdminCancel())
+    await state.set_state(AdminState.waiting_for_catalog_file)
+    await callback.message.answer(
+        '📥 Отправьте файл каталога: CSV или JSON, до 20 МБ.\n\n'
+        f'Колонки: {", ".join(catalog_io.COLUMNS)}. Обязательны category, name и price. '
+        'Товар с уже известным sku обновляется, категории ищутся по названию, новые создаются.',
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+@dp.message(AdminState.waiting_for_catalog_file, F.document)
+async def process_catalog_file(message: types.Message, state: FSMContext):
+    document = message.document
+    fmt = catalog_io.detect_format(document.file_name)
+    if not fmt:
+        return message.answer('❌ Нужен файл .csv, .json или .jsonl')
+    if (document.file_size or 0) > catalog_io.DOCUMENT_LIMIT:
+        return message.answer('❌ Файл больше 20 МБ — разделите его на части')
     
-    if not orders:
-        await callback.message.answer('📦 Заказов пока нет')
+    await state.clear()
+    catalog_io.start_import(message.bot, message.chat.id, document, fmt)
+
+@dp.message(AdminState.waiting_for_catalog_file)
+async def process_catalog_file_invalid(message: types.Message):
+    return message.answer('❌ Отправьте каталог файлом (CSV или JSON):')
+
+@on_callback(cb.AdminExport)
+async def admin_export(callback: types.CallbackQuery, callback_data: cb.AdminExport):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
+        return
+    
+    if callback_data.fmt not in ('csv', 'json'):
+        await callback.message.answer('📤 В каком формате выгрузить каталог?', reply_markup=kb.export_menu())
+        await callback.answer()
+        return
+    
+    catalog_io.start_export(callback.bot, callback.message.chat.id, callback_data.fmt)
+    await callback.answer('📤 Готовлю файл...')
+
+@on_callback(cb.AdminBroadcast)
+async def admin_broadcast_start(callback: types.CallbackQuery, callback_data: cb.AdminBroadcast, state: FSMContext):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
         return
     
-    orders_text = '📦 Все заказы:\n\n'
-    for order in orders:
+    builder = InlineKeyboardBuilder()
+    builder.button(text='❌ Отмена', callback_data=cb.AdminCancel())
+    await state.set_state(AdminState.waiting_for_broadcast_text)
+    await callback.message.answer(
+        '📣 Отправьте текст рассылки. Его получат все пользователи, кроме заблокировавших бота.',
+        reply_markup=builder.as_markup()
+    )
+    await callback.answer()
+
+@dp.message(AdminState.waiting_for_broadcast_text, F.text)
+async def process_broadcast_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    await broadcast.create(message.bot, message.chat.id, message.html_text)
+
+@on_callback(cb.CancelBroadcast)
+async def cancel_broadcast(callback: types.CallbackQuery, callback_data: cb.CancelBroadcast):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
+        return
+    
+    await broadcast.cancel(callback_data.broadcast_id)
+    await callback.answer('⛔ Рассылка остановится в течение нескольких секунд')
+
+def admin_orders_text(page, status: str = None):
+    title = f'📦 Заказы со статусом {status}:' if status else '📦 Все заказы:'
+    if not page.rows:
+        return f'{title}\n\nЗаказов нет'
+    
+    orders_text = f'{title}\n\n'
+    for order in page.rows:
         order_id, name, total, status, created = order
         orders_text += f'#{order_id} - {name}\n'
         orders_text += f'   Сумма: {total} | Статус: {status}\n'
         orders_text += f'   Дата: {created[:10]}\n\n'
+    return orders_text
+
+@on_callback(cb.AdminOrders)
+async def admin_orders(callback: types.CallbackQuery, callback_data: cb.AdminOrders):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
+        return
+    
+    page = await db.get_all_orders()
+    
+    if not page.rows:
+        await callback.message.answer('📦 Заказов пока нет')
+        await callback.answer()
+        return
         
-    await callback.message.answer(orders_text)
+    await callback.message.answer(admin_orders_text(page), reply_markup=kb.admin_orders_menu(page))
     await callback.answer()
+
+@on_callback(cb.AdminOrdersPage)
+async def admin_orders_page(callback: types.CallbackQuery, callback_data: cb.AdminOrdersPage):
+    if callback.from_user.id not in ID_ADMIN:
+        await callback.answer('⛔ Нет доступа')
+        return
     
+    status = None if callback_data.status == 'all' else callback_data.status
+    page = await db.get_all_orders(
+        cursor=callback_data.cursor or None,
+        newer=callback_data.newer,
+        status=status
+    )
+    
+    await callback.message.edit_text(
+        admin_orders_text(page, status),
+        reply_markup=kb.admin_orders_menu(page, status)
+    )
+    await callback.answer()
 
+@dp.callback_query()
+async def dispatch_callback(callback: types.CallbackQuery, **data):
+    # Все inline-кнопки приходят сюда и разбираются по префиксу за O(1)
+    result = await on_callback.dispatch(callback, **data)
+    if result is UNHANDLED:
+        await callback.answer('Кнопка устарела, откройте меню заново')
+        return
+    return result
+    
 
 
-async def main():
-    await db.init_db()
-    
+
+def setup_fsm_storage():
+    if FSM_STORAGE == 'sqlite':
+        # Состояния диалогов переживают перезапуск и видны всем процессам
+        storage = SQLiteStorage()
+        storage.start()
+        dp.fsm.storage = storage
+
+async def seed_catalog():
     categories = await db.get_categories()
     if not categories:
         await db.add_category('Электроника', 'Смартфоны, ноутбуки, гаджеты')
@@ -620,9 +951,36 @@ async def main():
         await db.add_product(2, 'Свитер', 'свитер yves saint laurent', 210900.00, 50)
         await db.add_product(3, 'BMW M3', 'Новая', 12000000.00,  5)
 
+async def main():
+    if await db.init_db() == 0:
+        # База только что создана — витрина с примерами товаров
+        await seed_catalog()
+    
+    if WORKERS > 1:
+        # Здесь только прием обновлений, разбирают их процессы-воркеры
+        await db.close_db()
+        print(f'Бот запущен, воркеров: {WORKERS}')
+        await run_supervisor(WORKERS, bot, dp.resolve_used_update_types())
+        return
+    
+    setup_fsm_storage()
+    lifecycle.start_prewarm()
+    await broadcast.resume(bot)
+    archive.start()
+    metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
     print('Бот запущен......')
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            # Сессию Bot API закрывает lifecycle.shutdown: начатым
+            # обработчикам она еще нужна
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await lifecycle.shutdown(bot, cart_writes)
+        if metrics_server:
+            await metrics_server.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
-        
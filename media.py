@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+import database as db
+from config import PHOTO_UPLOAD_CONCURRENCY, PRODUCT_IMAGES_DIR
+
+logger = logging.getLogger(__name__)
+
+# Загрузки и скачивания файлов — самые тяжелые запросы к Bot API;
+# одновременно их идет не больше PHOTO_UPLOAD_CONCURRENCY
+upload_gate = asyncio.Semaphore(PHOTO_UPLOAD_CONCURRENCY)
+_uploading = {}
+
+
+def _file_id_rejected(error: TelegramBadRequest):
+    # "wrong file identifier", "file_id is invalid", "wrong remote file identifier"...
+    text = error.message.lower()
+    return 'file identifier' in text or 'file_id' in text
+
+
+async def answer_product_photo(message, product, caption: str, reply_markup=None):
+    """Отправляет фото товара в чат message.
+
+    Фото идет по сохраненному file_id; файл с диска загружается только в
+    первый раз (или если Telegram перестал принимать file_id), после чего
+    новый file_id сохраняется. Возвращает отправленное сообщение или None,
+    если фото у товара нет.
+    """
+    if product.image_file_id:
+        try:
+            return await message.answer_photo(
+                product.image_file_id, caption=caption, reply_markup=reply_markup, parse_mode='HTML'
+            )
+        except TelegramBadRequest as error:
+            if not _file_id_rejected(error):
+                raise
+            logger.warning('Товар %s: file_id не принят (%s), загружаю заново', product.id, error.message)
+            await db.set_product_file_id(product.id, None)
+
+    if not product.image_path or not os.path.exists(product.image_path):
+        return None
+
+    # Один товар загружается один раз, даже если карточку открыли сразу многие:
+    # остальные дождутся первой загрузки и возьмут ее file_id. Запись в
+    # _uploading живет, пока загрузку кто-то держит или ждет
+    entry = _uploading.setdefault(product.id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            fresh = await db.get_product(product.id)
+            if fresh and fresh.image_file_id and fresh.image_file_id != product.image_file_id:
+                return await message.answer_photo(
+                    fresh.image_file_id, caption=caption, reply_markup=reply_markup, parse_mode='HTML'
+                )
+            async with upload_gate:
+                sent = await message.answer_photo(
+                    FSInputFile(product.image_path), caption=caption, reply_markup=reply_markup, parse_mode='HTML'
+                )
+            await db.set_product_file_id(product.id, sent.photo[-1].file_id)
+            return sent
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _uploading[product.id]
+
+
+async def save_product_photo(bot, product_id: int, photo):
+    """Сохраняет фото, присланное админом: файл — на диск, file_id — в базу.
+
+    Отправлять его потом можно сразу по file_id, а файл на диске нужен,
+    если file_id перестанет работать.
+    """
+    # Несуществующему товару файл не скачивается
+    if await db.get_product(product_id) is None:
+        return False
+    os.makedirs(PRODUCT_IMAGES_DIR, exist_ok=True)
+    path = os.path.join(PRODUCT_IMAGES_DIR, f'{product_id}.jpg')
+    async with upload_gate:
+        await bot.download(photo, destination=path)
+    return await db.set_product_image(product_id, path, photo.file_id)
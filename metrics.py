@@ -0,0 +1,233 @@
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery, InlineQuery, Message
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STARTED = time.time()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    """Гистограмма с постоянными корзинами: observe — bisect и три сложения."""
+
+    def __init__(self, name: str, help: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            # [счетчики по корзинам (последняя — +Inf), сумма, количество]
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {count}'
+
+
+# МЕТРИКИ
+handler_seconds = Histogram('shop_handler_seconds', 'Время обработчика', ('handler',))
+handler_errors = Counter('shop_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+db_query_seconds = Histogram('shop_db_query_seconds', 'Время запроса к базе (без ожидания соединения)', ('query',))
+db_wait_seconds = Histogram('shop_db_wait_seconds', 'Ожидание соединения из пула', ('pool',))
+db_connections = Counter('shop_db_connections_opened_total', 'Открыто соединений с базой')
+telegram_seconds = Histogram('shop_telegram_request_seconds', 'Время запроса к Bot API', ('method',))
+telegram_errors = Counter('shop_telegram_request_errors_total', 'Ошибки запросов к Bot API', ('method',))
+
+METRICS = [
+    handler_seconds, handler_errors,
+    db_query_seconds, db_wait_seconds, db_connections,
+    telegram_seconds, telegram_errors,
+]
+
+# Дополнительные источники: функции, которые при каждом запросе /metrics
+# возвращают готовые строки (например, очереди RequestScheduler), по имени:
+# повторная регистрация заменяет сборщик, а не дублирует метрику
+collectors = {}
+
+
+def gauge(name: str, help: str, values: dict, label: str = None):
+    """Строки gauge-метрики для collectors: values — {значение метки: число};
+    без метки — {None: число}."""
+    yield f'# HELP {name} {help}'
+    yield f'# TYPE {name} gauge'
+    for key, value in values.items():
+        yield f'{name}{_labels((label,), (key,)) if label else ""} {value}'
+
+
+def render():
+    lines = [
+        '# HELP shop_uptime_seconds Время работы процесса',
+        '# TYPE shop_uptime_seconds gauge',
+        f'shop_uptime_seconds {time.time() - _STARTED:.0f}',
+    ]
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collect in collectors.values():
+        try:
+            lines.extend(collect())
+        except Exception:
+            logger.exception('Сборщик метрик %r упал', collect)
+    return '\n'.join(lines) + '\n'
+
+
+# ОБРАБОТЧИКИ
+def handler_name(event, data, callbacks=()):
+    # Нажатия — по префиксу CallbackData (все они идут через один
+    # обработчик CallbackRouter), остальное — по имени функции-обработчика.
+    # callback_data присылает клиент: неизвестные префиксы — одна серия
+    if isinstance(event, CallbackQuery):
+        prefix = (event.data or '').split(':', 1)[0]
+        return f'callback:{prefix if prefix in callbacks else "unknown"}'
+    handler = data.get('handler')
+    name = getattr(getattr(handler, 'callback', None), '__name__', 'unknown')
+    if isinstance(event, Message):
+        return f'message:{name}'
+    if isinstance(event, InlineQuery):
+        return f'inline:{name}'
+    return name
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Внутренняя middleware: количество, ошибки и время каждого обработчика.
+    callbacks — известные префиксы callback_data (CallbackRouter)."""
+
+    def __init__(self, callbacks=()):
+        self.callbacks = callbacks
+
+    async def __call__(self, handler, event, data):
+        name = handler_name(event, data, self.callbacks)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+
+
+# BOT API
+class TelegramMetrics(BaseRequestMiddleware):
+    """Время запросов к Bot API по методам. Ставится после RequestScheduler,
+    поэтому ожидание в его очереди сюда не входит."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - started, name)
+
+
+# БАЗА
+_query = ContextVar('db_query', default='other')
+
+
+def current_query():
+    return _query.get()
+
+
+def instrument_queries(namespace: dict):
+    """Оборачивает публичные корутины модуля: запросы к базе внутри них
+    попадают в shop_db_query_seconds под именем функции."""
+    module = namespace['__name__']
+    for name, function in list(namespace.items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(function) or function.__module__ != module:
+            continue
+        namespace[name] = _named_query(name, function)
+
+
+def _named_query(name, function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        token = _query.set(name)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            _query.reset(token)
+    return wrapper
+
+
+# HTTP
+async def handle_metrics(request):
+    return web.Response(
+        body=render().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+
+async def serve(host: str, port: int):
+    """Поднимает /metrics на отдельном порту; возвращает runner для cleanup()."""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Метрики: http://%s:%s/metrics', host, port)
+    return runner
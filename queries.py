@@ -0,0 +1,491 @@
+"""Все запросы database.py по именам.
+
+Запрос регистрируется через query(): имя попадает в журнал медленных
+запросов, а benchmarks.query_plans прогоняет EXPLAIN QUERY PLAN для
+каждого запроса реестра и падает, если запрос горячего пути (hot=True)
+читает таблицу целиком. scans — что в плане этого запроса ожидаемо:
+таблица (или псевдоним), которую можно пройти целиком, строка SCAN
+целиком (например, проход по индексу до LIMIT) или 'TEMP B-TREE' для
+сортировки без индекса. Схема (миграции) остается в database.py.
+"""
+from typing import NamedTuple
+
+
+class Query(NamedTuple):
+    name: str
+    sql: str
+    hot: bool = True
+    scans: tuple = ()
+    # Запрос, который нужно выполнить перед EXPLAIN (временные таблицы)
+    requires: 'Query' = None
+
+
+QUERIES = {}
+
+
+def query(name: str, sql: str, hot: bool = True, scans: tuple = (), requires: Query = None):
+    if name in QUERIES:
+        raise ValueError(f'Запрос {name} уже зарегистрирован')
+    QUERIES[name] = Query(name, sql, hot, scans, requires)
+    return QUERIES[name]
+
+
+# ПАГИНАЦИЯ
+# Страница keyset-пагинации — четыре варианта одного запроса: с курсором и
+# без, вперед и назад. Курсор — id крайней строки страницы; ее ключ достает
+# подзапрос по первичному ключу, так что каждая страница — это поиск по
+# индексу независимо от ее номера.
+def _keyset_sql(select: str, where: list, key: list, cursor_key: str, has_cursor: bool, desc: bool):
+    conditions = list(where)
+    if has_cursor:
+        conditions.append(f'({", ".join(key)}) {"<" if desc else ">"} {cursor_key}')
+    order = ', '.join(f'{column} {"DESC" if desc else "ASC"}' for column in key)
+    return (
+        f'{select} {"WHERE " + " AND ".join(conditions) if conditions else ""} '
+        f'ORDER BY {order} LIMIT ?'
+    )
+
+
+def _variants(name: str, build, descending: bool, scans: tuple):
+    variants = {}
+    for has_cursor in (False, True):
+        for backward in (False, True):
+            sql = build(has_cursor, descending != backward)
+            variant = f'{"after" if has_cursor else "first"}:{"backward" if backward else "forward"}'
+            variants[has_cursor, backward] = query(f'{name}:{variant}', sql, scans=scans)
+    return variants
+
+
+def keyset(name: str, select: str, where: list, key: list, cursor_key: str,
+           descending: bool = False, scans: tuple = ()):
+    return _variants(
+        name, lambda has_cursor, desc: _keyset_sql(select, where, key, cursor_key, has_cursor, desc),
+        descending, scans
+    )
+
+
+# Та же страница поверх нескольких таблиц с общим ключом (заказы и их
+# архив): каждая часть берет свою страницу по своему индексу, внешний
+# ORDER BY ... LIMIT сливает их и сортирует не больше LIMIT строк из
+# каждой части. Параметры повторяются для каждой части, последним — LIMIT.
+def keyset_union(name: str, selects: list, where: list, key: list, cursor_key: str,
+                 descending: bool = False, scans: tuple = ()):
+    columns = [column.split('.')[-1] for column in key]
+
+    def build(has_cursor, desc):
+        parts = ' UNION ALL '.join(
+            f'SELECT * FROM ({_keyset_sql(select, where, key, cursor_key, has_cursor, desc)})'
+            for select in selects
+        )
+        order = ', '.join(f'{column} {"DESC" if desc else "ASC"}' for column in columns)
+        return f'{parts} ORDER BY {order} LIMIT ?'
+
+    return _variants(name, build, descending, scans)
+
+
+# КЭШ КАТАЛОГА
+# Теги, измененные после версии since: воркер сбрасывает их в своем кэше
+CATALOG_VERSION = query(
+    'catalog_version',
+    'SELECT COALESCE(MAX(version), 0) FROM catalog_versions'
+)
+CATALOG_CHANGES = query(
+    'catalog_changes',
+    'SELECT tag, version FROM catalog_versions WHERE version > ?'
+)
+
+
+# КАТЕГОРИИ
+# Категорий немного, и список читается через кэш каталога
+GET_CATEGORIES = query(
+    'get_categories',
+    'SELECT id, name FROM categories ORDER BY name',
+    scans=('categories', 'TEMP B-TREE')
+)
+ADD_CATEGORY = query(
+    'add_category',
+    'INSERT INTO categories (name, description) VALUES (?, ?)'
+)
+
+# ТОВАРЫ
+PRODUCT_COLUMNS = 'id, category_id, name, description, price, stock, image_path, image_file_id'
+
+# Порядки сортировки товаров: ключ keyset-пагинации и направление
+PRODUCT_SORTS = {
+    'name': (['p.name', 'p.id'], False),
+    'price': (['p.price', 'p.id'], False),
+    'new': (['p.created_at', 'p.id'], True),
+}
+PRODUCTS_PAGE = {
+    sort: keyset(
+        f'products_page:{sort}',
+        'SELECT p.id, p.name, p.price, p.stock, p.image_path FROM products p',
+        ['p.category_id = ?'], key,
+        f'(SELECT {", ".join(column[2:] for column in key)} FROM products WHERE id = ?)',
+        descending
+    )
+    for sort, (key, descending) in PRODUCT_SORTS.items()
+}
+GET_PRODUCT = query(
+    'get_product',
+    f'SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?'
+)
+SET_PRODUCT_IMAGE = query(
+    'set_product_image',
+    'UPDATE products SET image_path = ?, image_file_id = ? WHERE id = ? RETURNING category_id'
+)
+SET_PRODUCT_FILE_ID = query(
+    'set_product_file_id',
+    'UPDATE products SET image_file_id = ? WHERE id = ?'
+)
+ADD_PRODUCT = query('add_product', '''
+    INSERT INTO products (category_id, name, description, price, stock, image_path)
+    VALUES (?, ?, ?, ?, ?, ?)
+''')
+# Совпадение в названии весит больше, чем в описании
+SEARCH_PRODUCTS = query('search_products', '''
+    SELECT p.id, p.name, p.price, p.stock, p.description, p.category_id
+    FROM products_fts
+    JOIN products p ON p.id = products_fts.rowid
+    WHERE products_fts MATCH ?
+    ORDER BY bm25(products_fts, 10.0, 1.0)
+    LIMIT ? OFFSET ?
+''', scans=('TEMP B-TREE',))
+
+# МАССОВЫЙ ИМПОРТ И ЭКСПОРТ
+# Имя -> id; при повторяющихся именах берется первая категория
+GET_CATEGORY_IDS = query(
+    'get_category_ids',
+    'SELECT name, id FROM categories ORDER BY id DESC',
+    hot=False
+)
+ADD_CATEGORIES = query(
+    'add_categories',
+    'INSERT INTO categories (name) SELECT value FROM json_each(?) RETURNING name, id',
+    hot=False
+)
+CREATE_PRODUCT_IMPORT = query('create_product_import', '''
+    CREATE TEMP TABLE IF NOT EXISTS product_import
+        (sku, category_id, name, description, price, stock, image_path)
+''', hot=False)
+STAGE_PRODUCTS = query(
+    'stage_products',
+    'INSERT INTO product_import VALUES (?, ?, ?, ?, ?, ?, ?)',
+    requires=CREATE_PRODUCT_IMPORT
+)
+UPSERT_PRODUCTS = query('upsert_products', '''
+    INSERT INTO products (sku, category_id, name, description, price, stock, image_path)
+    SELECT sku, category_id, name, description, price, stock, image_path
+    FROM product_import ORDER BY rowid
+    ON CONFLICT (sku) WHERE sku IS NOT NULL DO UPDATE SET
+        category_id = excluded.category_id,
+        name = excluded.name,
+        description = excluded.description,
+        price = excluded.price,
+        stock = excluded.stock,
+        image_path = COALESCE(excluded.image_path, image_path),
+        image_file_id = CASE
+            WHEN excluded.image_path IS NULL OR excluded.image_path = image_path THEN image_file_id
+        END
+    -- Неизменившиеся товары не трогаем: иначе зря перестраивается поиск
+    WHERE (category_id, name, description, price, stock)
+        IS NOT (excluded.category_id, excluded.name, excluded.description, excluded.price, excluded.stock)
+        OR excluded.image_path IS NOT NULL AND excluded.image_path IS NOT image_path
+''', scans=('product_import',), requires=CREATE_PRODUCT_IMPORT)
+CLEAR_PRODUCT_IMPORT = query(
+    'clear_product_import',
+    'DELETE FROM product_import',
+    hot=False, requires=CREATE_PRODUCT_IMPORT
+)
+# Товары без артикула, которые уже есть в категории под тем же названием
+FIND_PRODUCTS_BY_NAME = query('find_products_by_name', '''
+    SELECT p.category_id, p.name
+    FROM json_each(?) j
+    JOIN products p ON p.category_id = json_extract(j.value, '$[0]') AND p.name = json_extract(j.value, '$[1]')
+''', hot=False)
+EXPORT_PRODUCTS = query('export_products', '''
+    SELECT p.id, p.sku, c.name, p.name, p.description, p.price, p.stock, p.image_path
+    FROM products p LEFT JOIN categories c ON c.id = p.category_id
+    WHERE p.id > ? ORDER BY p.id LIMIT ?
+''')
+
+# ПОЛЬЗОВАТЕЛИ
+USER_COLUMNS = 'id, user_id, username, full_name, phone, address, is_admin, created_at, blocked_at'
+
+GET_USER = query(
+    'get_user',
+    f'SELECT {USER_COLUMNS} FROM users WHERE user_id = ?'
+)
+CREATE_USER = query('create_user', f'''
+    INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)
+    ON CONFLICT (user_id) DO NOTHING
+    RETURNING {USER_COLUMNS}
+''')
+UPDATE_USER_INFO = query('update_user_info', f'''
+    UPDATE users SET phone = COALESCE(?, phone), address = COALESCE(?, address)
+    WHERE user_id = ?
+    RETURNING {USER_COLUMNS}
+''')
+
+# КОРЗИНА
+# Каждая операция — одно выражение с RETURNING: новое количество и название
+# товара приходят сразу, без повторного чтения корзины
+CART_LINE = 'quantity, (SELECT name FROM products WHERE id = cart.product_id)'
+
+ADD_TO_CART = query('add_to_cart', f'''
+    INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+    RETURNING {CART_LINE}
+''')
+SET_CART_QUANTITY = query('set_cart_quantity', f'''
+    INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = excluded.quantity
+    RETURNING {CART_LINE}
+''')
+CHANGE_CART_ITEM = query('change_cart_item', f'''
+    UPDATE cart SET quantity = quantity + ?
+    WHERE id = ? AND user_id = ? AND quantity + ? > 0
+    RETURNING {CART_LINE}
+''')
+REMOVE_CART_ITEM = query('remove_cart_item', '''
+    DELETE FROM cart WHERE id = ? AND user_id = ?
+    RETURNING 0, (SELECT name FROM products WHERE id = cart.product_id)
+''')
+REMOVE_FROM_CART = query('remove_from_cart', '''
+    DELETE FROM cart WHERE user_id = ? AND product_id = ?
+    RETURNING 0, (SELECT name FROM products WHERE id = cart.product_id)
+''')
+GET_CART_ITEM = query(
+    'get_cart_item',
+    f'SELECT {CART_LINE} FROM cart WHERE id = ? AND user_id = ?'
+)
+# Корзина целиком одним запросом по ux_cart_user_product: по ней строятся
+# и текст, и клавиатура
+GET_CART_SNAPSHOT = query('get_cart_snapshot', '''
+    SELECT c.id, p.id, p.name, p.price, c.quantity, p.price * c.quantity
+    FROM cart c
+    JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = ?
+    ORDER BY c.id
+''', scans=('TEMP B-TREE',))
+CLEAR_CART = query(
+    'clear_cart',
+    'DELETE FROM cart WHERE user_id = ?'
+)
+
+# ЗАКАЗЫ
+ORDER_CART = query('order_cart', '''
+    SELECT c.product_id, c.quantity, p.price, p.name, p.stock, p.category_id
+    FROM cart c
+    JOIN products p ON c.product_id = p.id
+    WHERE c.user_id = ?
+''')
+# Остаток списывается, только если его хватает
+TAKE_STOCK = query(
+    'take_stock',
+    'UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?'
+)
+CREATE_ORDER = query('create_order', '''
+    INSERT INTO orders (user_id, total_amount, phone, address)
+    VALUES (?, ?, ?, ?)
+''')
+ADD_ORDER_ITEMS = query('add_order_items', '''
+    INSERT INTO order_items (order_id, product_id, quantity, price)
+    SELECT ?, c.product_id, c.quantity, p.price
+    FROM cart c
+    JOIN products p ON c.product_id = p.id
+    WHERE c.user_id = ?
+''')
+
+# Заказы идут от новых к старым по (created_at, id). У каждого списка три
+# семейства: только orders, только архив (дочитать короткую страницу) и
+# слияние обеих таблиц для страниц за горизонтом архива
+_ORDER_KEY = ['o.created_at', 'o.id']
+_ORDER_CURSOR = '(SELECT created_at, id FROM orders WHERE id = ?)'
+_ARCHIVED_CURSOR = '(SELECT created_at, id FROM orders_archive WHERE id = ?)'
+# Курсор страницы, которая заходит в архив, может быть и архивным заказом;
+# id заказа сохраняется при переносе, так что он уникален в обеих таблицах
+_SPAN_CURSOR = '(SELECT created_at, id FROM order_keys WHERE id = ?)'
+# Слияние частей сортирует не больше 2 * LIMIT строк
+_SPAN_SCANS = ('TEMP B-TREE',)
+
+
+class OrderLists(NamedTuple):
+    hot: dict
+    archived: dict
+    spanning: dict
+
+
+def order_lists(name: str, select: str, where: list, hot_scans: tuple = (), archived_scans: tuple = ()):
+    hot, archived = select.format(table='orders'), select.format(table='orders_archive')
+    return OrderLists(
+        keyset(name, hot, where, _ORDER_KEY, _ORDER_CURSOR, descending=True, scans=hot_scans),
+        keyset(f'{name}:archive', archived, where, _ORDER_KEY, _ARCHIVED_CURSOR,
+               descending=True, scans=archived_scans),
+        keyset_union(f'{name}+archive', [hot, archived], where, _ORDER_KEY, _SPAN_CURSOR,
+                     descending=True, scans=(*hot_scans, *archived_scans, *_SPAN_SCANS)),
+    )
+
+
+USER_ORDERS = order_lists(
+    'user_orders',
+    'SELECT o.id, o.total_amount, o.status, o.created_at FROM {table} o',
+    ['o.user_id = ?']
+)
+GET_ORDER_CREATED = query(
+    'get_order_created',
+    'SELECT created_at FROM orders WHERE id = ?'
+)
+
+# АДМИН
+# Первая страница всех заказов — проход по idx_orders_created с конца до LIMIT
+_ADMIN_ORDERS = '''
+    SELECT o.id, u.full_name, o.total_amount, o.status, o.created_at
+    FROM {table} o
+    LEFT JOIN users u ON o.user_id = u.user_id
+'''
+ALL_ORDERS = order_lists(
+    'all_orders', _ADMIN_ORDERS, [],
+    hot_scans=('o USING INDEX idx_orders_created',),
+    archived_scans=('o USING INDEX idx_orders_archive_created',)
+)
+ORDERS_BY_STATUS = order_lists('orders_by_status', _ADMIN_ORDERS, ['o.status = ?'])
+# Архивные заказы уже доставлены или отменены, их статус не меняется
+UPDATE_ORDER_STATUS = query(
+    'update_order_status',
+    'UPDATE orders SET status = ? WHERE id = ?'
+)
+
+# АРХИВ ЗАКАЗОВ
+# Пачка заказов для переноса: по idx_orders_status_created, без сортировки
+PICK_ARCHIVE_ORDERS = query('pick_archive_orders', '''
+    SELECT id FROM orders
+    WHERE status IN ('delivered', 'cancelled') AND created_at < ?
+    LIMIT ?
+''', hot=False)
+ARCHIVE_ORDERS = query('archive_orders', '''
+    INSERT INTO orders_archive (id, user_id, total_amount, status, phone, address, created_at)
+    SELECT id, user_id, total_amount, status, phone, address, created_at
+    FROM orders WHERE id IN (SELECT value FROM json_each(?))
+''', hot=False)
+ARCHIVE_ORDER_ITEMS = query('archive_order_items', '''
+    INSERT INTO order_items_archive (id, order_id, product_id, quantity, price)
+    SELECT id, order_id, product_id, quantity, price
+    FROM order_items WHERE order_id IN (SELECT value FROM json_each(?))
+''', hot=False)
+DELETE_ARCHIVED_ITEMS = query(
+    'delete_archived_items',
+    'DELETE FROM order_items WHERE order_id IN (SELECT value FROM json_each(?))',
+    hot=False
+)
+# Триггер статистики не вычитает заказ, который уже лежит в orders_archive
+DELETE_ARCHIVED_ORDERS = query(
+    'delete_archived_orders',
+    'DELETE FROM orders WHERE id IN (SELECT value FROM json_each(?))',
+    hot=False
+)
+
+# СТАТИСТИКА
+# Счетчики читаются из shop_stats, которую поддерживают триггеры
+GET_STAT = query(
+    'get_stat',
+    'SELECT value FROM shop_stats WHERE key = ?'
+)
+# В shop_stats — десяток счетчиков; дни читаются с конца первичного ключа до LIMIT
+GET_STATS = query(
+    'get_stats',
+    'SELECT key, value FROM shop_stats',
+    scans=('shop_stats',)
+)
+GET_DAILY_REVENUE = query(
+    'get_daily_revenue',
+    'SELECT day, orders, revenue FROM shop_daily_revenue ORDER BY day DESC LIMIT ?',
+    scans=('shop_daily_revenue',)
+)
+
+# FSM
+GET_FSM_RECORD = query(
+    'get_fsm_record',
+    'SELECT state, data FROM fsm_state WHERE bot_id = ? AND chat_id = ? AND user_id = ?'
+)
+DELETE_FSM_RECORD = query(
+    'delete_fsm_record',
+    'DELETE FROM fsm_state WHERE bot_id = ? AND chat_id = ? AND user_id = ?'
+)
+SET_FSM_RECORD = query('set_fsm_record', '''
+    INSERT INTO fsm_state (bot_id, chat_id, user_id, state, data, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bot_id, chat_id, user_id) DO UPDATE SET
+        state = excluded.state,
+        data = excluded.data,
+        updated_at = excluded.updated_at
+''')
+DELETE_STALE_FSM = query(
+    'delete_stale_fsm',
+    'DELETE FROM fsm_state WHERE updated_at < ?'
+)
+
+# РАССЫЛКИ
+CREATE_BROADCAST = query('create_broadcast', '''
+    INSERT INTO broadcasts (admin_chat_id, text, total)
+    VALUES (?, ?, (SELECT COUNT(*) FROM users WHERE blocked_at IS NULL))
+    RETURNING id, total
+''', hot=False)
+SET_BROADCAST_MESSAGE = query(
+    'set_broadcast_message',
+    'UPDATE broadcasts SET progress_message_id = ? WHERE id = ?'
+)
+GET_BROADCAST = query(
+    'get_broadcast',
+    'SELECT id, admin_chat_id, progress_message_id, text, status, total FROM broadcasts WHERE id = ?'
+)
+GET_RUNNING_BROADCASTS = query(
+    'get_running_broadcasts',
+    "SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id",
+    hot=False
+)
+SET_BROADCAST_STATUS = query('set_broadcast_status', '''
+    UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP
+    WHERE id = ? AND status = 'running'
+''')
+# Следующие получатели после users.id, которым рассылка еще не уходила
+CLAIM_RECIPIENTS = query('claim_recipients', '''
+    SELECT id, user_id FROM users
+    WHERE id > ? AND blocked_at IS NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM broadcast_deliveries
+          WHERE broadcast_id = ? AND user_id = users.user_id
+      )
+    ORDER BY id
+    LIMIT ?
+''')
+ADD_PENDING_DELIVERY = query(
+    'add_pending_delivery',
+    "INSERT INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, 'pending')"
+)
+SET_DELIVERY_STATUS = query(
+    'set_delivery_status',
+    'UPDATE broadcast_deliveries SET status = ? WHERE broadcast_id = ? AND user_id = ?'
+)
+BLOCK_USER = query(
+    'block_user',
+    'UPDATE users SET blocked_at = CURRENT_TIMESTAMP WHERE user_id = ?'
+)
+RESET_PENDING_DELIVERIES = query(
+    'reset_pending_deliveries',
+    "DELETE FROM broadcast_deliveries WHERE broadcast_id = ? AND status = 'pending'"
+)
+# Статусов четыре: группировка во временном дереве дешевле отдельного индекса
+GET_BROADCAST_COUNTS = query(
+    'get_broadcast_counts',
+    'SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status',
+    scans=('TEMP B-TREE',)
+)
+IS_USER_BLOCKED = query(
+    'is_user_blocked',
+    'SELECT 1 FROM users WHERE user_id = ? AND blocked_at IS NOT NULL'
+)
+UNBLOCK_USER = query(
+    'unblock_user',
+    'UPDATE users SET blocked_at = NULL WHERE user_id = ? AND blocked_at IS NOT NULL'
+)
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+import database as db
+import lifecycle
+import metrics
+from config import (
+    BOT_MODE,
+    METRICS_HOST,
+    METRICS_PORT,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBAPP_SHUTDOWN_TIMEOUT,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WORKER_HEALTH_TIMEOUT,
+    WORKER_HEARTBEAT_INTERVAL,
+    WORKER_MAX_IN_FLIGHT,
+    WORKER_START_TIMEOUT,
+    WORKER_STOP_TIMEOUT
+)
+from webhook import wait_for_stop_signal
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: dict):
+    """Автор обновления по сырому JSON, без разбора в модели aiogram."""
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+# ВОРКЕР
+async def _feed(dp, bot, update, previous):
+    # Следующее обновление пользователя ждет предыдущее, даже если оно упало
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        result = await dp.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot, result)
+    except Exception:
+        logger.exception('Ошибка при обработке обновления %s', update.get('update_id'))
+
+
+async def _heartbeat(index, heartbeats):
+    while True:
+        heartbeats[index] = time.time()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+def _bot_module():
+    # spawn уже выполнил main.py в воркере как __mp_main__: повторный import
+    # создал бы второй Bot, Dispatcher и RequestScheduler
+    module = sys.modules.get('__mp_main__')
+    path = getattr(module, '__file__', None)
+    if path and Path(path).resolve() == Path(__file__).with_name('main.py').resolve():
+        sys.modules.setdefault('main', module)
+    import main
+    return main
+
+
+async def _worker(index, updates, heartbeats, processed, session):
+    main = _bot_module()
+    if session is not None:
+        main.bot.session = session
+    dp, bot = main.dp, main.bot
+
+    await db.init_db()
+    # Каталог меняют и другие воркеры: их записи доходят через базу
+    await db.track_catalog_changes()
+    main.setup_fsm_storage()
+    lifecycle.start_prewarm()
+    await dp.emit_startup(bot=bot)
+    # У каждого воркера свои метрики — на своем порту
+    metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT + index) if METRICS_PORT else None
+    if index == 0:
+        # Прерванные рассылки продолжает и заказы в архив переносит один воркер
+        await main.broadcast.resume(bot)
+        main.archive.start()
+    beat = asyncio.create_task(_heartbeat(index, heartbeats))
+
+    loop = asyncio.get_running_loop()
+    tails = {}
+    # Пока разбирается WORKER_MAX_IN_FLIGHT обновлений, новые не читаются
+    # из канала и копятся у супервизора, а не задачами в памяти воркера
+    slots = asyncio.Semaphore(WORKER_MAX_IN_FLIGHT)
+
+    def done(user_id, task):
+        processed[index] += 1
+        slots.release()
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    while True:
+        await slots.acquire()
+        update = await loop.run_in_executor(None, updates.recv)
+        if update is None:
+            break
+        user_id = update_user_id(update)
+        task = asyncio.create_task(_feed(dp, bot, update, tails.get(user_id)))
+        tails[user_id] = task
+        task.add_done_callback(lambda task, user_id=user_id: done(user_id, task))
+
+    await asyncio.gather(*tails.values())
+    beat.cancel()
+    await dp.emit_shutdown(bot=bot)
+    await lifecycle.shutdown(bot, main.cart_writes)
+    if metrics_server:
+        await metrics_server.cleanup()
+
+
+def worker_main(index, updates, heartbeats, processed, worker_init=None):
+    # Ctrl+C получает вся группа процессов; останавливает воркеры супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    session = worker_init() if worker_init else None
+    asyncio.run(_worker(index, updates, heartbeats, processed, session))
+
+
+# СУПЕРВИЗОР
+class _Channel:
+    """Очередь обновлений к одному воркеру.
+
+    Pipe без межпроцессного замка: у multiprocessing.Queue читатель держит
+    замок, пока ждет, и убитый воркер оставил бы его занятым навсегда.
+    Пишет в Pipe отдельный поток, поэтому put() не блокирует цикл событий,
+    даже если воркер отстает. Перезапущенный воркер читает тот же Pipe.
+    """
+
+    def __init__(self, ctx):
+        self.reader, self._writer = ctx.Pipe(duplex=False)
+        self._pending = queue.Queue()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def put(self, update):
+        self._pending.put(update)
+
+    def pending(self):
+        return self._pending.qsize()
+
+    def _send_loop(self):
+        while True:
+            update = self._pending.get()
+            self._writer.send(update)
+            if update is None:
+                return
+
+
+class Supervisor:
+    """Держит N процессов-воркеров и раздает им обновления.
+
+    Воркер выбирается по id пользователя, так что все обновления одного
+    пользователя разбирает один процесс строго по очереди, а разные
+    пользователи обрабатываются параллельно на разных ядрах. Упавший или
+    переставший отмечаться воркер перезапускается; его очередь сохраняется.
+
+    worker_init вызывается в воркере до импорта бота и может вернуть
+    сессию Bot API вместо настоящей (для замеров).
+    """
+
+    def __init__(self, workers: int, worker_init=None):
+        self.workers = workers
+        self.worker_init = worker_init
+        self.restarts = 0
+        self._ctx = multiprocessing.get_context('spawn')
+        self._channels = [_Channel(self._ctx) for _ in range(workers)]
+        self._heartbeats = self._ctx.Array('d', workers, lock=False)
+        self._processed = self._ctx.Array('q', workers, lock=False)
+        self._processes = [None] * workers
+        self._spawned = [0.0] * workers
+
+    def _spawn(self, index):
+        self._heartbeats[index] = 0
+        self._spawned[index] = time.time()
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self._channels[index].reader, self._heartbeats, self._processed, self.worker_init),
+            name=f'shop-worker-{index}'
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    async def wait_ready(self, timeout: float = WORKER_START_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not all(self._heartbeats):
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    raise RuntimeError(f'Воркер {index} упал при запуске, код {process.exitcode}')
+            if time.monotonic() > deadline:
+                raise TimeoutError('Воркеры не запустились')
+            await asyncio.sleep(0.05)
+
+    def route(self, update: dict):
+        self._channels[update_user_id(update) % self.workers].put(update)
+
+    def check(self):
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            beat = self._heartbeats[index]
+            if not process.is_alive():
+                logger.warning('Воркер %s завершился с кодом %s, перезапуск', index, process.exitcode)
+            elif beat and now - beat > WORKER_HEALTH_TIMEOUT:
+                logger.warning('Воркер %s не отвечает %.0f с, перезапуск', index, now - beat)
+            elif not beat and now - self._spawned[index] > WORKER_START_TIMEOUT:
+                # Завис при запуске (например, в init_db) до первой отметки
+                logger.warning('Воркер %s не запустился за %.0f с, перезапуск', index, now - self._spawned[index])
+            else:
+                continue
+            if process.is_alive():
+                process.kill()
+                process.join()
+            self.restarts += 1
+            self._spawn(index)
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+            self.check()
+
+    async def stop(self, timeout: float = WORKER_STOP_TIMEOUT):
+        """Дает воркерам разобрать очереди и ждет их не дольше timeout."""
+        for channel in self._channels:
+            channel.put(None)
+
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, max(0, deadline - time.monotonic()))
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                logger.warning('Воркер %s не успел остановиться', index)
+                process.terminate()
+                process.join()
+
+        # Неотправленные обновления остались только у зависших воркеров
+        lost = sum(max(0, channel.pending() - 1) for channel in self._channels)
+
+        processed = sum(self._processed)
+        logger.info(
+            'Воркеры остановлены: обработано %s, потеряно %s, перезапусков %s, коды выхода %s',
+            processed, lost, self.restarts, [process.exitcode for process in self._processes]
+        )
+        return processed
+
+
+# ПРИЕМ ОБНОВЛЕНИЙ
+async def _poll(supervisor, bot, allowed_updates):
+    # Пока висит webhook, getUpdates отвечает конфликтом — снимаем его, как
+    # start_polling в aiogram (накопленные обновления остаются)
+    await bot.delete_webhook(drop_pending_updates=False)
+    # getUpdates без разбора в модели aiogram: воркеру уходит сырой JSON
+    url = f'https://api.telegram.org/bot{bot.token}/getUpdates'
+    offset = 0
+    timeout = aiohttp.ClientTimeout(total=40)
+    async with aiohttp.ClientSession(timeout=timeout) as http:
+        while True:
+            params = {'offset': offset, 'timeout': 30, 'allowed_updates': allowed_updates}
+            try:
+                async with http.post(url, json=params) as response:
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                logger.warning('getUpdates: %r', error)
+                await asyncio.sleep(1)
+                continue
+
+            if not payload.get('ok'):
+                logger.warning('getUpdates: %s', payload.get('description'))
+                await asyncio.sleep(payload.get('parameters', {}).get('retry_after', 1))
+                continue
+
+            for update in payload['result']:
+                supervisor.route(update)
+                offset = update['update_id'] + 1
+
+
+async def _serve_webhook(supervisor, bot, allowed_updates):
+    async def handle(request):
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(body='Unauthorized', status=401)
+        supervisor.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app, shutdown_timeout=WEBAPP_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=allowed_updates
+    )
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
+
+
+async def run_supervisor(workers: int, bot, allowed_updates):
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    await supervisor.wait_ready()
+
+    serve = _serve_webhook if BOT_MODE == 'webhook' else _poll
+    ingress = asyncio.create_task(serve(supervisor, bot, allowed_updates))
+    monitor = asyncio.create_task(supervisor.monitor())
+    stop = asyncio.create_task(wait_for_stop_signal())
+    try:
+        await asyncio.wait([ingress, stop], return_when=asyncio.FIRST_COMPLETED)
+        if ingress.done() and ingress.exception():
+            logger.error('Прием обновлений остановился', exc_info=ingress.exception())
+    finally:
+        for task in (ingress, monitor, stop):
+            task.cancel()
+        await asyncio.gather(ingress, monitor, stop, return_exceptions=True)
+        await supervisor.stop()
+        await bot.session.close()
@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    TG_CHAT_BURST,
+    TG_CHAT_RATE,
+    TG_GLOBAL_BURST,
+    TG_GLOBAL_RATE,
+    TG_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше — раньше
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+LANES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BULK: 'bulk'}
+
+# Ответы на нажатия и inline-запросы: пользователь ждет их прямо сейчас
+INTERACTIVE_METHODS = {'answerCallbackQuery', 'answerInlineQuery'}
+
+_lane = ContextVar('outbound_lane', default=NORMAL)
+
+
+@contextmanager
+def bulk():
+    """Запросы внутри блока идут в самую низкую полосу (рассылки, уведомления)."""
+    token = _lane.set(BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Берет токен; если его нет — возвращает, сколько секунд ждать."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class RequestScheduler(BaseRequestMiddleware):
+    """Исходящие запросы к Bot API через общий и початовые лимиты.
+
+    Сначала запрос ждет токен своего чата (по очереди внутри чата), затем
+    общий токен. Общие токены раздаются по полосам: ответы на нажатия
+    раньше обычных ответов, рассылки (bulk()) — в последнюю очередь.
+    TelegramRetryAfter останавливает выдачу токенов на retry_after секунд,
+    после чего запрос повторяется. Служебные запросы (getUpdates,
+    setWebhook, ...) идут мимо очереди.
+    """
+
+    def __init__(self, rate: float = TG_GLOBAL_RATE, burst: float = TG_GLOBAL_BURST,
+                 chat_rate: float = TG_CHAT_RATE, chat_burst: float = TG_CHAT_BURST,
+                 max_retries: int = TG_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, burst)
+        self._chats = {}
+        self._chat_locks = {}
+        self._waiters = []
+        self._order = itertools.count()
+        self._releaser = None
+        self._paused_until = 0.0
+        # Метрики
+        self.depth = dict.fromkeys(LANES, 0)
+        self.waited = dict.fromkeys(LANES, 0.0)
+        self.max_wait = dict.fromkeys(LANES, 0.0)
+        self.requests = dict.fromkeys(LANES, 0)
+        self.retry_after = 0
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        chat_id = getattr(method, 'chat_id', None)
+        if name in INTERACTIVE_METHODS:
+            lane = INTERACTIVE
+        elif chat_id is None:
+            return await make_request(bot, method)
+        else:
+            lane = _lane.get()
+
+        for attempt in itertools.count():
+            await self._acquire(lane, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                self.retry_after += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + error.retry_after)
+                logger.warning('%s: flood control, пауза %s с', name, error.retry_after)
+                if attempt >= self.max_retries:
+                    raise
+
+    # ОЧЕРЕДЬ
+    async def _acquire(self, lane, chat_id):
+        started = time.monotonic()
+        self.depth[lane] += 1
+        try:
+            if chat_id is not None:
+                await self._acquire_chat(chat_id)
+            await self._acquire_global(lane)
+        finally:
+            self.depth[lane] -= 1
+        waited = time.monotonic() - started
+        self.requests[lane] += 1
+        self.waited[lane] += waited
+        self.max_wait[lane] = max(self.max_wait[lane], waited)
+
+    async def _acquire_chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._forget_idle_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_locks[chat_id] = asyncio.Lock()
+        async with self._chat_locks[chat_id]:
+            while wait := bucket.take():
+                await asyncio.sleep(wait)
+
+    def _forget_idle_chats(self):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.full]:
+            if not self._chat_locks[chat_id].locked():
+                del self._chats[chat_id], self._chat_locks[chat_id]
+
+    async def _acquire_global(self, lane):
+        if not self._waiters and time.monotonic() >= self._paused_until and not self._bucket.take():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._order), waiter))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.create_task(self._release())
+        await waiter
+
+    async def _release(self):
+        # Один раздающий токены по приоритету, пока есть ожидающие
+        while self._waiters:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = self._bucket.take()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+            else:
+                # Все ожидавшие отменились — токен возвращается
+                self._bucket.tokens += 1
+
+    def stats(self):
+        return {
+            LANES[lane]: {
+                'queued': self.depth[lane],
+                'requests': self.requests[lane],
+                'avg_wait': self.waited[lane] / self.requests[lane] if self.requests[lane] else 0.0,
+                'max_wait': self.max_wait[lane],
+            }
+            for lane in LANES
+        } | {'retry_after': self.retry_after}
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import signal
+
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import (
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBAPP_SHUTDOWN_TIMEOUT,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def wait_for_stop_signal():
+    """Ждет SIGINT или SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = (signal.SIGINT, signal.SIGTERM)
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+    finally:
+        for sig in signals:
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+
+
+def build_app(dp, bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+    """aiohttp-приложение, которое принимает обновления Telegram на path.
+
+    Каждый запрос aiohttp обрабатывает в своей задаче, поэтому обновления
+    идут параллельно (до WEBHOOK_MAX_CONNECTIONS одновременно). Запросы без
+    верного секрета получают 401. Метод, который вернул обработчик
+    (return message.answer(...)), уходит прямо в теле ответа на webhook —
+    без отдельного запроса к Bot API.
+
+    Хуков on_shutdown нет (ни setup_application, ни handler.register):
+    aiohttp вызывает их до того, как дождется начатых запросов, а сессию
+    Bot API закрывает lifecycle.shutdown уже после них.
+    """
+    app = web.Application()
+    handler = SimpleRequestHandler(dp, bot, handle_in_background=False, secret_token=secret)
+    app.router.add_post(path, handler.handle)
+    return app
+
+
+async def run_webhook(dp, bot, host: str = WEBAPP_HOST, port: int = WEBAPP_PORT):
+    app = build_app(dp, bot)
+    runner = web.AppRunner(app, shutdown_timeout=WEBAPP_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    await dp.emit_startup(bot=bot)
+    await web.TCPSite(runner, host, port).start()
+
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info('Webhook слушает %s:%s%s', host, port, WEBHOOK_PATH)
+
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # Новые запросы больше не принимаются, начатые дорабатывают
+        # не дольше WEBAPP_SHUTDOWN_TIMEOUT секунд. Webhook не снимаем:
+        # Telegram придержит обновления до следующего запуска.
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        logger.info('Webhook остановлен')